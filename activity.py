@@ -0,0 +1,112 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from database import db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Activity writer settings
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "15"))
+ACTIVITY_BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "1000"))
+
+
+class ActivityWriter:
+    """Coalesces user activity touches and writes them as batched upserts
+
+    touch() only updates an in-memory dict keyed by user_id, so a user who
+    taps /start ten times between flushes costs one row. Every flush_interval
+    seconds (or as soon as batch_size distinct users are waiting) the buffer
+    is written with multi-row INSERT ... ON CONFLICT DO UPDATE statements of
+    at most batch_size rows.
+    """
+
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_INTERVAL, batch_size: int = ACTIVITY_BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending: Dict[int, Tuple[Optional[str], Optional[str], datetime]] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "touches": 0,
+            "flushes": 0,
+            "rows_written": 0,
+            "last_flush_rows": 0,
+            "failures": 0
+        }
+
+    def touch(self, user_id: int, username: Optional[str], first_name: Optional[str]) -> None:
+        """Record that a user was just active; the latest touch per user wins"""
+        self._pending[user_id] = (username, first_name, datetime.now())
+        self.stats["touches"] += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        """Distinct users waiting to be written"""
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """Write the buffered touches; returns the number of rows written"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            pending, self._pending = self._pending, {}
+            rows = [
+                (user_id, username, first_name, last_active)
+                for user_id, (username, first_name, last_active) in pending.items()
+            ]
+
+            written = await db.upsert_user_activity(rows, self.batch_size)
+            if written is None:
+                # Keep the failed touches unless the user has been touched again since
+                for user_id, touch in pending.items():
+                    self._pending.setdefault(user_id, touch)
+                self.stats["failures"] += 1
+                return 0
+
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += written
+            self.stats["last_flush_rows"] = written
+            logger.debug(f"Activity flush wrote {written} rows")
+            return written
+
+    async def _run(self) -> None:
+        """Flush every flush_interval seconds, or early once batch_size users are waiting"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in activity flush loop: {e}")
+
+    def start(self) -> None:
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop the flush loop and write out the remaining touches"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logger.info(f"Activity writer closed: {self.stats}")
+
+
+# Create a global activity writer instance
+activity = ActivityWriter()
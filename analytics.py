@@ -0,0 +1,80 @@
+import logging
+from typing import Dict, Iterable, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _amount(value) -> float:
+    """Transaction amounts are carried around as strings; parse them once"""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Aggregates:
+    """Running revenue and conversion totals over the transaction history
+
+    record() is called every time a transaction is created or changes status.
+    It remembers what each transaction last contributed, so it can subtract
+    that and add the new contribution. The admin screens then read the
+    counters in constant time, however long the history is.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every counted transaction"""
+        # transaction_id -> (status, service, amount) as last counted
+        self._counted: Dict[str, Tuple[str, str, float]] = {}
+        self.total = 0
+        self.count_by_status: Dict[str, int] = {}
+        self.revenue_by_status: Dict[str, float] = {}
+        self.count_by_service: Dict[str, int] = {}
+
+    def _apply(self, status: str, service: str, amount: float, sign: int) -> None:
+        self.total += sign
+        self.count_by_status[status] = self.count_by_status.get(status, 0) + sign
+        self.revenue_by_status[status] = self.revenue_by_status.get(status, 0.0) + sign * amount
+        self.count_by_service[service] = self.count_by_service.get(service, 0) + sign
+
+    def record(self, transaction: Dict) -> None:
+        """Count a new transaction, or move an existing one to its current status"""
+        transaction_id = transaction.get("transaction_id")
+        current = (
+            transaction.get("status") or "unknown",
+            transaction.get("service") or "unknown",
+            _amount(transaction.get("amount"))
+        )
+        previous = self._counted.get(transaction_id)
+        if previous == current:
+            return
+        if previous is not None:
+            self._apply(*previous, -1)
+        self._apply(*current, 1)
+        self._counted[transaction_id] = current
+
+    def load(self, transactions: Iterable[Dict]) -> None:
+        """Rebuild every counter from the full history; done once at startup"""
+        self.reset()
+        for transaction in transactions:
+            self.record(transaction)
+        logger.info(f"Aggregates built from {self.total} transactions")
+
+    def revenue(self, status: str) -> float:
+        return round(self.revenue_by_status.get(status, 0.0), 2)
+
+    def count(self, status: str) -> int:
+        return self.count_by_status.get(status, 0)
+
+    def popular_services(self) -> Iterable[Tuple[str, int]]:
+        """Services by number of orders, most popular first"""
+        return sorted(
+            ((service, count) for service, count in self.count_by_service.items() if count > 0),
+            key=lambda item: item[1], reverse=True)
+
+
+# Create a global aggregates instance
+aggregates = Aggregates()
@@ -0,0 +1,80 @@
+"""Compare the memory held by dict-based and slotted order records
+
+Usage: python benchmark_memory.py [number of users]
+
+Builds the same users, purchases, transactions and pending payments once
+as plain dicts (the old in-memory layout) and once as the records in
+models.py, and reports the bytes allocated for each with tracemalloc.
+"""
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+from models import PendingPayment, Purchase, Transaction, User
+
+# Orders per user in the generated data
+ORDERS_PER_USER = 3
+
+
+def _rows(users: int):
+    """Field values for every user and order, shared by both layouts"""
+    now = datetime.now()
+    for user_id in range(users):
+        user = {"username": f"user{user_id}", "joined_date": now.isoformat(), "language": "en",
+                "active_promos": []}
+        orders = []
+        for n in range(ORDERS_PER_USER):
+            transaction_id = f"TRX{now.strftime('%Y%m%d%H%M%S')}{user_id}{n}"
+            price = str(10 + n * 5)
+            orders.append((
+                {"purchase_id": f"PUR{user_id}{n}", "service": "group", "group_name": "Premium",
+                 "price": price, "original_price": price, "date": now.isoformat(), "status": "completed",
+                 "renewal_reminder_sent": False, "final_reminder_sent": False, "auto_renew": False,
+                 "transaction_id": transaction_id},
+                {"transaction_id": transaction_id, "user_id": user_id, "username": user["username"],
+                 "service": "group", "amount": price, "payment_method": "upi", "payment_type": "indian",
+                 "status": "completed", "created_at": now.isoformat()},
+                {"user_id": user_id, "service_type": "group", "price": price,
+                 "timestamp": now - timedelta(minutes=n), "reminder_1_sent": False, "reminder_2_sent": False,
+                 "reminder_3_sent": False, "payment_confirmed": False, "status": "pending",
+                 "next_action_at": now + timedelta(minutes=30)}
+            ))
+        yield user_id, user, orders
+
+
+def build(users: int, slotted: bool):
+    """Build the four stores in one layout"""
+    user_database, transactions, pending = {}, [], {}
+    for user_id, user, orders in _rows(users):
+        record = User(user, purchases=[]) if slotted else dict(user, purchases=[])
+        for purchase, transaction, payment in orders:
+            record["purchases"].append(Purchase(purchase) if slotted else dict(purchase))
+            transactions.append(Transaction(transaction) if slotted else dict(transaction))
+            pending[transaction["transaction_id"]] = PendingPayment(payment) if slotted else dict(payment)
+        user_database[user_id] = record
+    return user_database, transactions, pending
+
+
+def measure(users: int, slotted: bool) -> int:
+    """Bytes still allocated after building the stores"""
+    tracemalloc.start()
+    stores = build(users, slotted)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del stores
+    return size
+
+
+def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    orders = users * ORDERS_PER_USER
+    dicts = measure(users, slotted=False)
+    records = measure(users, slotted=True)
+    print(f"{users} users, {orders} orders")
+    print(f"dicts:   {dicts / 2**20:8.1f} MiB ({dicts / orders:.0f} bytes per order)")
+    print(f"records: {records / 2**20:8.1f} MiB ({records / orders:.0f} bytes per order)")
+    print(f"saved:   {(dicts - records) / dicts:8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import os
 import json
 import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Tuple, Union
 import random
 import string
 
@@ -11,7 +11,6 @@ from aiogram import Bot, Dispatcher, F, types
 from aiogram.enums import ParseMode
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, CallbackQuery
@@ -19,6 +18,26 @@ from aiogram import Router
 from aiogram.filters import CommandStart, Command
 from aiogram.client.default import DefaultBotProperties
 
+import coldstart
+import webhook
+from activity import activity
+from analytics import aggregates
+from broadcast import broadcaster
+from catalog import catalog
+from fsm_storage import storage
+from database import db
+from persistence import store
+from keyboards import PAYMENT_METHODS, create_back_button, keyboards
+from ledger import ledger
+from middlewares import BROWSING, CHECKOUT, PAYMENT, admission, mailboxes
+from models import PendingPayment, Purchase, Status, Transaction, User
+from outbox import BACKGROUND, OutboxMiddleware, outbox
+from callbacks import Callback, callbacks
+from ratelimit import TELEGRAM_RATE_LIMIT
+from texts import texts
+from reminders import EXPIRE, RENEW, payment_reminders, subscription_reminders
+from scheduler import scheduler
+
 # Environment variable for API token (more secure than hardcoding)
 API_TOKEN = os.getenv("TELEGRAM_API_TOKEN", "YOUR_API_TOKEN_HERE")
 
@@ -29,19 +48,21 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
-# Initialize bot and dispatcher
-bot = Bot(token=API_TOKEN,
-          default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# Bot and dispatcher are created by startup() rather than at import time, so
+# importing this module needs neither a network connection nor a database
+bot: Optional[Bot] = None
+dp: Optional[Dispatcher] = None
 
-# Create and configure router
+# Create and configure router; every handler below registers on it
 router = Router()
-dp.include_router(router)
 
 # Admin user IDs for accessing admin features
 ADMIN_IDS = [6189058729]  # Replace with actual admin Telegram IDs
 
+# Seconds between runs of the periodic background jobs
+PENDING_PAYMENTS_INTERVAL = 60
+SUBSCRIPTION_RENEWALS_INTERVAL = 3600
+
 # Payment methods and details
 details_map = {
     # International Payment Methods
@@ -71,123 +92,21 @@ details_map = {
     "To pay via cryptocurrency, please contact @YG_JOIN\nMention your selected plan and write \"CRYPTO\"."
 }
 
-# Service options and pricing
-service_options = {
-    "video_call": {
-        "durations": [{
-            "name": "15 min",
-            "price": 10
-        }, {
-            "name": "30 min",
-            "price": 15
-        }, {
-            "name": "60 min",
-            "price": 25
-        }]
-    },
-    "group": {
-        "names": ["Exclusive", "Ankita's Den"],
-        "durations": [{
-            "name": "2 Months",
-            "price": 20
-        }, {
-            "name": "6 Months",
-            "price": 50
-        }, {
-            "name": "12 Months",
-            "price": 90
-        }]
-    },
-    "private_chat": {
-        "durations": [{
-            "name": "2 Hr",
-            "price": 20
-        }, {
-            "name": "4 Hr",
-            "price": 35
-        }],
-        "types": [{
-            "name": "Sx Chat with Notes",
-            "price": 60
-        }, {
-            "name": "Normal Chat",
-            "price": 35
-        }]
-    },
-    "album": [{
-        "name": "Node Pic Full Collection (300+)",
-        "price": 30
-    }, {
-        "name": "Node Pic + Vid Full Collection (800+)",
-        "price": 60
-    }, {
-        "name": "My Exclusive Bj Vids (50 Vids)",
-        "price": 50
-    }, {
-        "name": "Master Album (All-in-One)",
-        "price": 90
-    }]
-}
-
-# Database simulation (in a real application, use a proper database)
-user_database = {}
-transaction_history = []
-pending_payments = {}  # To track abandoned payments
-scheduled_tasks = {}   # To track scheduled tasks
-promo_codes = {
-    # Example: "WELCOME10": {"discount": 10, "type": "percentage", "expires": "2024-12-31", "uses": 0, "max_uses": 100}
-}
-bundle_packages = [
-    {
-        "id": "bundle1",
-        "name": "Starter Bundle",
-        "description": "1 Month Group + 1 Album",
-        "items": [
-            {"service": "group", "duration": "2 Months", "group_name": "Exclusive"},
-            {"service": "album", "name": "Node Pic Full Collection (300+)"}
-        ],
-        "original_price": 50,
-        "bundle_price": 40,
-        "discount_percentage": 20
-    },
-    {
-        "id": "bundle2",
-        "name": "Premium Bundle",
-        "description": "6 Months Group + Master Album",
-        "items": [
-            {"service": "group", "duration": "6 Months", "group_name": "Ankita's Den"},
-            {"service": "album", "name": "Master Album (All-in-One)"}
-        ],
-        "original_price": 140,
-        "bundle_price": 110,
-        "discount_percentage": 21
-    }
-]
-limited_time_offers = [
-    # Example: {"id": "summer_sale", "name": "Summer Sale", "discount": 15, "type": "percentage", "expires": "2024-08-31"}
-]
+# In-memory stores; persistence.store loads them from PostgreSQL at startup and
+# writes changes back in batches, so call the matching store.mark_* after a mutation
+user_database = store.users
+transaction_history = store.transactions
+pending_payments = store.pending_payments  # To track abandoned payments
+scheduled_tasks = store.scheduled_tasks   # To track scheduled tasks
+promo_codes = store.promo_codes
+# Example: "WELCOME10": {"discount": 10, "type": "percentage", "expires": "2024-12-31", "uses": 0, "max_uses": 100}
+# Service options, bundles and limited-time offers are served from catalog.catalog
 supported_languages = {
     "en": "English",
     "hi": "Hindi",
     "es": "Spanish"
 }
-translations = {
-    "en": {
-        "welcome": "Welcome to our service bot! Choose an option below:",
-        "payment_success": "Your payment was successful!",
-        "payment_pending": "Your payment is pending verification."
-    },
-    "hi": {
-        "welcome": "हमारे सेवा बॉट में आपका स्वागत है! नीचे एक विकल्प चुनें:",
-        "payment_success": "आपका भुगतान सफल रहा!",
-        "payment_pending": "आपका भुगतान सत्यापन के लिए लंबित है।"
-    },
-    "es": {
-        "welcome": "¡Bienvenido a nuestro bot de servicio! Elija una opción a continuación:",
-        "payment_success": "¡Su pago fue exitoso!",
-        "payment_pending": "Su pago está pendiente de verificación."
-    }
-}
+# Message templates for each language live in texts.py
 
 
 class Form(StatesGroup):
@@ -213,51 +132,32 @@ class Form(StatesGroup):
     admin_bundle_create = State()
 
 
-# Helper function to create a back button
-def create_back_button(builder: InlineKeyboardBuilder) -> None:
-    builder.button(text="« Back to Main Menu", callback_data="back_to_main")
+# Helper function to look up a user's language
+def get_user_language(user_id: Optional[int]) -> str:
+    """The user's preferred language, English by default"""
+    return user_database.get(user_id, {}).get("language") or "en"
+
+
+# Helper function to record a purchase in the user's history
+def record_purchase(user_id: int, purchase_data: Dict[str, Any]) -> Purchase:
+    """Store the purchase as a record with a purchase ID, append it and queue it for persistence"""
+    purchase = Purchase(purchase_data, purchase_id=f"PUR{datetime.now().strftime('%Y%m%d%H%M%S%f')}{user_id}")
+    user_database[user_id]["purchases"].append(purchase)
+    store.mark_purchase(user_id, purchase)
+    return purchase
 
 
-# Helper function to generate main menu
 async def show_main_menu(message: types.Message) -> None:
     user_id = message.from_user.id if hasattr(message, 'from_user') else None
-    user_language = "en"  # Default language
-    
-    # Get user's preferred language if available
-    if user_id and user_id in user_database and "language" in user_database[user_id]:
-        user_language = user_database[user_id]["language"]
-    
-    kb = InlineKeyboardBuilder()
-    kb.button(text="📞 Video Call", callback_data="video_call")
-    kb.button(text="👥 Join Group", callback_data="group")
-    kb.button(text="💬 Private Chat", callback_data="private_chat")
-    kb.button(text="📸 Album", callback_data="album")
-    kb.button(text="📦 Bundle Packages", callback_data="bundles")
-    kb.button(text="🎁 Enter Promo Code", callback_data="enter_promo")
-    kb.button(text="📝 Leave Feedback", callback_data="feedback")
-    kb.button(text="❓ Help", callback_data="help")
-    kb.button(text="🌐 Change Language", callback_data="change_language")
-    kb.adjust(1)
+    user_language = get_user_language(user_id)
 
-    # Check if there are any active limited-time offers to display
-    current_time = datetime.now()
-    active_offers = [
-        offer for offer in limited_time_offers 
-        if datetime.fromisoformat(offer["expires"]) > current_time
-    ]
+    # Append any active limited-time offers; the banner is rendered once per catalog version
+    welcome_text = texts.render("welcome", user_language) + texts.offer_banner(await catalog.get(), user_language)
     
-    welcome_text = translations[user_language].get("welcome", "Choose an option below:")
-    
-    if active_offers:
-        offer_text = "\n\n🔥 <b>Limited Time Offers:</b>\n"
-        for offer in active_offers:
-            offer_text += f"• {offer['name']}: {offer['discount']}% off! Ends {offer['expires'].split('T')[0]}\n"
-        welcome_text += offer_text
-    
-    await message.answer(welcome_text, reply_markup=kb.as_markup())
+    await message.answer(welcome_text, reply_markup=await keyboards.get("main_menu", user_language))
 
 
-@dp.message(CommandStart())
+@router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext) -> None:
     """Handle the /start command"""
     user_id = message.from_user.id
@@ -265,18 +165,22 @@ async def cmd_start(message: Message, state: FSMContext) -> None:
 
     # Store user info
     if user_id not in user_database:
-        user_database[user_id] = {
-            "username": user_name,
-            "joined_date": datetime.now().isoformat(),
-            "purchases": []
-        }
+        user_database[user_id] = User(
+            username=user_name,
+            joined_date=datetime.now().isoformat(),
+            purchases=[]
+        )
+        store.mark_user(user_id)
         logger.info(f"New user registered: {user_id} ({user_name})")
 
+    # Refresh last_active; coalesced and written in batches by the activity writer
+    activity.touch(user_id, message.from_user.username, message.from_user.first_name)
+
     await state.clear()
     await show_main_menu(message)
 
 
-@dp.message(Command("help"))
+@router.message(Command("help"))
 async def cmd_help(message: Message) -> None:
     """Handle the /help command"""
     help_text = ("<b>Available Commands:</b>\n"
@@ -287,31 +191,19 @@ async def cmd_help(message: Message) -> None:
     await message.answer(help_text)
 
 
-@dp.message(Command("admin"))
+@router.message(Command("admin"))
 async def cmd_admin(message: Message) -> None:
     """Admin panel access"""
     user_id = message.from_user.id
     if user_id in ADMIN_IDS:
-        kb = InlineKeyboardBuilder()
-        kb.button(text="📊 User Statistics", callback_data="admin_stats")
-        kb.button(text="📣 Broadcast Message", callback_data="admin_broadcast")
-        kb.button(text="📅 Schedule Broadcast", callback_data="admin_schedule_broadcast")
-        kb.button(text="💰 Custom Price Quote", callback_data="admin_custom_price")
-        kb.button(text="🛠️ Manage Services", callback_data="admin_manage_services")
-        kb.button(text="💲 Manage Pricing", callback_data="admin_manage_pricing")
-        kb.button(text="🎁 Create Promo Code", callback_data="admin_create_promo")
-        kb.button(text="📦 Manage Bundles", callback_data="admin_manage_bundles")
-        kb.button(text="⏱️ Create Limited Offer", callback_data="admin_create_offer")
-        kb.button(text="📊 Advanced Analytics", callback_data="admin_advanced_analytics")
-        kb.adjust(1)
         await message.answer("<b>Admin Panel</b>\nWelcome to the admin panel.",
-                             reply_markup=kb.as_markup())
+                             reply_markup=await keyboards.get("admin_panel", get_user_language(user_id)))
     else:
         await message.answer(
             "You don't have permission to access this feature.")
 
 
-@dp.message(Command("cancel"))
+@router.message(Command("cancel"))
 async def cmd_cancel(message: Message, state: FSMContext) -> None:
     """Cancel the current operation and return to main menu"""
     current_state = await state.get_state()
@@ -321,7 +213,7 @@ async def cmd_cancel(message: Message, state: FSMContext) -> None:
     await show_main_menu(message)
 
 
-@dp.callback_query(F.data == "back_to_main")
+@callbacks.action("back_to_main")
 async def back_to_main(call: CallbackQuery, state: FSMContext) -> None:
     """Handle back to main menu button"""
     # Get transaction ID if available to track abandoned payment
@@ -338,27 +230,18 @@ async def back_to_main(call: CallbackQuery, state: FSMContext) -> None:
     await show_main_menu(call.message)
 
 
-@dp.callback_query(F.data == "video_call")
+@callbacks.action("video_call")
 async def video_call_handler(call: CallbackQuery, state: FSMContext) -> None:
     """Handle video call selection"""
     await state.set_state(Form.video_duration)
-    options = service_options["video_call"]["durations"]
-
-    kb = InlineKeyboardBuilder()
-    for option in options:
-        kb.button(text=f"{option['name']} - ${option['price']}",
-                  callback_data=f"price_{option['price']}")
-    create_back_button(kb)
-    kb.adjust(1)
 
     await call.message.edit_text("Select video call duration:",
-                                 reply_markup=kb.as_markup())
+                                 reply_markup=await keyboards.get("video_call", get_user_language(call.from_user.id)))
 
 
-@dp.callback_query(F.data.startswith("price_"))
-async def video_price_selected(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("price", ("price", str), legacy="price_{}", priority=CHECKOUT)
+async def video_price_selected(call: CallbackQuery, state: FSMContext, price: str) -> None:
     """Handle price selection"""
-    price = call.data.split("_")[1]
     original_price = float(price)
     
     # Get current service type from state
@@ -389,6 +272,7 @@ async def video_price_selected(call: CallbackQuery, state: FSMContext) -> None:
             
             # Remove the used promo
             user_database[user_id]["active_promos"].remove(promo)
+            store.mark_user(user_id)
     
     # Round to 2 decimal places
     final_price = round(final_price, 2)
@@ -408,44 +292,40 @@ async def video_price_selected(call: CallbackQuery, state: FSMContext) -> None:
             purchase_data["promo_code"] = applied_promo
             purchase_data["discount_amount"] = str(original_price - final_price)
         
-        user_database[user_id]["purchases"].append(purchase_data)
+        purchase = record_purchase(user_id, purchase_data)
+        await state.update_data(purchase_id=purchase["purchase_id"])
     
     # Generate transaction ID
     transaction_id = f"TRX{datetime.now().strftime('%Y%m%d%H%M%S')}{call.from_user.id}"
     await state.update_data(transaction_id=transaction_id)
     
     # Track this as a pending payment for reminder purposes
-    pending_payments[transaction_id] = {
-        "user_id": user_id,
-        "service_type": service_type,
-        "price": str(final_price),
-        "timestamp": datetime.now(),
-        "reminder_1_sent": False,
-        "reminder_2_sent": False,
-        "reminder_3_sent": False
-    }
+    pending_payments[transaction_id] = PendingPayment(
+        user_id=user_id,
+        service_type=service_type,
+        price=str(final_price),
+        timestamp=datetime.now(),
+        reminder_1_sent=False,
+        reminder_2_sent=False,
+        reminder_3_sent=False
+    )
+    store.mark_pending_payment(transaction_id)
+    payment_reminders.schedule(transaction_id)
     
     # Show payment type options with discount info if applicable
     if applied_promo:
-        kb = InlineKeyboardBuilder()
-        kb.button(text="🇮🇳 Indian Payment", callback_data="payment_type_indian")
-        kb.button(text="🌍 International Payment", callback_data="payment_type_international")
-        kb.button(text="💰 Crypto Payment", callback_data="payment_type_crypto")
-        create_back_button(kb)
-        kb.adjust(1)
-        
         discount_text = f"Original price: ${original_price}\nDiscount applied: ${original_price - final_price} (Promo: {applied_promo})\nFinal price: ${final_price}"
         
         await call.message.edit_text(
             f"<b>Discount Applied!</b>\n\n{discount_text}\n\nChoose your payment type:",
-            reply_markup=kb.as_markup()
+            reply_markup=await keyboards.get("payment_types", get_user_language(user_id))
         )
     else:
         # Standard payment flow
         await show_payment_types(call)
 
 
-@dp.callback_query(F.data == "group")
+@callbacks.action("group")
 async def group_handler(call: CallbackQuery, state: FSMContext) -> None:
     """Handle group selection"""
     # Clear previous state and set new state
@@ -453,46 +333,31 @@ async def group_handler(call: CallbackQuery, state: FSMContext) -> None:
     await state.set_state(Form.group_name)
     await state.update_data(service_type="group")
     
-    # Create keyboard with group options
-    kb = InlineKeyboardBuilder()
-    for name in service_options["group"]["names"]:
-        kb.button(text=name, callback_data=f"group_{name}")
-    create_back_button(kb)
-    kb.adjust(1)
-
     try:
-        await call.message.edit_text("Choose a group to join:", reply_markup=kb.as_markup())
+        await call.message.edit_text(
+            "Choose a group to join:",
+            reply_markup=await keyboards.get("group", get_user_language(call.from_user.id)))
     except Exception as e:
         logger.error(f"Error displaying group options: {e}")
 
 
-@dp.callback_query(F.data.startswith("group_") & ~F.data.startswith("group_duration_"))
-async def group_selected(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("group_name", ("group_name", str), legacy="group_{}", priority=CHECKOUT)
+async def group_selected(call: CallbackQuery, state: FSMContext, group_name: str) -> None:
     """Handle specific group selection"""
-    group_name = call.data.split("_")[1]
     await state.update_data(group_name=group_name, service_type="group")
     await state.set_state(Form.group_duration)
 
-    # Create keyboard with duration options
-    kb = InlineKeyboardBuilder()
-    for duration in service_options["group"]["durations"]:
-        kb.button(text=f"{duration['name']} - ${duration['price']}",
-                  callback_data=f"group_duration_{duration['price']}")
-    create_back_button(kb)
-    kb.adjust(1)
-
     try:
         await call.message.edit_text(
             f"<b>Selected Group:</b> {group_name}\n\nChoose your plan duration:",
-            reply_markup=kb.as_markup())
+            reply_markup=await keyboards.get("group_durations", get_user_language(call.from_user.id)))
     except Exception as e:
         logger.error(f"Error displaying group duration options: {e}")
 
 
-@dp.callback_query(F.data.startswith("group_duration_"))
-async def group_price_selected(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("group_duration", ("price", str), legacy="group_duration_{}", priority=CHECKOUT)
+async def group_price_selected(call: CallbackQuery, state: FSMContext, price: str) -> None:
     """Handle group duration price selection"""
-    price = call.data.split("_")[2]
     await state.update_data(price=price, service_type="group")
 
     # Record transaction
@@ -500,39 +365,30 @@ async def group_price_selected(call: CallbackQuery, state: FSMContext) -> None:
     user_id = call.from_user.id
 
     if user_id in user_database:
-        user_database[user_id]["purchases"].append({
+        purchase = record_purchase(user_id, {
             "service": "group",
             "group_name": user_data.get("group_name"),
             "price": price,
             "date": datetime.now().isoformat(),
             "status": "pending"
         })
+        await state.update_data(purchase_id=purchase["purchase_id"])
 
     # Show payment type options directly
-    kb = InlineKeyboardBuilder()
-    kb.button(text="🇮🇳 Indian Payment", callback_data="payment_type_indian")
-    kb.button(text="🌍 International Payment", callback_data="payment_type_international")
-    kb.button(text="💰 Crypto Payment", callback_data="payment_type_crypto")
-    create_back_button(kb)
-    kb.adjust(1)
-
-    try:
-        await call.message.edit_text("Choose your payment type:", reply_markup=kb.as_markup())
-    except Exception as e:
-        logger.error(f"Error displaying payment types: {e}")
+    await show_payment_types(call)
 
 
-@dp.callback_query(F.data == "private_chat")
+@callbacks.action("private_chat")
 async def private_chat_handler(call: CallbackQuery, state: FSMContext) -> None:
     """Handle private chat selection"""
     await state.set_state(Form.chat_duration)
     await state.update_data(service_type="private_chat")
-    durations = service_options["private_chat"]["durations"]
+    durations = (await catalog.get()).service_options["private_chat"]["durations"]
 
     kb = InlineKeyboardBuilder()
     for duration in durations:
         kb.button(text=f"{duration['name']} - ${duration['price']}",
-                  callback_data=f"chat_{duration['name'].split()[0]}")
+                  callback_data=callbacks.pack("chat_duration", duration['name'].split()[0]))
     create_back_button(kb)
     kb.adjust(1)
 
@@ -540,90 +396,79 @@ async def private_chat_handler(call: CallbackQuery, state: FSMContext) -> None:
                                  reply_markup=kb.as_markup())
 
 
-@dp.callback_query(F.data.startswith("chat_"))
-async def chat_duration_selected(call: CallbackQuery,
-                                 state: FSMContext) -> None:
-    """Handle chat duration selection"""
-    # Check if this is a chat type selection
-    if call.data.startswith("chat_type_"):
-        chat_type = call.data.split("_")[2]
-        types = service_options["private_chat"]["types"]
-        selected_type = next(
-            (t for t in types if t["name"].lower().startswith(chat_type)),
-            None)
-
-        if selected_type:
-            price = selected_type["price"]
-            await state.update_data(price=price,
-                                    chat_type=selected_type["name"])
-
-            # Record transaction
-            user_data = await state.get_data()
-            user_id = call.from_user.id
+@callbacks.action("chat_type", ("chat_type", str), legacy="chat_type_{}", priority=CHECKOUT)
+async def chat_type_selected(call: CallbackQuery, state: FSMContext, chat_type: str) -> None:
+    """Handle chat type selection"""
+    types = (await catalog.get()).service_options["private_chat"]["types"]
+    selected_type = next(
+        (t for t in types if t["name"].lower().startswith(chat_type)),
+        None)
 
-            if user_id in user_database:
-                user_database[user_id]["purchases"].append({
-                    "service":
-                    "private_chat",
-                    "chat_duration":
-                    user_data.get("chat_duration"),
-                    "chat_type":
-                    selected_type["name"],
-                    "price":
-                    price,
-                    "date":
-                    datetime.now().isoformat(),
-                    "status":
-                    "pending"
-                })
+    if selected_type:
+        price = selected_type["price"]
+        await state.update_data(price=price,
+                                chat_type=selected_type["name"])
 
-            # Show payment type options
-            await show_payment_types(call)
-    else:
-        # This is a duration selection
-        chat_duration = call.data.split("_")[1]
-        await state.update_data(chat_duration=chat_duration)
-        await state.set_state(Form.chat_type)
+        # Record transaction
+        user_data = await state.get_data()
+        user_id = call.from_user.id
 
-        types = service_options["private_chat"]["types"]
+        if user_id in user_database:
+            purchase = record_purchase(user_id, {
+                "service":
+                "private_chat",
+                "chat_duration":
+                user_data.get("chat_duration"),
+                "chat_type":
+                selected_type["name"],
+                "price":
+                price,
+                "date":
+                datetime.now().isoformat(),
+                "status":
+                "pending"
+            })
+            await state.update_data(purchase_id=purchase["purchase_id"])
 
-        kb = InlineKeyboardBuilder()
-        for type_info in types:
-            kb.button(text=f"{type_info['name']} - ${type_info['price']}",
-                      callback_data=
-                      f"chat_type_{type_info['name'].split()[0].lower()}")
-        create_back_button(kb)
-        kb.adjust(1)
+        # Show payment type options
+        await show_payment_types(call)
 
-        await call.message.edit_text("Choose chat type:",
-                                     reply_markup=kb.as_markup())
 
+@callbacks.action("chat_duration", ("chat_duration", str), legacy="chat_{}", priority=CHECKOUT)
+async def chat_duration_selected(call: CallbackQuery, state: FSMContext, chat_duration: str) -> None:
+    """Handle chat duration selection"""
+    await state.update_data(chat_duration=chat_duration)
+    await state.set_state(Form.chat_type)
 
-@dp.callback_query(F.data == "album")
-async def album_handler(call: CallbackQuery, state: FSMContext) -> None:
-    """Handle album selection"""
-    await state.set_state(Form.album_choice)
-    await state.update_data(service_type="album")
-    albums = service_options["album"]
+    types = (await catalog.get()).service_options["private_chat"]["types"]
 
     kb = InlineKeyboardBuilder()
-    for album in albums:
-        kb.button(text=f"{album['name']} - ${album['price']}",
-                  callback_data=f"album_{album['price']}")
+    for type_info in types:
+        kb.button(text=f"{type_info['name']} - ${type_info['price']}",
+                  callback_data=callbacks.pack("chat_type", type_info['name'].split()[0].lower()))
     create_back_button(kb)
     kb.adjust(1)
 
-    await call.message.edit_text("Choose Album Option:",
+    await call.message.edit_text("Choose chat type:",
                                  reply_markup=kb.as_markup())
 
 
-@dp.callback_query(F.data.startswith("album_"))
-async def album_selected(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("album")
+async def album_handler(call: CallbackQuery, state: FSMContext) -> None:
+    """Handle album selection"""
+    await state.set_state(Form.album_choice)
+    await state.update_data(service_type="album")
+
+    await call.message.edit_text("Choose Album Option:",
+                                 reply_markup=await keyboards.get("album", get_user_language(call.from_user.id)))
+
+
+@callbacks.action("album_option", ("price", str), legacy="album_{}", priority=CHECKOUT)
+async def album_selected(call: CallbackQuery, state: FSMContext, price: str) -> None:
     """Handle specific album selection"""
-    price = call.data.split("_")[1]
     album_name = next(
         (a["name"]
-         for a in service_options["album"] if str(a["price"]) == price),
+         for a in (await catalog.get()).service_options["album"] if str(a["price"]) == price),
         "Unknown Album")
 
     await state.update_data(price=price, album_name=album_name)
@@ -631,7 +476,7 @@ async def album_selected(call: CallbackQuery, state: FSMContext) -> None:
     # Record transaction
     user_id = call.from_user.id
     if user_id in user_database:
-        user_database[user_id]["purchases"].append({
+        purchase = record_purchase(user_id, {
             "service":
             "album",
             "album_name":
@@ -643,6 +488,7 @@ async def album_selected(call: CallbackQuery, state: FSMContext) -> None:
             "status":
             "pending"
         })
+        await state.update_data(purchase_id=purchase["purchase_id"])
 
     # Show payment type options
     await show_payment_types(call)
@@ -650,75 +496,47 @@ async def album_selected(call: CallbackQuery, state: FSMContext) -> None:
 
 async def show_payment_types(call: CallbackQuery) -> None:
     """Show payment type options (Indian, International, Crypto)"""
-    kb = InlineKeyboardBuilder()
-    kb.button(text="🇮🇳 Indian Payment", callback_data="payment_type_indian")
-    kb.button(text="🌍 International Payment", callback_data="payment_type_international")
-    kb.button(text="💰 Crypto Payment", callback_data="payment_type_crypto")
-    create_back_button(kb)
-    kb.adjust(1)
-
     try:
-        await call.message.edit_text("Choose your payment type:", reply_markup=kb.as_markup())
+        await call.message.edit_text(
+            "Choose your payment type:",
+            reply_markup=await keyboards.get("payment_types", get_user_language(call.from_user.id)))
     except Exception as e:
         logger.error(f"Error displaying payment types: {e}")
 
 
-@dp.callback_query(F.data.startswith("payment_type_"))
-async def payment_type_selected(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("payment_type", ("payment_type", str), legacy="payment_type_{}", priority=CHECKOUT)
+async def payment_type_selected(call: CallbackQuery, state: FSMContext, payment_type: str) -> None:
     """Handle payment type selection"""
-    payment_type = call.data.split("_")[2]
     await state.update_data(payment_type=payment_type)
 
     # Handle crypto payment directly
     if payment_type == "crypto":
-        await show_payment_details(call, state)
+        await show_payment_details(call, state, "crypto")
         return
 
-    kb = InlineKeyboardBuilder()
-
-    if payment_type == "indian":
-        # Indian payment options
-        kb.button(text="UPI ID/QR Code", callback_data="pay_upi")
-        kb.button(text="Amazon Gift Card", callback_data="pay_amazon_india")
-    elif payment_type == "international":
-        # International payment options
-        kb.button(text="Remitly", callback_data="pay_remitly")
-        kb.button(text="Paysend", callback_data="pay_paysend")
-        kb.button(text="Wise", callback_data="pay_wise")
-        kb.button(text="Amazon Gift Card", callback_data="pay_amazon_intl")
-        kb.button(text="Western Union", callback_data="pay_wu")
-        kb.button(text="PayPal", callback_data="pay_paypal")
-        kb.button(text="Other", callback_data="pay_other")
-
-    kb.button(text="« Back to Payment Types", callback_data="back_to_payment_types")
-    create_back_button(kb)
-    kb.adjust(1)
+    if payment_type not in PAYMENT_METHODS:
+        await call.answer("Unknown payment type. Please try again.")
+        return
 
     try:
         await call.message.edit_text(
             "Choose your payment method:\n\n"
             "<i>After payment, please contact @YG_JOIN with your payment confirmation.</i>",
-            reply_markup=kb.as_markup())
+            reply_markup=await keyboards.get(f"payment_methods_{payment_type}", get_user_language(call.from_user.id)))
     except Exception as e:
         logger.error(f"Error displaying payment methods: {e}")
 
 
-@dp.callback_query(F.data == "back_to_payment_types")
+@callbacks.action("back_to_payment_types", priority=CHECKOUT)
 async def back_to_payment_types(call: CallbackQuery) -> None:
     """Handle back to payment types button"""
     await show_payment_types(call)
 
 
-@dp.callback_query(F.data.startswith("pay_"))
-async def show_payment_details(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("pay", ("method", str), legacy="pay_{}", priority=PAYMENT)
+async def show_payment_details(call: CallbackQuery, state: FSMContext, method: str) -> None:
     """Show payment details for selected method"""
-    method = call.data
-
-    # For crypto payment from payment type selection
-    if method == "payment_type_crypto":
-        method = "pay_crypto"
-
-    details = details_map.get(method, "Payment method not found.")
+    details = details_map.get(f"pay_{method}", "Payment method not found.")
 
     # Get transaction info
     user_data = await state.get_data()
@@ -733,15 +551,17 @@ async def show_payment_details(call: CallbackQuery, state: FSMContext) -> None:
         await state.update_data(transaction_id=transaction_id)
         
         # Track this as a pending payment for reminder purposes
-        pending_payments[transaction_id] = {
-            "user_id": call.from_user.id,
-            "service_type": service_type,
-            "price": price,
-            "timestamp": datetime.now(),
-            "reminder_1_sent": False,
-            "reminder_2_sent": False,
-            "reminder_3_sent": False
-        }
+        pending_payments[transaction_id] = PendingPayment(
+            user_id=call.from_user.id,
+            service_type=service_type,
+            price=price,
+            timestamp=datetime.now(),
+            reminder_1_sent=False,
+            reminder_2_sent=False,
+            reminder_3_sent=False
+        )
+        store.mark_pending_payment(transaction_id)
+        payment_reminders.schedule(transaction_id)
 
     kb = InlineKeyboardBuilder()
 
@@ -749,14 +569,14 @@ async def show_payment_details(call: CallbackQuery, state: FSMContext) -> None:
     kb.button(text="✅ I've Made the Payment", callback_data="confirm_payment")
 
     # Add "Copy UPI ID" button for UPI payment method
-    if method == "pay_upi":
+    if method == "upi":
         kb.button(text="📋 Copy UPI ID", callback_data="copy_upi_id")
 
     # Add appropriate back button based on payment type
     payment_type = user_data.get("payment_type", "")
     if payment_type:
         kb.button(text="« Back to Payment Methods",
-                  callback_data=f"back_to_{payment_type}_methods")
+                  callback_data=callbacks.pack("back_to_methods", payment_type))
     else:
         kb.button(text="« Back to Payment Types",
                   callback_data="back_to_payment_types")
@@ -765,58 +585,44 @@ async def show_payment_details(call: CallbackQuery, state: FSMContext) -> None:
     kb.adjust(1)
 
     # Prepare order summary text
-    order_summary = f"Service: {service_type}\nAmount: ${price}"
+    language = get_user_language(call.from_user.id)
+    order_summary = texts.render("order_summary", language, service_type=service_type, price=price)
     
     # Add discount info if applicable
     if original_price != price:
-        order_summary += f"\nOriginal Price: ${original_price}\nDiscount: ${float(original_price) - float(price)}"
+        order_summary += texts.render("order_discount", language, original_price=original_price,
+                                      discount=float(original_price) - float(price))
     
     # Add bundle items if this is a bundle purchase
     if service_type == "bundle":
-        bundle_id = user_data.get("bundle_id")
-        selected_bundle = next((b for b in bundle_packages if b["id"] == bundle_id), None)
+        snapshot = await catalog.get()
+        selected_bundle = snapshot.bundles_by_id.get(user_data.get("bundle_id"))
         if selected_bundle:
-            order_summary = f"Bundle: {selected_bundle['name']}\nAmount: ${price}"
-            
-            # Add items list
-            items_text = "\n\nIncludes:"
-            for item in selected_bundle["items"]:
-                if item["service"] == "group":
-                    items_text += f"\n• {item['group_name']} Group ({item['duration']})"
-                elif item["service"] == "album":
-                    items_text += f"\n• {item['name']}"
-                else:
-                    items_text += f"\n• {item['service'].capitalize()}"
-            
-            order_summary += items_text
+            order_summary = texts.render("bundle_order_summary", language, name=selected_bundle["name"], price=price,
+                                         items=texts.bundle_items(snapshot, selected_bundle, language))
 
     try:
         await call.message.edit_text(
-            f"<b>Payment Instructions:</b>\n\n"
-            f"{details}\n\n"
-            f"<b>Order Summary:</b>\n"
-            f"{order_summary}\n"
-            f"Transaction ID: <code>{transaction_id}</code>\n\n"
-            f"<i>After making payment, click 'I've Made the Payment' button and send a screenshot as proof.</i>",
+            texts.render("payment_instructions", language, details=details, order_summary=order_summary,
+                         transaction_id=transaction_id),
             reply_markup=kb.as_markup())
     except Exception as e:
         logger.error(f"Error displaying payment details: {e}")
 
-    # Log transaction if not already logged
-    existing_transaction = next((t for t in transaction_history if t.get("transaction_id") == transaction_id), None)
-    if not existing_transaction:
-        payment_method = method.replace("pay_", "")
-        transaction_data = {
-            "transaction_id": transaction_id,
-            "user_id": call.from_user.id,
-            "username": call.from_user.username or call.from_user.first_name,
-            "service": service_type,
-            "amount": price,
-            "payment_method": payment_method,
-            "payment_type": user_data.get("payment_type", "unknown"),
-            "status": "pending",
-            "created_at": datetime.now().isoformat()
-        }
+    # Log the order if not already logged, linked to the purchase it pays for
+    if transaction_id not in ledger:
+        payment_method = method
+        transaction_data = Transaction(
+            transaction_id=transaction_id,
+            user_id=call.from_user.id,
+            username=call.from_user.username or call.from_user.first_name,
+            service=service_type,
+            amount=price,
+            payment_method=payment_method,
+            payment_type=user_data.get("payment_type", "unknown"),
+            status=Status.PENDING,
+            created_at=datetime.now().isoformat()
+        )
         
         # Add original price and discount if applicable
         if original_price != price:
@@ -826,10 +632,10 @@ async def show_payment_details(call: CallbackQuery, state: FSMContext) -> None:
             if "promo_code" in user_data:
                 transaction_data["promo_code"] = user_data["promo_code"]
         
-        transaction_history.append(transaction_data)
+        ledger.add(transaction_data, user_data.get("purchase_id"))
 
 
-@dp.callback_query(F.data == "confirm_payment")
+@callbacks.action("confirm_payment", priority=PAYMENT)
 async def confirm_payment_handler(call: CallbackQuery, state: FSMContext) -> None:
     """Handle payment confirmation button"""
     await state.set_state(Form.waiting_for_screenshot)
@@ -842,6 +648,7 @@ async def confirm_payment_handler(call: CallbackQuery, state: FSMContext) -> Non
     if transaction_id and transaction_id in pending_payments:
         # We'll keep it in the dictionary but mark it as confirmed
         pending_payments[transaction_id]["payment_confirmed"] = True
+        store.mark_pending_payment(transaction_id)
         logger.info(f"User {call.from_user.id} confirmed payment for {transaction_id}")
 
     kb = InlineKeyboardBuilder()
@@ -853,7 +660,7 @@ async def confirm_payment_handler(call: CallbackQuery, state: FSMContext) -> Non
         reply_markup=kb.as_markup())
 
 
-@dp.message(Form.waiting_for_screenshot, F.photo)
+@router.message(Form.waiting_for_screenshot, F.photo)
 async def handle_screenshot(message: Message, state: FSMContext) -> None:
     """Process payment screenshot"""
     user_id = message.from_user.id
@@ -863,48 +670,45 @@ async def handle_screenshot(message: Message, state: FSMContext) -> None:
     user_data = await state.get_data()
     service_type = user_data.get("service_type", "Unknown")
     price = user_data.get("price", "0")
-    transaction_id = user_data.get("transaction_id", "unknown")
+    transaction_id = user_data.get("transaction_id")
+    if transaction_id not in ledger:
+        # The session lost its order; fall back to the user's latest pending one
+        pending = ledger.by_user_status(user_id, Status.PENDING)
+        transaction_id = pending[-1]["transaction_id"] if pending else transaction_id or "unknown"
     
     # If this is a bundle purchase, include bundle details
     bundle_details = ""
     if service_type == "bundle":
         bundle_id = user_data.get("bundle_id")
-        selected_bundle = next((b for b in bundle_packages if b["id"] == bundle_id), None)
+        selected_bundle = (await catalog.get()).bundles_by_id.get(bundle_id)
         if selected_bundle:
             bundle_details = f"\nBundle: {selected_bundle['name']}"
 
-    # Update transaction status
-    for purchase in user_database.get(user_id, {}).get("purchases", []):
-        if purchase.get("status") == "pending":
-            purchase["status"] = "processing"
-            
-            # If this is a group subscription, set expiry date
-            if purchase.get("service") == "group" and "expiry_date" not in purchase:
-                # Get duration in months from the purchase
-                duration_text = purchase.get("group_duration", "2 Months")
-                try:
-                    # Extract number of months from text like "2 Months"
-                    months = int(duration_text.split()[0])
-                    expiry_date = (datetime.now() + timedelta(days=30*months)).isoformat()
-                    purchase["expiry_date"] = expiry_date
-                    purchase["renewal_reminder_sent"] = False
-                    purchase["final_reminder_sent"] = False
-                    purchase["auto_renew"] = False
-                except (ValueError, IndexError):
-                    # Default to 2 months if parsing fails
-                    expiry_date = (datetime.now() + timedelta(days=60)).isoformat()
-                    purchase["expiry_date"] = expiry_date
-            break
-
-    # Update transaction history
-    for transaction in transaction_history:
-        if transaction.get("transaction_id") == transaction_id:
-            transaction["status"] = "processing"
-            break
+    # Update the order and the purchase it pays for
+    purchase = ledger.set_status(transaction_id, Status.PROCESSING)
+
+    # If this is a group subscription, set expiry date
+    if purchase is not None and purchase.get("service") == "group" and "expiry_date" not in purchase:
+        # Get duration in months from the purchase
+        duration_text = purchase.get("group_duration", "2 Months")
+        try:
+            # Extract number of months from text like "2 Months"
+            months = int(duration_text.split()[0])
+            expiry_date = (datetime.now() + timedelta(days=30*months)).isoformat()
+            purchase["expiry_date"] = expiry_date
+            purchase["renewal_reminder_sent"] = False
+            purchase["final_reminder_sent"] = False
+            purchase["auto_renew"] = False
+        except (ValueError, IndexError):
+            # Default to 2 months if parsing fails
+            expiry_date = (datetime.now() + timedelta(days=60)).isoformat()
+            purchase["expiry_date"] = expiry_date
+        store.mark_purchase(user_id, purchase)
     
     # Remove from pending payments tracking or mark as processing
     if transaction_id in pending_payments:
         pending_payments[transaction_id]["status"] = "processing"
+        store.mark_pending_payment(transaction_id)
 
     # Notify user about processing status
     await message.answer(
@@ -921,8 +725,8 @@ async def handle_screenshot(message: Message, state: FSMContext) -> None:
 
             # Send payment details after the screenshot
             kb = InlineKeyboardBuilder()
-            kb.button(text="✅ Approve Payment", callback_data=f"approve_{user_id}_{transaction_id}")
-            kb.button(text="❌ Reject Payment", callback_data=f"reject_{user_id}_{transaction_id}")
+            kb.button(text="✅ Approve Payment", callback_data=callbacks.pack("approve", user_id, transaction_id))
+            kb.button(text="❌ Reject Payment", callback_data=callbacks.pack("reject", user_id, transaction_id))
             kb.adjust(1)
             
             # Prepare order summary
@@ -947,109 +751,82 @@ async def handle_screenshot(message: Message, state: FSMContext) -> None:
     await state.set_state(Form.processing_payment)
 
 
-@dp.callback_query(F.data.startswith("approve_"))
-async def approve_payment(call: CallbackQuery) -> None:
+@callbacks.action("approve", ("user_id", int), ("transaction_id", str), legacy="approve_{}_{}", priority=PAYMENT)
+async def approve_payment(call: CallbackQuery, user_id: int, transaction_id: str) -> None:
     """Handle payment approval by admin"""
     if call.from_user.id not in ADMIN_IDS:
         await call.answer("Unauthorized access")
         return
 
-    # Extract user ID and transaction ID from callback data
-    parts = call.data.split("_")
-    user_id = int(parts[1])
-    transaction_id = parts[2] if len(parts) > 2 else "unknown"
     service_type = "Unknown"
     bundle_info = None
 
-    # Update transaction status
-    for purchase in user_database.get(user_id, {}).get("purchases", []):
-        if purchase.get("status") == "processing":
-            purchase["status"] = "completed"
-            service_type = purchase.get("service", "Unknown")
-            
-            # If this is a bundle purchase, get bundle details
-            if service_type == "bundle":
-                bundle_id = purchase.get("bundle_id")
-                bundle_info = next((b for b in bundle_packages if b["id"] == bundle_id), None)
+    # Update the order and the purchase it pays for
+    purchase = ledger.set_status(transaction_id, Status.COMPLETED)
+    if purchase is not None:
+        service_type = purchase.get("service", "Unknown")
+        
+        # If this is a bundle purchase, get bundle details; it may have been retired since purchase
+        if service_type == "bundle":
+            bundle_id = purchase.get("bundle_id")
+            bundle_info = (await catalog.find_bundles([bundle_id])).get(bundle_id)
+        
+        # If this is a renewal, update the expiry date
+        if service_type == "renewal":
+            renewal_service = purchase.get("renewal_service", "")
             
-            # If this is a renewal, update the expiry date
-            if service_type == "renewal":
-                renewal_service = purchase.get("renewal_service", "")
-                
-                # Find the original subscription to update
-                for old_purchase in user_database.get(user_id, {}).get("purchases", []):
-                    if (old_purchase.get("service") == "group" and 
-                        renewal_service in old_purchase.get("group_name", "") and
-                        old_purchase.get("status") == "completed"):
-                        
-                        # Get current expiry date
-                        current_expiry = datetime.fromisoformat(old_purchase.get("expiry_date", datetime.now().isoformat()))
-                        
-                        # Add duration based on the renewal
-                        duration_text = purchase.get("renewal_duration", "2 Months")
-                        try:
-                            months = int(duration_text.split()[0])
-                            new_expiry = (current_expiry + timedelta(days=30*months)).isoformat()
-                            old_purchase["expiry_date"] = new_expiry
-                            old_purchase["renewal_reminder_sent"] = False
-                            old_purchase["final_reminder_sent"] = False
-                        except (ValueError, IndexError):
-                            # Default to 2 months if parsing fails
-                            new_expiry = (current_expiry + timedelta(days=60)).isoformat()
-                            old_purchase["expiry_date"] = new_expiry
-                        
-                        break
-            break
-
-    # Update transaction history
-    for transaction in transaction_history:
-        if transaction.get("transaction_id") == transaction_id:
-            transaction["status"] = "completed"
-            break
+            # Find the original subscription to update
+            for old_purchase in user_database.get(user_id, {}).get("purchases", []):
+                if (old_purchase.get("service") == "group" and 
+                    renewal_service in old_purchase.get("group_name", "") and
+                    old_purchase.get("status") == "completed"):
+                    
+                    # Get current expiry date
+                    current_expiry = datetime.fromisoformat(old_purchase.get("expiry_date", datetime.now().isoformat()))
+                    
+                    # Add duration based on the renewal
+                    duration_text = purchase.get("renewal_duration", "2 Months")
+                    try:
+                        months = int(duration_text.split()[0])
+                        new_expiry = (current_expiry + timedelta(days=30*months)).isoformat()
+                        old_purchase["expiry_date"] = new_expiry
+                        old_purchase["renewal_reminder_sent"] = False
+                        old_purchase["final_reminder_sent"] = False
+                    except (ValueError, IndexError):
+                        # Default to 2 months if parsing fails
+                        new_expiry = (current_expiry + timedelta(days=60)).isoformat()
+                        old_purchase["expiry_date"] = new_expiry
+                    
+                    store.mark_purchase(user_id, old_purchase)
+                    break
+    elif transaction_id in ledger:
+        service_type = ledger.get(transaction_id).get("service", "Unknown")
     
     # Remove from pending payments tracking
     if transaction_id in pending_payments:
         del pending_payments[transaction_id]
+        store.mark_pending_payment(transaction_id)
 
     # Send confirmation to user
     try:
+        language = get_user_language(user_id)
         # Default instructions based on service type
-        service_instructions = {
-            "group": "You'll receive an invite link to join the group within 24 hours.",
-            "video_call": "Our agent will contact you to schedule your video call.",
-            "private_chat": "Our agent will initiate a private chat with you shortly.",
-            "album": "You'll receive access to the album content within 24 hours.",
-            "bundle": "You'll receive access to all bundle items within 24 hours.",
-            "renewal": "Your subscription has been extended. Thank you for renewing!"
-        }.get(service_type, "")
+        instructions_key = f"instructions_{service_type}"
+        service_instructions = texts.render(instructions_key, language) if texts.has(instructions_key) else ""
         
         # Customize message for bundle purchases
-        message_text = f"🎉 <b>Payment Approved!</b>\n\n"
-        
         if service_type == "bundle" and bundle_info:
-            message_text += f"Your payment for the {bundle_info['name']} bundle has been verified and approved.\n\n"
-            message_text += "<b>Your bundle includes:</b>\n"
-            
-            for item in bundle_info["items"]:
-                if item["service"] == "group":
-                    message_text += f"• {item['group_name']} Group ({item['duration']})\n"
-                elif item["service"] == "album":
-                    message_text += f"• {item['name']}\n"
-                else:
-                    message_text += f"• {item['service'].capitalize()}\n"
-            
-            message_text += f"\n{service_instructions}\n"
+            body = texts.render("approved_bundle", language, name=bundle_info["name"],
+                                items=texts.bundle_items(await catalog.get(), bundle_info, language),
+                                instructions=service_instructions)
         elif service_type == "renewal":
-            message_text += "Your subscription renewal has been verified and approved.\n"
-            message_text += f"Your subscription has been extended.\n\n"
+            body = texts.render("approved_renewal", language)
         else:
-            message_text += f"Your payment for {service_type} has been verified and approved.\n"
-            message_text += f"{service_instructions}\n\n"
-        
-        message_text += f"Transaction ID: <code>{transaction_id}</code>\n\n"
-        message_text += f"Thank you for your purchase! If you have any questions, contact @YG_JOIN."
+            body = texts.render("approved_service", language, service_type=service_type,
+                                instructions=service_instructions)
         
-        await bot.send_message(user_id, message_text)
+        await bot.send_message(
+            user_id, texts.render("payment_approved", language, body=body, transaction_id=transaction_id))
     except Exception as e:
         logger.error(f"Failed to send approval notification to user {user_id}: {e}")
 
@@ -1059,32 +836,20 @@ async def approve_payment(call: CallbackQuery) -> None:
     )
 
 
-@dp.callback_query(F.data.startswith("reject_"))
-async def reject_payment(call: CallbackQuery) -> None:
+@callbacks.action("reject", ("user_id", int), ("transaction_id", str), legacy="reject_{}_{}", priority=PAYMENT)
+async def reject_payment(call: CallbackQuery, user_id: int, transaction_id: str) -> None:
     """Handle payment rejection by admin"""
     if call.from_user.id not in ADMIN_IDS:
         await call.answer("Unauthorized access")
         return
 
-    # Extract user ID and transaction ID from callback data
-    parts = call.data.split("_")
-    user_id = int(parts[1])
-    transaction_id = parts[2] if len(parts) > 2 else "unknown"
-
-    # Update transaction status
-    for purchase in user_database.get(user_id, {}).get("purchases", []):
-        if purchase.get("status") == "processing":
-            purchase["status"] = "rejected"
-            break
-
-    for transaction in transaction_history:
-        if transaction.get("transaction_id") == transaction_id:
-            transaction["status"] = "rejected"
-            break
+    # Update the order and the purchase it pays for
+    ledger.set_status(transaction_id, Status.REJECTED)
     
     # Remove from pending payments tracking
     if transaction_id in pending_payments:
         del pending_payments[transaction_id]
+        store.mark_pending_payment(transaction_id)
 
     # Send rejection to user
     try:
@@ -1110,46 +875,31 @@ async def reject_payment(call: CallbackQuery) -> None:
     )
 
 
-@dp.callback_query(F.data == "copy_upi_id")
+@callbacks.action("copy_upi_id", priority=PAYMENT)
 async def copy_upi_id(call: CallbackQuery) -> None:
     """Handle copy UPI ID button press"""
     await call.answer("UPI ID copied: illusionarts@ybl", show_alert=True)
 
 
-@dp.callback_query(F.data.startswith("back_to_") & F.data.endswith("_methods"))
-async def back_to_payment_methods(call: CallbackQuery,
-                                  state: FSMContext) -> None:
+@callbacks.action("back_to_methods", ("payment_type", str), legacy="back_to_{}_methods", priority=CHECKOUT)
+async def back_to_payment_methods(call: CallbackQuery, state: FSMContext, payment_type: str) -> None:
     """Handle back to payment methods button"""
-    payment_type = call.data.split("_")[2]
-    await state.update_data(payment_type=payment_type)
-    await payment_type_selected(call, state)
+    await payment_type_selected(call, state, payment_type)
 
 
-@dp.callback_query(F.data == "bundles")
+@callbacks.action("bundles")
 async def bundle_packages_handler(call: CallbackQuery, state: FSMContext) -> None:
     """Handle bundle packages selection"""
-    kb = InlineKeyboardBuilder()
-    
-    for bundle in bundle_packages:
-        kb.button(
-            text=f"{bundle['name']} - ${bundle['bundle_price']} (Save {bundle['discount_percentage']}%)",
-            callback_data=f"bundle_{bundle['id']}"
-        )
-    
-    create_back_button(kb)
-    kb.adjust(1)
-    
     await call.message.edit_text(
         "<b>📦 Bundle Packages</b>\n\n"
         "Get more value with our special bundles! Each bundle combines multiple services at a discounted price.",
-        reply_markup=kb.as_markup()
+        reply_markup=await keyboards.get("bundles", get_user_language(call.from_user.id))
     )
 
-@dp.callback_query(F.data.startswith("bundle_"))
-async def bundle_selected(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("bundle", ("bundle_id", str), legacy="bundle_{}")
+async def bundle_selected(call: CallbackQuery, state: FSMContext, bundle_id: str) -> None:
     """Handle specific bundle selection"""
-    bundle_id = call.data.split("_")[1]
-    selected_bundle = next((b for b in bundle_packages if b["id"] == bundle_id), None)
+    selected_bundle = (await catalog.get()).bundles_by_id.get(bundle_id)
     
     if not selected_bundle:
         await call.answer("Bundle not found. Please try again.")
@@ -1163,17 +913,10 @@ async def bundle_selected(call: CallbackQuery, state: FSMContext) -> None:
     )
     
     # Format bundle items for display
-    items_text = ""
-    for item in selected_bundle["items"]:
-        if item["service"] == "group":
-            items_text += f"• {item['group_name']} Group ({item['duration']})\n"
-        elif item["service"] == "album":
-            items_text += f"• {item['name']}\n"
-        else:
-            items_text += f"• {item['service'].capitalize()}\n"
+    items_text = texts.bundle_items(await catalog.get(), selected_bundle, get_user_language(call.from_user.id)) + "\n"
     
     kb = InlineKeyboardBuilder()
-    kb.button(text="Purchase Bundle", callback_data=f"purchase_bundle_{bundle_id}")
+    kb.button(text="Purchase Bundle", callback_data=callbacks.pack("purchase_bundle", bundle_id))
     create_back_button(kb)
     kb.adjust(1)
     
@@ -1187,12 +930,12 @@ async def bundle_selected(call: CallbackQuery, state: FSMContext) -> None:
         reply_markup=kb.as_markup()
     )
 
-@dp.callback_query(F.data.startswith("purchase_bundle_"))
-async def purchase_bundle(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("purchase_bundle", ("bundle_id", str), legacy="purchase_bundle_{}", priority=CHECKOUT)
+async def purchase_bundle(call: CallbackQuery, state: FSMContext, bundle_id: str) -> None:
     """Handle bundle purchase"""
     await show_payment_types(call)
 
-@dp.callback_query(F.data == "enter_promo")
+@callbacks.action("enter_promo")
 async def enter_promo_code(call: CallbackQuery, state: FSMContext) -> None:
     """Handle promo code entry"""
     await state.set_state(Form.promo_code)
@@ -1206,7 +949,7 @@ async def enter_promo_code(call: CallbackQuery, state: FSMContext) -> None:
         reply_markup=kb.as_markup()
     )
 
-@dp.message(Form.promo_code)
+@router.message(Form.promo_code)
 async def process_promo_code(message: Message, state: FSMContext) -> None:
     """Process entered promo code"""
     promo_code = message.text.strip().upper()
@@ -1244,6 +987,8 @@ async def process_promo_code(message: Message, state: FSMContext) -> None:
                 
                 # Increment usage count
                 promo_codes[promo_code]["uses"] += 1
+                store.mark_user(user_id)
+                store.mark_promo_code(promo_code)
                 
                 discount_text = f"{promo['discount']}% off" if promo["type"] == "percentage" else f"${promo['discount']} off"
                 
@@ -1263,14 +1008,14 @@ async def process_promo_code(message: Message, state: FSMContext) -> None:
     await state.clear()
     await show_main_menu(message)
 
-@dp.callback_query(F.data == "change_language")
+@callbacks.action("change_language")
 async def change_language_handler(call: CallbackQuery, state: FSMContext) -> None:
     """Handle language change request"""
     await state.set_state(Form.language_selection)
     
     kb = InlineKeyboardBuilder()
     for lang_code, lang_name in supported_languages.items():
-        kb.button(text=lang_name, callback_data=f"lang_{lang_code}")
+        kb.button(text=lang_name, callback_data=callbacks.pack("lang", lang_code))
     
     create_back_button(kb)
     kb.adjust(1)
@@ -1281,20 +1026,20 @@ async def change_language_handler(call: CallbackQuery, state: FSMContext) -> Non
         reply_markup=kb.as_markup()
     )
 
-@dp.callback_query(F.data.startswith("lang_"))
-async def language_selected(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("lang", ("lang_code", str), legacy="lang_{}")
+async def language_selected(call: CallbackQuery, state: FSMContext, lang_code: str) -> None:
     """Handle language selection"""
-    lang_code = call.data.split("_")[1]
     user_id = call.from_user.id
     
     if lang_code in supported_languages:
         # Update user's language preference
         if user_id in user_database:
             user_database[user_id]["language"] = lang_code
+            store.mark_user(user_id)
             
             await call.answer(f"Language set to {supported_languages[lang_code]}")
             await state.clear()
-            await call.message.edit_text(translations[lang_code].get("welcome", "Choose an option below:"))
+            await call.message.edit_text(texts.render("welcome", lang_code))
             await show_main_menu(call.message)
         else:
             await call.answer("Error setting language. Please try again.")
@@ -1303,10 +1048,9 @@ async def language_selected(call: CallbackQuery, state: FSMContext) -> None:
         await call.answer("Invalid language selection. Please try again.")
         await back_to_main(call, state)
 
-@dp.callback_query(F.data.startswith("resume_payment_"))
-async def resume_payment_handler(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("resume_payment", ("transaction_id", str), legacy="resume_payment_{}", priority=PAYMENT)
+async def resume_payment_handler(call: CallbackQuery, state: FSMContext, transaction_id: str) -> None:
     """Handle payment resumption"""
-    transaction_id = call.data.split("_")[2]
     
     # Find the transaction in pending payments
     if transaction_id in pending_payments:
@@ -1324,29 +1068,17 @@ async def resume_payment_handler(call: CallbackQuery, state: FSMContext) -> None
         await call.answer("This payment session has expired. Please start a new order.")
         await back_to_main(call, state)
 
-@dp.callback_query(F.data.startswith("cancel_payment_"))
-async def cancel_payment_handler(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("cancel_payment", ("transaction_id", str), legacy="cancel_payment_{}", priority=PAYMENT)
+async def cancel_payment_handler(call: CallbackQuery, state: FSMContext, transaction_id: str) -> None:
     """Handle payment cancellation"""
-    transaction_id = call.data.split("_")[2]
-    user_id = call.from_user.id
-    
     # Find and update the transaction
     if transaction_id in pending_payments:
         # Remove from pending payments
         del pending_payments[transaction_id]
+        store.mark_pending_payment(transaction_id)
         
-        # Update transaction history
-        for transaction in transaction_history:
-            if transaction.get("transaction_id") == transaction_id:
-                transaction["status"] = "cancelled"
-                break
-        
-        # Update user purchases
-        if user_id in user_database:
-            for purchase in user_database[user_id]["purchases"]:
-                if purchase.get("status") == "pending":
-                    purchase["status"] = "cancelled"
-                    break
+        # Update the order and the purchase it pays for
+        ledger.set_status(transaction_id, Status.CANCELLED)
         
         await call.message.edit_text(
             "✅ Your order has been cancelled.\n\n"
@@ -1360,10 +1092,9 @@ async def cancel_payment_handler(call: CallbackQuery, state: FSMContext) -> None
         await call.answer("This order has already been processed or expired.")
         await back_to_main(call, state)
 
-@dp.callback_query(F.data.startswith("renew_"))
-async def renew_subscription_handler(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("renew", ("service_type", str), legacy="renew_{}", priority=CHECKOUT)
+async def renew_subscription_handler(call: CallbackQuery, state: FSMContext, service_type: str) -> None:
     """Handle subscription renewal"""
-    service_type = call.data.split("_")[1]
     
     # Set up state for renewal
     await state.update_data(
@@ -1374,10 +1105,9 @@ async def renew_subscription_handler(call: CallbackQuery, state: FSMContext) ->
     # Show payment options
     await show_payment_types(call)
 
-@dp.callback_query(F.data.startswith("auto_renew_"))
-async def auto_renew_handler(call: CallbackQuery) -> None:
+@callbacks.action("auto_renew", ("service_type", str), legacy="auto_renew_{}", priority=CHECKOUT)
+async def auto_renew_handler(call: CallbackQuery, state: FSMContext, service_type: str) -> None:
     """Handle auto-renewal toggle"""
-    service_type = call.data.split("_")[2]
     user_id = call.from_user.id
     
     if user_id in user_database:
@@ -1385,6 +1115,7 @@ async def auto_renew_handler(call: CallbackQuery) -> None:
             if purchase.get("service") == "group" and service_type in purchase.get("group_name", ""):
                 # Toggle auto-renew setting
                 purchase["auto_renew"] = not purchase.get("auto_renew", False)
+                store.mark_purchase(user_id, purchase)
                 
                 status = "enabled" if purchase.get("auto_renew", False) else "disabled"
                 
@@ -1398,7 +1129,7 @@ async def auto_renew_handler(call: CallbackQuery) -> None:
     await back_to_main(call, state)
 
 
-@dp.callback_query(F.data == "help")
+@callbacks.action("help")
 async def help_handler(call: CallbackQuery) -> None:
     """Handle help button"""
     help_text = (
@@ -1417,7 +1148,7 @@ async def help_handler(call: CallbackQuery) -> None:
     await call.message.edit_text(help_text, reply_markup=kb.as_markup())
 
 
-@dp.callback_query(F.data == "feedback")
+@callbacks.action("feedback")
 async def feedback_handler(call: CallbackQuery, state: FSMContext) -> None:
     """Handle feedback button"""
     await state.set_state(Form.feedback)
@@ -1430,7 +1161,7 @@ async def feedback_handler(call: CallbackQuery, state: FSMContext) -> None:
         reply_markup=kb.as_markup())
 
 
-@dp.message(Form.feedback)
+@router.message(Form.feedback)
 async def process_feedback(message: Message, state: FSMContext) -> None:
     """Process user feedback"""
     feedback_text = message.text
@@ -1442,12 +1173,14 @@ async def process_feedback(message: Message, state: FSMContext) -> None:
         if "feedback" not in user_database[user_id]:
             user_database[user_id]["feedback"] = []
 
-        user_database[user_id]["feedback"].append({
+        feedback_entry = {
             "text":
             feedback_text,
             "date":
             datetime.now().isoformat()
-        })
+        }
+        user_database[user_id]["feedback"].append(feedback_entry)
+        store.add_feedback(user_id, feedback_text, feedback_entry["date"])
 
     # Notify admins about feedback (in a real app, you'd send to all admins)
     for admin_id in ADMIN_IDS:
@@ -1466,7 +1199,7 @@ async def process_feedback(message: Message, state: FSMContext) -> None:
 
 
 # Admin functions
-@dp.callback_query(F.data == "admin_stats")
+@callbacks.action("admin_stats")
 async def admin_stats(call: CallbackQuery) -> None:
     """Show admin statistics"""
     if call.from_user.id not in ADMIN_IDS:
@@ -1474,19 +1207,31 @@ async def admin_stats(call: CallbackQuery) -> None:
         return
 
     total_users = len(user_database)
-    total_transactions = len(transaction_history)
+    total_transactions = aggregates.total
+
+    # Revenue comes from the running aggregates, not a scan of the history
+    pending_revenue = aggregates.revenue("pending")
+    completed_revenue = aggregates.revenue("completed")
+    total_revenue = round(pending_revenue + completed_revenue, 2)
 
-    # Calculate revenue
-    pending_revenue = sum(float(t["amount"]) for t in transaction_history if t["status"] == "pending")
-    completed_revenue = sum(float(t["amount"]) for t in transaction_history if t["status"] == "completed")
-    total_revenue = pending_revenue + completed_revenue
+    # Users who blocked the bot are no longer sent broadcasts
+    unreachable = await db.count_unreachable_users()
 
     stats = (f"<b>Bot Statistics</b>\n\n"
              f"Total Users: {total_users}\n"
              f"Total Transactions: {total_transactions}\n"
              f"Pending Revenue: ${pending_revenue}\n"
              f"Completed Revenue: ${completed_revenue}\n"
-             f"Total Revenue: ${total_revenue}\n\n"
+             f"Total Revenue: ${total_revenue}\n"
+             f"Activity Writes: {activity.stats['last_flush_rows']} rows last flush "
+             f"({activity.stats['rows_written']} total)\n"
+             f"User Mailboxes: {len(mailboxes)} active, max queue depth {mailboxes.stats['max_depth']}\n"
+             f"Admission: {admission.in_flight} running, {admission.waiting} waiting, "
+             f"loop lag {admission.lag * 1000:.0f}ms, {admission.stats['shed']} shed\n"
+             f"Outbox: {outbox.depth} queued, {outbox.stats['retried']} retried, "
+             f"{len(outbox.dead_letters)} dead letters\n"
+             f"Unreachable Users: {unreachable} (each broadcast skips {unreachable} sends, "
+             f"~{unreachable / TELEGRAM_RATE_LIMIT:.0f}s)\n\n"
              f"Last Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
     kb = InlineKeyboardBuilder()
@@ -1495,7 +1240,7 @@ async def admin_stats(call: CallbackQuery) -> None:
     await call.message.edit_text(stats, reply_markup=kb.as_markup())
 
 
-@dp.callback_query(F.data == "admin_broadcast")
+@callbacks.action("admin_broadcast")
 async def admin_broadcast_handler(call: CallbackQuery, state: FSMContext) -> None:
     """Handle admin broadcast preparation"""
     if call.from_user.id not in ADMIN_IDS:
@@ -1512,7 +1257,7 @@ async def admin_broadcast_handler(call: CallbackQuery, state: FSMContext) -> Non
         reply_markup=kb.as_markup())
 
 
-@dp.message(Form.admin_broadcast)
+@router.message(Form.admin_broadcast)
 async def process_admin_broadcast(message: Message, state: FSMContext) -> None:
     """Process admin broadcast message"""
     if message.from_user.id not in ADMIN_IDS:
@@ -1520,26 +1265,21 @@ async def process_admin_broadcast(message: Message, state: FSMContext) -> None:
         return
 
     broadcast_message = message.text
-    sent_count = 0
-    failed_count = 0
 
-    # Send message to all users
-    for user_id in user_database:
-        try:
-            await bot.send_message(
-                user_id,
-                f"<b>📢 Announcement</b>\n\n{broadcast_message}\n\n<i>To see available services, type /start</i>"
-            )
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Failed to send broadcast to user {user_id}: {e}")
-            failed_count += 1
+    # Flush first so users who joined in the last few seconds are included;
+    # the broadcaster reports progress to this chat as it goes
+    await store.flush()
+    broadcast_id = await broadcaster.submit(
+        f"<b>📢 Announcement</b>\n\n{broadcast_message}\n\n<i>To see available services, type /start</i>",
+        created_by=message.from_user.id,
+        report_chat_id=message.chat.id)
 
-    await message.answer(f"Broadcast complete!\n\nSent to: {sent_count} users\nFailed: {failed_count} users")
+    if broadcast_id is None:
+        await message.answer("Failed to start the broadcast. Please try again.")
     await state.clear()
 
 
-@dp.callback_query(F.data == "admin_custom_price")
+@callbacks.action("admin_custom_price")
 async def admin_custom_price(call: CallbackQuery, state: FSMContext) -> None:
     """Handle admin custom price quote"""
     if call.from_user.id not in ADMIN_IDS:
@@ -1558,7 +1298,7 @@ async def admin_custom_price(call: CallbackQuery, state: FSMContext) -> None:
         reply_markup=kb.as_markup())
 
 
-@dp.message(Form.custom_price)
+@router.message(Form.custom_price)
 async def process_custom_price(message: Message, state: FSMContext) -> None:
     """Process admin custom price quote"""
     if message.from_user.id not in ADMIN_IDS:
@@ -1574,10 +1314,10 @@ async def process_custom_price(message: Message, state: FSMContext) -> None:
         # Create custom keyboard for payment type selection
         kb = InlineKeyboardBuilder()
         kb.button(text="🇮🇳 Indian Payment",
-                  callback_data="payment_type_indian")
+                  callback_data=callbacks.pack("payment_type", "indian"))
         kb.button(text="🌍 International Payment",
-                  callback_data="payment_type_international")
-        kb.button(text="💰 Crypto Payment", callback_data="payment_type_crypto")
+                  callback_data=callbacks.pack("payment_type", "international"))
+        kb.button(text="💰 Crypto Payment", callback_data=callbacks.pack("payment_type", "crypto"))
         kb.adjust(1)
 
         await bot.send_message(user_id, f"<b>Custom Price Quote</b>\n\n"
@@ -1593,7 +1333,7 @@ async def process_custom_price(message: Message, state: FSMContext) -> None:
     await state.clear()
 
 
-@dp.callback_query(F.data == "admin_schedule_broadcast")
+@callbacks.action("admin_schedule_broadcast")
 async def admin_schedule_broadcast(call: CallbackQuery, state: FSMContext) -> None:
     """Handle scheduled broadcast setup"""
     if call.from_user.id not in ADMIN_IDS:
@@ -1612,7 +1352,7 @@ async def admin_schedule_broadcast(call: CallbackQuery, state: FSMContext) -> No
         reply_markup=kb.as_markup()
     )
 
-@dp.message(Form.admin_scheduled_broadcast)
+@router.message(Form.admin_scheduled_broadcast)
 async def process_scheduled_broadcast(message: Message, state: FSMContext) -> None:
     """Process scheduled broadcast setup"""
     if message.from_user.id not in ADMIN_IDS:
@@ -1642,6 +1382,8 @@ async def process_scheduled_broadcast(message: Message, state: FSMContext) -> No
             "created_by": message.from_user.id,
             "created_at": datetime.now().isoformat()
         }
+        store.mark_scheduled_task(task_id)
+        schedule_broadcast_task(task_id, scheduled_time)
         
         await message.answer(
             f"✅ Broadcast scheduled successfully!\n\n"
@@ -1655,7 +1397,7 @@ async def process_scheduled_broadcast(message: Message, state: FSMContext) -> No
     
     await state.clear()
 
-@dp.callback_query(F.data == "admin_create_promo")
+@callbacks.action("admin_create_promo")
 async def admin_create_promo(call: CallbackQuery, state: FSMContext) -> None:
     """Handle promo code creation"""
     if call.from_user.id not in ADMIN_IDS:
@@ -1677,7 +1419,7 @@ async def admin_create_promo(call: CallbackQuery, state: FSMContext) -> None:
         reply_markup=kb.as_markup()
     )
 
-@dp.message(Form.admin_promo_create)
+@router.message(Form.admin_promo_create)
 async def process_promo_creation(message: Message, state: FSMContext) -> None:
     """Process promo code creation"""
     if message.from_user.id not in ADMIN_IDS:
@@ -1711,6 +1453,7 @@ async def process_promo_creation(message: Message, state: FSMContext) -> None:
             "created_by": message.from_user.id,
             "created_at": datetime.now().isoformat()
         }
+        store.mark_promo_code(code)
         
         await message.answer(
             f"✅ Promo code created successfully!\n\n"
@@ -1726,7 +1469,7 @@ async def process_promo_creation(message: Message, state: FSMContext) -> None:
     
     await state.clear()
 
-@dp.callback_query(F.data == "admin_manage_bundles")
+@callbacks.action("admin_manage_bundles")
 async def admin_manage_bundles(call: CallbackQuery, state: FSMContext) -> None:
     """Handle bundle management"""
     if call.from_user.id not in ADMIN_IDS:
@@ -1746,7 +1489,7 @@ async def admin_manage_bundles(call: CallbackQuery, state: FSMContext) -> None:
         reply_markup=kb.as_markup()
     )
 
-@dp.message(Form.admin_bundle_create)
+@router.message(Form.admin_bundle_create)
 async def process_bundle_creation(message: Message, state: FSMContext) -> None:
     """Process bundle creation"""
     if message.from_user.id not in ADMIN_IDS:
@@ -1786,7 +1529,10 @@ async def process_bundle_creation(message: Message, state: FSMContext) -> None:
             "created_at": datetime.now().isoformat()
         }
         
-        bundle_packages.append(new_bundle)
+        if not await catalog.add_bundle(new_bundle):
+            await message.answer("Failed to save the bundle. Please try again.")
+            await state.clear()
+            return
         
         await message.answer(
             f"✅ Bundle created successfully!\n\n"
@@ -1807,7 +1553,7 @@ async def process_bundle_creation(message: Message, state: FSMContext) -> None:
     
     await state.clear()
 
-@dp.callback_query(F.data == "admin_create_offer")
+@callbacks.action("admin_create_offer")
 async def admin_create_offer(call: CallbackQuery, state: FSMContext) -> None:
     """Handle limited time offer creation"""
     if call.from_user.id not in ADMIN_IDS:
@@ -1826,7 +1572,7 @@ async def admin_create_offer(call: CallbackQuery, state: FSMContext) -> None:
         reply_markup=kb.as_markup()
     )
 
-@dp.message(lambda message: message.text and "|" in message.text and message.from_user.id in ADMIN_IDS)
+@router.message(lambda message: message.text and "|" in message.text and message.from_user.id in ADMIN_IDS)
 async def process_offer_creation(message: Message) -> None:
     """Process limited time offer creation"""
     # Check if this might be an offer creation message
@@ -1854,7 +1600,9 @@ async def process_offer_creation(message: Message) -> None:
                 "created_at": datetime.now().isoformat()
             }
             
-            limited_time_offers.append(new_offer)
+            if not await catalog.add_limited_time_offer(new_offer):
+                await message.answer("Failed to save the offer. Please try again.")
+                return
             
             await message.answer(
                 f"✅ Limited time offer created successfully!\n\n"
@@ -1867,41 +1615,33 @@ async def process_offer_creation(message: Message) -> None:
             # Not an offer creation message, continue with other handlers
             pass
 
-@dp.callback_query(F.data == "admin_advanced_analytics")
+@callbacks.action("admin_advanced_analytics")
 async def admin_advanced_analytics(call: CallbackQuery) -> None:
     """Handle advanced analytics display"""
     if call.from_user.id not in ADMIN_IDS:
         await call.answer("Unauthorized access")
         return
     
-    # Calculate various metrics
+    # Calculate various metrics from the running aggregates
     total_users = len(user_database)
-    total_transactions = len(transaction_history)
+    total_transactions = aggregates.total
     
     # Revenue metrics
-    pending_revenue = sum(float(t["amount"]) for t in transaction_history if t["status"] == "pending")
-    completed_revenue = sum(float(t["amount"]) for t in transaction_history if t["status"] == "completed")
-    total_revenue = pending_revenue + completed_revenue
+    pending_revenue = aggregates.revenue("pending")
+    completed_revenue = aggregates.revenue("completed")
+    total_revenue = round(pending_revenue + completed_revenue, 2)
     
     # Conversion metrics
-    abandoned_count = sum(1 for t in transaction_history if t["status"] == "cancelled")
-    completed_count = sum(1 for t in transaction_history if t["status"] == "completed")
+    abandoned_count = aggregates.count("cancelled")
+    completed_count = aggregates.count("completed")
     
     conversion_rate = 0
     if total_transactions > 0:
         conversion_rate = (completed_count / total_transactions) * 100
     
-    # Service popularity
-    service_counts = {}
-    for t in transaction_history:
-        service = t.get("service", "unknown")
-        if service not in service_counts:
-            service_counts[service] = 0
-        service_counts[service] += 1
-    
     # Format service popularity
     popularity_text = ""
-    for service, count in sorted(service_counts.items(), key=lambda x: x[1], reverse=True):
+    for service, count in aggregates.popular_services():
         popularity_text += f"{service.capitalize()}: {count} orders\n"
     
     # Promo code usage
@@ -1945,7 +1685,7 @@ async def admin_advanced_analytics(call: CallbackQuery) -> None:
     
     await call.message.edit_text(analytics_text, reply_markup=kb.as_markup())
 
-@dp.callback_query(F.data == "admin_manage_services")
+@callbacks.action("admin_manage_services")
 async def admin_manage_services(call: CallbackQuery, state: FSMContext) -> None:
     """Handle service management"""
     if call.from_user.id not in ADMIN_IDS:
@@ -1955,10 +1695,10 @@ async def admin_manage_services(call: CallbackQuery, state: FSMContext) -> None:
     await state.set_state(Form.admin_service_edit)
     
     kb = InlineKeyboardBuilder()
-    kb.button(text="Add Video Call Duration", callback_data="add_service_video_call")
-    kb.button(text="Add Group Option", callback_data="add_service_group")
-    kb.button(text="Add Chat Option", callback_data="add_service_chat")
-    kb.button(text="Add Album Option", callback_data="add_service_album")
+    kb.button(text="Add Video Call Duration", callback_data=callbacks.pack("add_service", "video_call"))
+    kb.button(text="Add Group Option", callback_data=callbacks.pack("add_service", "group"))
+    kb.button(text="Add Chat Option", callback_data=callbacks.pack("add_service", "chat"))
+    kb.button(text="Add Album Option", callback_data=callbacks.pack("add_service", "album"))
     kb.button(text="« Back to Admin Panel", callback_data="back_to_admin")
     kb.adjust(1)
     
@@ -1968,14 +1708,13 @@ async def admin_manage_services(call: CallbackQuery, state: FSMContext) -> None:
         reply_markup=kb.as_markup()
     )
 
-@dp.callback_query(F.data.startswith("add_service_"))
-async def add_service_handler(call: CallbackQuery, state: FSMContext) -> None:
+@callbacks.action("add_service", ("service_type", str), legacy="add_service_{}")
+async def add_service_handler(call: CallbackQuery, state: FSMContext, service_type: str) -> None:
     """Handle adding a new service option"""
     if call.from_user.id not in ADMIN_IDS:
         await call.answer("Unauthorized access")
         return
     
-    service_type = call.data.split("_")[2]
     await state.update_data(edit_service_type=service_type)
     
     kb = InlineKeyboardBuilder()
@@ -1993,7 +1732,7 @@ async def add_service_handler(call: CallbackQuery, state: FSMContext) -> None:
     
     await call.message.edit_text(instructions, reply_markup=kb.as_markup())
 
-@dp.message(Form.admin_service_edit)
+@router.message(Form.admin_service_edit)
 async def process_service_edit(message: Message, state: FSMContext) -> None:
     """Process service edit/addition"""
     if message.from_user.id not in ADMIN_IDS:
@@ -2012,18 +1751,26 @@ async def process_service_edit(message: Message, state: FSMContext) -> None:
             duration = parts[0].strip()
             price = float(parts[1].strip())
             
-            service_options["video_call"]["durations"].append({
+            if not await catalog.add_service_option({
+                "service_type": "video_call",
+                "option_type": "duration",
                 "name": duration,
                 "price": price
-            })
+            }):
+                raise RuntimeError("could not save the option")
             
             await message.answer(f"✅ Added new video call duration: {duration} - ${price}")
             
         elif service_type == "group":
             group_name = message.text.strip()
             
-            if group_name not in service_options["group"]["names"]:
-                service_options["group"]["names"].append(group_name)
+            if group_name not in (await catalog.get()).service_options["group"]["names"]:
+                if not await catalog.add_service_option({
+                    "service_type": "group",
+                    "option_type": "name",
+                    "name": group_name
+                }):
+                    raise RuntimeError("could not save the option")
                 await message.answer(f"✅ Added new group option: {group_name}")
             else:
                 await message.answer(f"Group '{group_name}' already exists.")
@@ -2036,10 +1783,13 @@ async def process_service_edit(message: Message, state: FSMContext) -> None:
             chat_type = parts[0].strip()
             price = float(parts[1].strip())
             
-            service_options["private_chat"]["types"].append({
+            if not await catalog.add_service_option({
+                "service_type": "private_chat",
+                "option_type": "type",
                 "name": chat_type,
                 "price": price
-            })
+            }):
+                raise RuntimeError("could not save the option")
             
             await message.answer(f"✅ Added new chat type: {chat_type} - ${price}")
             
@@ -2051,10 +1801,13 @@ async def process_service_edit(message: Message, state: FSMContext) -> None:
             album_name = parts[0].strip()
             price = float(parts[1].strip())
             
-            service_options["album"].append({
+            if not await catalog.add_service_option({
+                "service_type": "album",
+                "option_type": "album",
                 "name": album_name,
                 "price": price
-            })
+            }):
+                raise RuntimeError("could not save the option")
             
             await message.answer(f"✅ Added new album option: {album_name} - ${price}")
             
@@ -2065,29 +1818,49 @@ async def process_service_edit(message: Message, state: FSMContext) -> None:
     
     await state.clear()
 
-@dp.callback_query(F.data == "back_to_admin")
+@callbacks.action("back_to_admin")
 async def back_to_admin(call: CallbackQuery, state: FSMContext) -> None:
     """Handle back to admin panel button"""
     await state.clear()
-    kb = InlineKeyboardBuilder()
-    kb.button(text="📊 User Statistics", callback_data="admin_stats")
-    kb.button(text="📣 Broadcast Message", callback_data="admin_broadcast")
-    kb.button(text="📅 Schedule Broadcast", callback_data="admin_schedule_broadcast")
-    kb.button(text="💰 Custom Price Quote", callback_data="admin_custom_price")
-    kb.button(text="🛠️ Manage Services", callback_data="admin_manage_services")
-    kb.button(text="💲 Manage Pricing", callback_data="admin_manage_pricing")
-    kb.button(text="🎁 Create Promo Code", callback_data="admin_create_promo")
-    kb.button(text="📦 Manage Bundles", callback_data="admin_manage_bundles")
-    kb.button(text="⏱️ Create Limited Offer", callback_data="admin_create_offer")
-    kb.button(text="📊 Advanced Analytics", callback_data="admin_advanced_analytics")
-    kb.adjust(1)
     await call.message.edit_text(
         "<b>Admin Panel</b>\nWelcome to the admin panel.",
-        reply_markup=kb.as_markup())
+        reply_markup=await keyboards.get("admin_panel", get_user_language(call.from_user.id)))
+
+
+@router.callback_query()
+async def dispatch_callback(call: CallbackQuery, state: FSMContext, callback: Optional[Callback] = None) -> None:
+    """Route every callback query through the callback action table"""
+    if not await callbacks.dispatch(call, state, callback):
+        logger.warning(f"Unknown callback data from user {call.from_user.id}: {call.data!r}")
+        await call.answer("This button is no longer available.")
+
+
+@admission.classifier
+def classify_update(update: types.Update, data: Dict[str, Any]) -> int:
+    """Admission class of an update: admins and payments first, then checkout, then browsing
+
+    Callback data is parsed here once and left in data["callback"] for dispatch_callback.
+    """
+    callback = None
+    if update.callback_query is not None:
+        callback = data["callback"] = callbacks.parse(update.callback_query.data)
+    user = data.get("event_from_user")
+    if user is not None and user.id in ADMIN_IDS:
+        return PAYMENT
+    if update.callback_query is not None:
+        return callbacks.priority(callback)
+    if update.message is not None:
+        raw_state = data.get("raw_state")
+        if raw_state == Form.waiting_for_screenshot.state:
+            return PAYMENT
+        # Any other reply inside a flow (promo code, feedback, ...) continues an order or form
+        if raw_state is not None:
+            return CHECKOUT
+    return BROWSING
 
 
 # Error handler
-@dp.error()
+@router.error()
 async def error_handler(update, exception) -> None:
     """Handle errors"""
     logger.error(f"Update {update} caused error {exception}")
@@ -2109,8 +1882,8 @@ async def send_payment_reminder(user_id: int, service_type: str, price: str, tra
     """Send a reminder to users who abandoned the payment process"""
     try:
         kb = InlineKeyboardBuilder()
-        kb.button(text="Resume Payment", callback_data=f"resume_payment_{transaction_id}")
-        kb.button(text="Cancel Order", callback_data=f"cancel_payment_{transaction_id}")
+        kb.button(text="Resume Payment", callback_data=callbacks.pack("resume_payment", transaction_id))
+        kb.button(text="Cancel Order", callback_data=callbacks.pack("cancel_payment", transaction_id))
         kb.adjust(1)
         
         await bot.send_message(
@@ -2128,8 +1901,8 @@ async def send_subscription_renewal_reminder(user_id: int, service_type: str, ex
     """Send a reminder for subscription renewal"""
     try:
         kb = InlineKeyboardBuilder()
-        kb.button(text="Renew Subscription", callback_data=f"renew_{service_type}")
-        kb.button(text="Auto-Renew", callback_data=f"auto_renew_{service_type}")
+        kb.button(text="Renew Subscription", callback_data=callbacks.pack("renew", service_type))
+        kb.button(text="Auto-Renew", callback_data=callbacks.pack("auto_renew", service_type))
         kb.adjust(1)
         
         await bot.send_message(
@@ -2144,121 +1917,78 @@ async def send_subscription_renewal_reminder(user_id: int, service_type: str, ex
         logger.error(f"Failed to send renewal reminder to user {user_id}: {e}")
 
 async def check_pending_payments() -> None:
-    """Check for abandoned payments and send reminders"""
-    current_time = datetime.now()
-    to_remove = []
-    
-    for transaction_id, data in pending_payments.items():
-        time_diff = current_time - data["timestamp"]
-        
-        # Send first reminder after 30 minutes
-        if time_diff > timedelta(minutes=30) and not data.get("reminder_1_sent"):
-            await send_payment_reminder(data["user_id"], data["service_type"], data["price"], transaction_id)
-            pending_payments[transaction_id]["reminder_1_sent"] = True
-        
-        # Send second reminder after 4 hours
-        elif time_diff > timedelta(hours=4) and not data.get("reminder_2_sent"):
-            await send_payment_reminder(data["user_id"], data["service_type"], data["price"], transaction_id)
-            pending_payments[transaction_id]["reminder_2_sent"] = True
-        
-        # Send final reminder after 24 hours
-        elif time_diff > timedelta(hours=24) and not data.get("reminder_3_sent"):
+    """Send the abandoned-payment reminders that are due and forget expired orders"""
+    outbox.use_priority(BACKGROUND)
+    # Reminders go out 30 minutes, 4 hours and 24 hours after the order was
+    # started; after 48 hours it is removed from tracking (see reminders.py)
+    for transaction_id, action in payment_reminders.pop_due(datetime.now()):
+        if action == EXPIRE:
+            pending_payments.pop(transaction_id, None)
+        else:
+            # The payment may have been completed while earlier reminders were sent
+            data = pending_payments.get(transaction_id)
+            if data is None:
+                continue
             await send_payment_reminder(data["user_id"], data["service_type"], data["price"], transaction_id)
-            pending_payments[transaction_id]["reminder_3_sent"] = True
-            
-        # Remove from tracking after 48 hours
-        if time_diff > timedelta(hours=48):
-            to_remove.append(transaction_id)
-    
-    # Remove old transactions
-    for transaction_id in to_remove:
-        del pending_payments[transaction_id]
+        store.mark_pending_payment(transaction_id)
 
 async def check_subscription_renewals() -> None:
-    """Check for expiring subscriptions and send renewal reminders"""
-    current_date = datetime.now().date()
-    
-    for user_id, user_data in user_database.items():
-        for purchase in user_data.get("purchases", []):
-            if purchase.get("service") == "group" and purchase.get("status") == "completed":
-                # Check if expiry date exists
-                if "expiry_date" in purchase:
-                    expiry_date = datetime.fromisoformat(purchase["expiry_date"]).date()
-                    days_until_expiry = (expiry_date - current_date).days
-                    
-                    # Send reminder 7 days before expiry
-                    if days_until_expiry == 7 and not purchase.get("renewal_reminder_sent"):
-                        await send_subscription_renewal_reminder(
-                            user_id, 
-                            f"{purchase.get('group_name', 'Group')} subscription", 
-                            expiry_date.strftime("%Y-%m-%d")
-                        )
-                        purchase["renewal_reminder_sent"] = True
-                    
-                    # Send final reminder 1 day before expiry
-                    elif days_until_expiry == 1 and not purchase.get("final_reminder_sent"):
-                        await send_subscription_renewal_reminder(
-                            user_id, 
-                            f"{purchase.get('group_name', 'Group')} subscription", 
-                            expiry_date.strftime("%Y-%m-%d")
-                        )
-                        purchase["final_reminder_sent"] = True
-                    
-                    # Process auto-renewal if enabled
-                    elif days_until_expiry == 0 and purchase.get("auto_renew"):
-                        # Logic for auto-renewal would go here
-                        # This would typically involve charging the user and extending their subscription
-                        logger.info(f"Auto-renewal triggered for user {user_id}")
-
-async def background_tasks() -> None:
-    """Run background tasks periodically"""
-    while True:
-        try:
-            await check_pending_payments()
-            await check_subscription_renewals()
-            
-            # Process scheduled broadcasts
-            current_time = datetime.now()
-            to_remove = []
-            
-            for task_id, task in scheduled_tasks.items():
-                if task["type"] == "broadcast" and current_time >= task["scheduled_time"]:
-                    # Execute the scheduled broadcast
-                    sent_count = 0
-                    failed_count = 0
-                    
-                    for user_id in user_database:
-                        try:
-                            await bot.send_message(
-                                user_id,
-                                f"<b>📢 Scheduled Announcement</b>\n\n{task['message']}\n\n<i>To see available services, type /start</i>"
-                            )
-                            sent_count += 1
-                        except Exception as e:
-                            logger.error(f"Failed to send scheduled broadcast to user {user_id}: {e}")
-                            failed_count += 1
-                    
-                    # Notify admin about completion
-                    for admin_id in ADMIN_IDS:
-                        try:
-                            await bot.send_message(
-                                admin_id,
-                                f"Scheduled broadcast completed!\n\nSent to: {sent_count} users\nFailed: {failed_count} users"
-                            )
-                        except Exception:
-                            pass
-                    
-                    to_remove.append(task_id)
-            
-            # Remove completed tasks
-            for task_id in to_remove:
-                del scheduled_tasks[task_id]
-                
-            # Run every 5 minutes
-            await asyncio.sleep(300)
-        except Exception as e:
-            logger.error(f"Error in background tasks: {e}")
-            await asyncio.sleep(60)  # If there's an error, wait a bit before retrying
+    """Send the subscription renewal reminders that are due"""
+    outbox.use_priority(BACKGROUND)
+    # Reminders go out 7 days and 1 day before expiry (see reminders.py);
+    # flush first so the range query sees the latest purchases
+    await store.flush()
+    async for batch in subscription_reminders.due(datetime.now()):
+        for user_id, purchase, expiry_date, action in batch:
+            if action == RENEW:
+                # Logic for auto-renewal would go here
+                # This would typically involve charging the user and extending their subscription
+                logger.info(f"Auto-renewal triggered for user {user_id}")
+                continue
+
+            await send_subscription_renewal_reminder(
+                user_id, 
+                f"{purchase.get('group_name', 'Group')} subscription", 
+                expiry_date.strftime("%Y-%m-%d")
+            )
+            store.mark_purchase(user_id, purchase)
+
+async def run_scheduled_broadcast(task_id: str) -> None:
+    """Hand a due scheduled broadcast to the broadcaster"""
+    task = scheduled_tasks.get(task_id)
+    if task is None:
+        return
+
+    # The broadcaster sends it in the background and reports progress to the
+    # admin who scheduled it; flush first so the newest users are included
+    await store.flush()
+    broadcast_id = await broadcaster.submit(
+        f"<b>📢 Scheduled Announcement</b>\n\n{task['message']}\n\n<i>To see available services, type /start</i>",
+        created_by=task.get("created_by"),
+        report_chat_id=task.get("created_by") or (ADMIN_IDS[0] if ADMIN_IDS else None))
+
+    if broadcast_id is None:
+        # Could not be recorded; try again in a minute
+        schedule_broadcast_task(task_id, datetime.now() + timedelta(minutes=1))
+        return
+
+    del scheduled_tasks[task_id]
+    store.mark_scheduled_task(task_id)
+
+
+def schedule_broadcast_task(task_id: str, when: datetime) -> None:
+    """Arm the one-shot timer for a scheduled broadcast"""
+    scheduler.at(task_id, when, lambda: run_scheduled_broadcast(task_id))
+
+
+def register_jobs() -> None:
+    """Register the periodic jobs and the timers for already scheduled broadcasts"""
+    scheduler.every("pending_payments", PENDING_PAYMENTS_INTERVAL, check_pending_payments)
+    scheduler.every("subscription_renewals", SUBSCRIPTION_RENEWALS_INTERVAL, check_subscription_renewals)
+    for task_id, task in scheduled_tasks.items():
+        if task["type"] == "broadcast":
+            schedule_broadcast_task(task_id, task["scheduled_time"])
+
 
 async def on_startup(bot: Bot) -> None:
     """Actions to perform on startup"""
@@ -2271,9 +2001,6 @@ async def on_startup(bot: Bot) -> None:
                 f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         except Exception as e:
             logger.error(f"Failed to notify admin {admin_id}: {e}")
-    
-    # Start background tasks
-    asyncio.create_task(background_tasks())
 
 
 async def on_shutdown(bot: Bot) -> None:
@@ -2289,14 +2016,88 @@ async def on_shutdown(bot: Bot) -> None:
             logger.error(f"Failed to notify admin {admin_id}: {e}")
 
 
+def setup() -> Tuple[Bot, Dispatcher]:
+    """Create the bot and dispatcher (idempotent)"""
+    global bot, dp
+    if dp is None:
+        bot = Bot(token=API_TOKEN,
+                  default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        bot.session.middleware(coldstart.FirstUpdateProbe())
+        # Every new message (send, forward, copy) and edit is queued and rate limited by the outbox
+        bot.session.middleware(OutboxMiddleware())
+        dp = Dispatcher(storage=storage)
+        # One update at a time per user; runs after the dispatcher's own user/FSM context middlewares
+        dp.update.outer_middleware(mailboxes)
+        # Bounded concurrency by priority class; sheds browsing, then checkout, under overload
+        dp.update.outer_middleware(admission)
+        dp.include_router(router)
+    return bot, dp
+
+
+async def startup() -> Tuple[Bot, Dispatcher]:
+    """Connect to the database, load state and build the bot; the explicit start-up step"""
+    coldstart.mark("imports")
+
+    await db.connect()
+    coldstart.mark("database")
+
+    # Load persisted state and start the write-behind flushers
+    await store.load()
+    aggregates.load(store.transactions)
+    payment_reminders.load()
+    ledger.load()
+    store.start()
+    activity.start()
+    storage.start()
+    await catalog.load()
+    coldstart.mark("state loaded")
+
+    bot, dp = setup()
+    outbox.start()
+    await broadcaster.start(bot)
+    admission.start()
+
+    # Background jobs; startup() is the only place the scheduler is started
+    register_jobs()
+    scheduler.start()
+    return bot, dp
+
+
+async def run(bot: Bot, dp: Dispatcher) -> None:
+    """Receive updates until stopped, by long polling or webhook depending on BOT_MODE"""
+    if webhook.BOT_MODE == "webhook":
+        await webhook.run_webhook(bot, dp)
+    else:
+        # A webhook left registered by a previous deployment blocks getUpdates
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+
+
+async def shutdown() -> None:
+    """Flush buffered writes and close the database before the process exits"""
+    await scheduler.close()
+    await mailboxes.close()
+    await admission.close()
+    await broadcaster.close()
+    await outbox.close()
+    await activity.close()
+    await store.close()
+    await storage.close()
+    await db.close()
+
+
 async def main() -> None:
     """Main function to start the bot"""
+    bot, dp = await startup()
+
     # Set up startup and shutdown handlers
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
-    # Start polling
-    await dp.start_polling(bot)
+    try:
+        await run(bot, dp)
+    finally:
+        await shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from database import db
+from outbox import BULK, outbox
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Broadcast settings: messages in flight at once, users fetched (and
+# checkpointed) per batch, and seconds between progress updates to the admin
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "200"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "10"))
+
+# Outcomes of a single send
+SENT = "sent"
+FAILED = "failed"
+UNREACHABLE = "unreachable"
+
+# Bad Request descriptions that mean the chat itself is gone, not that the message was wrong
+PERMANENT_BAD_REQUESTS = ("chat not found", "user is deactivated", "peer_id_invalid", "bot was blocked")
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """True when retrying a send to this chat can never succeed"""
+    if isinstance(error, TelegramForbiddenError):
+        # Blocked by the user, kicked from the chat, or the account was deleted
+        return True
+    if isinstance(error, TelegramBadRequest):
+        return any(reason in str(error).lower() for reason in PERMANENT_BAD_REQUESTS)
+    return False
+
+
+class BroadcastRun:
+    """Progress of one broadcast, mirrored in its broadcasts row"""
+
+    def __init__(self, record: Dict):
+        self.id = record["id"]
+        self.message = record["message"]
+        self.created_by = record.get("created_by")
+        self.cursor = record.get("last_user_id") or 0
+        self.sent = record.get("sent") or 0
+        self.failed = record.get("failed") or 0
+        self.unreachable = record.get("unreachable") or 0
+        self.report_chat_id = record.get("report_chat_id")
+        self.report_message_id = record.get("report_message_id")
+        self.total = self.sent + self.failed
+        self.started = time.monotonic()
+        self.done_at_start = self.sent + self.failed
+
+    @property
+    def rate(self) -> float:
+        """Messages per second since this process picked the broadcast up"""
+        elapsed = time.monotonic() - self.started
+        return (self.sent + self.failed - self.done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def progress_text(self) -> str:
+        remaining = max(self.total - self.sent - self.failed, 0)
+        eta = f"{int(remaining / self.rate // 60)}m {int(remaining / self.rate % 60)}s" if self.rate else "—"
+        return (f"<b>📣 Broadcast in progress</b>\n\n"
+                f"Sent: {self.sent}\n"
+                f"Failed: {self.failed} ({self.unreachable} unreachable)\n"
+                f"Remaining: {remaining} of {self.total}\n"
+                f"Rate: {self.rate:.1f} msg/s\n"
+                f"ETA: {eta}")
+
+    def summary_text(self) -> str:
+        return (f"Broadcast complete!\n\nSent to: {self.sent} users\nFailed: {self.failed} users\n"
+                f"Newly unreachable: {self.unreachable} users (skipped from now on)")
+
+
+class Broadcaster:
+    """Sends a message to every user concurrently, through the outbox at bulk priority
+
+    Recipients are walked in user_id order, a batch at a time. After each
+    batch the highest user_id below which every recipient has been handled
+    is checkpointed in the broadcasts table, so a broadcast interrupted by a
+    restart resumes from there (a few recipients of the interrupted batch may
+    receive the message twice). The outbox applies the global and per-chat
+    rate limits and waits out RetryAfter, and replies to live users are sent
+    ahead of queued broadcast messages. The admin who started the broadcast
+    gets a progress message that is edited as it runs.
+
+    Failures are split into transient ones (retried by the outbox, then
+    counted as failed) and permanent ones: users who blocked the bot or
+    deleted their account are flagged unreachable and left out of every
+    later audience.
+    """
+
+    def __init__(self, concurrency: int = BROADCAST_CONCURRENCY, batch_size: int = BROADCAST_BATCH_SIZE,
+                 progress_interval: float = BROADCAST_PROGRESS_INTERVAL):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.bot: Optional[Bot] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def running(self) -> List[str]:
+        return list(self._tasks)
+
+    async def start(self, bot: Bot) -> None:
+        """Attach the bot and resume broadcasts interrupted by the last shutdown"""
+        self.bot = bot
+        for record in await db.get_running_broadcasts():
+            if record["id"] not in self._tasks:
+                logger.info(f"Resuming broadcast {record['id']} after user {record['last_user_id']}")
+                self._spawn(BroadcastRun(record))
+
+    async def submit(self, message: str, created_by: Optional[int], report_chat_id: Optional[int] = None) -> Optional[str]:
+        """Record a broadcast and start sending it in the background; returns its ID"""
+        report_chat_id = report_chat_id or created_by
+        record = {
+            "id": f"BC{datetime.now().strftime('%Y%m%d%H%M%S%f')}",
+            "message": message,
+            "created_by": created_by,
+            "report_chat_id": report_chat_id,
+            "report_message_id": None,
+            "created_at": datetime.now()
+        }
+
+        if report_chat_id:
+            try:
+                report = await self.bot.send_message(report_chat_id, "📣 Broadcast started…")
+                record["report_message_id"] = report.message_id
+            except Exception as e:
+                logger.error(f"Failed to send broadcast progress message to {report_chat_id}: {e}")
+
+        if not await db.create_broadcast(record):
+            return None
+        self._spawn(BroadcastRun(record))
+        return record["id"]
+
+    def _spawn(self, run: BroadcastRun) -> None:
+        task = asyncio.create_task(self._run(run))
+        self._tasks[run.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(run.id, None))
+
+    async def _send(self, user_id: int, text: str) -> str:
+        """Deliver one message; returns SENT, FAILED or UNREACHABLE
+
+        The outbox has already retried flood control and network errors, so
+        any error that reaches here is final for this recipient.
+        """
+        try:
+            await self.bot.send_message(user_id, text)
+            return SENT
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            if is_permanent_failure(e):
+                return UNREACHABLE
+            logger.error(f"Broadcast to user {user_id} rejected: {e}")
+            return FAILED
+        except Exception as e:
+            logger.error(f"Failed to send broadcast to user {user_id}: {e}")
+            return FAILED
+
+    async def _send_batch(self, run: BroadcastRun, user_ids: List[int]) -> None:
+        """Send to one batch concurrently, then checkpoint the contiguous finished prefix"""
+        results: Dict[int, str] = {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        def count(outcome: str, step: int) -> None:
+            if outcome == SENT:
+                run.sent += step
+            else:
+                run.failed += step
+                if outcome == UNREACHABLE:
+                    run.unreachable += step
+
+        async def deliver(user_id: int) -> None:
+            async with semaphore:
+                outcome = await self._send(user_id, run.message)
+            results[user_id] = outcome
+            count(outcome, 1)
+
+        try:
+            await asyncio.gather(*(deliver(user_id) for user_id in user_ids))
+        finally:
+            # Recipients past the first unfinished one are sent again on resume,
+            # so take them back out of the counters
+            in_prefix = True
+            for user_id in user_ids:
+                if in_prefix and user_id in results:
+                    run.cursor = user_id
+                    continue
+                in_prefix = False
+                if user_id in results:
+                    count(results[user_id], -1)
+
+            unreachable = [user_id for user_id, outcome in results.items() if outcome == UNREACHABLE]
+            if unreachable:
+                await db.mark_users_unreachable(unreachable)
+            await db.update_broadcast(run.id, {
+                "last_user_id": run.cursor,
+                "sent": run.sent,
+                "failed": run.failed,
+                "unreachable": run.unreachable
+            })
+
+    async def _report(self, run: BroadcastRun, text: str) -> None:
+        """Edit the admin's progress message, or send a new one if there is none"""
+        try:
+            if run.report_message_id:
+                await self.bot.edit_message_text(text, chat_id=run.report_chat_id, message_id=run.report_message_id)
+            elif run.report_chat_id:
+                await self.bot.send_message(run.report_chat_id, text)
+        except TelegramBadRequest:
+            # "message is not modified" or the message was deleted
+            pass
+        except Exception as e:
+            logger.error(f"Failed to report progress of broadcast {run.id}: {e}")
+
+    async def _run(self, run: BroadcastRun) -> None:
+        """Send a broadcast to the end of the users table"""
+        # Every send from this task, including the batches it gathers, queues behind live traffic
+        outbox.use_priority(BULK)
+        run.total = run.sent + run.failed + await db.count_users_after(run.cursor)
+        last_report = time.monotonic()
+
+        while True:
+            user_ids = await db.get_user_ids_after(run.cursor, self.batch_size)
+            if user_ids is None:
+                # Database hiccup; the cursor is safe, try again shortly
+                await asyncio.sleep(5)
+                continue
+            if not user_ids:
+                break
+
+            await self._send_batch(run, user_ids)
+            # Users who joined since the start extend the broadcast
+            run.total = max(run.total, run.sent + run.failed)
+
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                await self._report(run, run.progress_text())
+
+        await db.update_broadcast(run.id, {"status": "completed"})
+        logger.info(f"Broadcast {run.id} completed: {run.sent} sent, {run.failed} failed")
+        await self._report(run, run.summary_text())
+
+    async def close(self) -> None:
+        """Stop running broadcasts; each checkpoints its cursor and resumes on next start"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Create a global broadcaster instance
+broadcaster = Broadcaster()
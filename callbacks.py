@@ -0,0 +1,176 @@
+import inspect
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery
+
+from middlewares import BROWSING
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Telegram rejects callback data longer than this many bytes
+CALLBACK_DATA_LIMIT = 64
+
+SEPARATOR = ":"
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _encode_int(value: int) -> str:
+    """Integers travel in base 36: a 10-digit user ID takes 7 characters"""
+    if value < 0:
+        return "-" + _encode_int(-value)
+    out = ""
+    while True:
+        value, digit = divmod(value, 36)
+        out = _DIGITS[digit] + out
+        if not value:
+            return out
+
+
+def _encode(kind: type, value: Any, last: bool) -> str:
+    if kind is int:
+        return _encode_int(int(value))
+    text = str(value)
+    # Only the last field may contain the separator; parsing stops splitting before it
+    if SEPARATOR in text and not last:
+        raise ValueError(f"Callback field {text!r} contains {SEPARATOR!r}")
+    return text
+
+
+def _decode(kind: type, text: str) -> Any:
+    return int(text, 36) if kind is int else text
+
+
+class Callback(NamedTuple):
+    """Callback data parsed once: the action and its typed fields"""
+    action: str
+    fields: Dict[str, Any]
+
+
+class Action:
+    __slots__ = ("name", "fields", "handler", "wants_state", "legacy", "priority")
+
+    def __init__(self, name: str, fields: Tuple[Tuple[str, type], ...], handler: Callable[..., Awaitable[Any]],
+                 legacy: Optional[str], priority: int):
+        self.name = name
+        self.fields = fields
+        self.handler = handler
+        self.wants_state = "state" in inspect.signature(handler).parameters
+        self.legacy = legacy
+        self.priority = priority
+
+
+class CallbackRouter:
+    """Dispatches callback queries through a hash lookup on the action
+
+    Callback data is "action" or "action:field:field", with integers in base
+    36. It is parsed once into a Callback and the handler is found by its
+    action in a dict, instead of testing a chain of prefix filters in order.
+    Handlers receive the fields as keyword arguments (and the FSM context if
+    they take a state argument).
+
+    Buttons sent before this format (still on old messages, reminders and
+    admin approval requests) are understood through each action's legacy
+    pattern, e.g. "approve_{}_{}". Legacy patterns are tried longest prefix
+    first, so "group_duration_" wins over "group_".
+    """
+
+    def __init__(self):
+        self._actions: Dict[str, Action] = {}
+        self._legacy: List[Tuple[str, str, Action]] = []
+        self.stats = {"dispatched": 0, "legacy": 0, "unknown": 0}
+
+    def action(self, name: str, *fields: Tuple[str, type], legacy: Optional[str] = None,
+               priority: int = BROWSING):
+        """Decorator registering a handler for an action with the given (name, type) fields
+
+        priority is the action's admission class (see middlewares.AdmissionControl).
+        """
+        def decorator(handler):
+            if name in self._actions:
+                raise ValueError(f"Callback action {name!r} is already registered")
+            action = Action(name, fields, handler, legacy, priority)
+            self._actions[name] = action
+            if legacy is not None:
+                prefix, _, rest = legacy.partition("{}")
+                suffix = rest.rpartition("{}")[2] if "{}" in rest else rest
+                self._legacy.append((prefix, suffix, action))
+                self._legacy.sort(key=lambda entry: len(entry[0]), reverse=True)
+            return handler
+        return decorator
+
+    def pack(self, name: str, *values: Any) -> str:
+        """Encode an action and its field values as callback data"""
+        action = self._actions[name]
+        if len(values) != len(action.fields):
+            raise ValueError(f"Callback action {name!r} takes {len(action.fields)} fields, got {len(values)}")
+        last = len(values) - 1
+        data = SEPARATOR.join([name] + [_encode(kind, value, i == last)
+                                        for i, ((_, kind), value) in enumerate(zip(action.fields, values))])
+        if len(data.encode()) > CALLBACK_DATA_LIMIT:
+            raise ValueError(f"Callback data {data!r} is longer than {CALLBACK_DATA_LIMIT} bytes")
+        return data
+
+    def _parse_legacy(self, data: str) -> Optional[Callback]:
+        for prefix, suffix, action in self._legacy:
+            if not data.startswith(prefix) or not data.endswith(suffix) or len(data) < len(prefix) + len(suffix):
+                continue
+            body = data[len(prefix):len(data) - len(suffix)]
+            # Every field but the last is a single "_"-separated word
+            parts = body.split("_", len(action.fields) - 1) if action.fields else []
+            if len(parts) != len(action.fields):
+                continue
+            try:
+                values = {name: int(part) if kind is int else part
+                          for (name, kind), part in zip(action.fields, parts)}
+            except ValueError:
+                continue
+            self.stats["legacy"] += 1
+            return Callback(action.name, values)
+        return None
+
+    def parse(self, data: Optional[str]) -> Optional[Callback]:
+        """Parse callback data, new or legacy format; None when nothing matches"""
+        if not data:
+            return None
+        name, _, rest = data.partition(SEPARATOR)
+        action = self._actions.get(name)
+        if action is not None:
+            parts = rest.split(SEPARATOR, len(action.fields) - 1) if action.fields else []
+            if len(parts) == len(action.fields) and (rest or not action.fields):
+                try:
+                    return Callback(name, {field: _decode(kind, part)
+                                           for (field, kind), part in zip(action.fields, parts)})
+                except ValueError:
+                    return None
+        return self._parse_legacy(data)
+
+    def priority(self, callback: Optional[Callback]) -> int:
+        """Admission class of a parsed callback's action"""
+        return self._actions[callback.action].priority if callback is not None else BROWSING
+
+    async def dispatch(self, call: CallbackQuery, state: FSMContext, callback: Optional[Callback] = None) -> bool:
+        """Run the handler for a callback query; False when the data matches no action
+
+        callback is the query's data already parsed (by the admission
+        classifier); it is parsed here when not given.
+        """
+        if callback is None:
+            callback = self.parse(call.data)
+        if callback is None:
+            self.stats["unknown"] += 1
+            return False
+
+        action = self._actions[callback.action]
+        self.stats["dispatched"] += 1
+        if action.wants_state:
+            await action.handler(call, state=state, **callback.fields)
+        else:
+            await action.handler(call, **callback.fields)
+        return True
+
+
+# Create a global callback router
+callbacks = CallbackRouter()
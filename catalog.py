@@ -0,0 +1,208 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from database import db, format_service_options
+from persistence import _iso, _number
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds a catalog snapshot is served before the next read reloads it, so
+# edits made outside this process still show up
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively turn dicts into read-only mappings and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return _number(value)
+
+
+def _bundle_from_row(row: Dict) -> Dict:
+    """Reshape a bundle row and its aggregated items into the layout the menus use"""
+    items = []
+    for item_row in row["items"]:
+        item = {
+            key: value for key, value in item_row.items()
+            if key not in ("id", "bundle_id", "service", "item_name", "duration")
+        }
+        item["service"] = item_row["service"]
+        if item_row["service"] == "group":
+            item["group_name"] = item_row["item_name"]
+        else:
+            item["name"] = item_row["item_name"]
+        if item_row["duration"]:
+            item["duration"] = item_row["duration"]
+        items.append(item)
+
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "description": row["description"],
+        "items": items,
+        "original_price": row["original_price"],
+        "bundle_price": row["bundle_price"],
+        "discount_percentage": row["discount_percentage"],
+        "created_by": row["created_by"],
+        "created_at": _iso(row["created_at"])
+    }
+
+
+def _offer_from_row(row: Dict) -> Dict:
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "discount": row["discount"],
+        "type": row["type"],
+        "expires": _iso(row["expires"]),
+        "created_by": row["created_by"],
+        "created_at": _iso(row["created_at"])
+    }
+
+
+class CatalogSnapshot:
+    """One immutable, versioned view of everything the menus sell
+
+    Every field is frozen (read-only mappings and tuples), so handlers can
+    hold on to a snapshot across awaits without it changing underneath them.
+    """
+
+    __slots__ = ("version", "generation", "loaded_at", "service_options", "bundles", "bundles_by_id", "offers")
+
+    def __init__(self, version: int, generation: int, data: Dict[str, List[Dict]]):
+        self.version = version
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+        self.service_options: Mapping[str, Any] = _freeze(format_service_options(data["service_options"]))
+        self.bundles: Tuple[Mapping[str, Any], ...] = _freeze([_bundle_from_row(row) for row in data["bundles"]])
+        self.bundles_by_id: Mapping[str, Mapping[str, Any]] = MappingProxyType(
+            {bundle["id"]: bundle for bundle in self.bundles})
+        self.offers: Tuple[Mapping[str, Any], ...] = _freeze([_offer_from_row(row) for row in data["offers"]])
+
+    def active_offers(self, now: Optional[datetime] = None) -> List[Mapping[str, Any]]:
+        """Offers that have not expired yet"""
+        now = (now or datetime.now()).isoformat()
+        return [offer for offer in self.offers if offer["expires"] > now]
+
+
+class Catalog:
+    """In-process cache of the catalog, reloaded as a whole and swapped atomically
+
+    Reads return the current snapshot without touching the database. A
+    snapshot goes stale after ttl seconds or when an admin write goes through
+    one of the write methods below; the next read then reloads it. Concurrent
+    readers that find the snapshot stale share a single in-flight reload.
+    """
+
+    def __init__(self, ttl: float = CATALOG_TTL):
+        self.ttl = ttl
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        # Bumped by every write; a snapshot loaded before the bump is stale
+        self._generation = 0
+        self._reload: Optional[asyncio.Task] = None
+        self.stats = {"reloads": 0, "failures": 0, "joined": 0}
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        """The current snapshot, even if stale; load() must have run first"""
+        if self._snapshot is None:
+            raise RuntimeError("Catalog is not loaded; call catalog.load() first")
+        return self._snapshot
+
+    def _is_fresh(self, snapshot: Optional[CatalogSnapshot]) -> bool:
+        return (snapshot is not None and snapshot.generation == self._generation
+                and time.monotonic() - snapshot.loaded_at < self.ttl)
+
+    async def _load(self) -> Optional[CatalogSnapshot]:
+        """Fetch the catalog and swap in a new snapshot; keeps the old one on failure"""
+        try:
+            generation = self._generation
+            data = await db.load_catalog()
+            if data is None:
+                self.stats["failures"] += 1
+                return None
+
+            self._version += 1
+            snapshot = CatalogSnapshot(self._version, generation, data)
+            self._snapshot = snapshot
+            self.stats["reloads"] += 1
+            logger.info(
+                f"Catalog v{snapshot.version} loaded: {len(snapshot.bundles)} bundles, "
+                f"{len(snapshot.offers)} offers")
+            return snapshot
+        finally:
+            self._reload = None
+
+    async def reload(self) -> Optional[CatalogSnapshot]:
+        """Reload now, joining a reload that is already in flight"""
+        if self._reload is None:
+            self._reload = asyncio.create_task(self._load())
+        else:
+            self.stats["joined"] += 1
+        # Shielded so a cancelled handler does not cancel the reload other readers await
+        return await asyncio.shield(self._reload)
+
+    async def load(self) -> None:
+        """Load the first snapshot at startup"""
+        if await self.reload() is None:
+            logger.error("Could not load the catalog; menus will be empty until it reloads")
+            self._snapshot = CatalogSnapshot(0, -1, {"service_options": [], "bundles": [], "offers": []})
+
+    async def get(self) -> CatalogSnapshot:
+        """The current snapshot, reloading first if it is stale"""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+
+        generation = self._generation
+        while True:
+            snapshot = await self.reload()
+            # A reload that started before the latest write does not count
+            if snapshot is None or snapshot.generation >= generation:
+                return self._snapshot if snapshot is None else snapshot
+
+    async def find_bundles(self, bundle_ids: List[str]) -> Dict[str, Mapping[str, Any]]:
+        """Bundles by ID in the menu layout, fetching retired ones missing from the snapshot in one query"""
+        bundles_by_id = (await self.get()).bundles_by_id
+        found = {bundle_id: bundles_by_id[bundle_id] for bundle_id in bundle_ids if bundle_id in bundles_by_id}
+        missing = [bundle_id for bundle_id in bundle_ids if bundle_id and bundle_id not in found]
+        if missing:
+            rows = await db.get_bundles(missing)
+            found.update({bundle_id: _freeze(_bundle_from_row(row)) for bundle_id, row in rows.items()})
+        return found
+
+    def invalidate(self) -> None:
+        """Mark the current snapshot stale so the next read reloads it"""
+        self._generation += 1
+
+    async def _write(self, result: bool) -> bool:
+        if result:
+            self.invalidate()
+            await self.get()
+        return result
+
+    # Admin writes go to the database first, then swap in a fresh snapshot
+    async def add_service_option(self, option_data: Dict) -> bool:
+        return await self._write(await db.add_service_option(option_data))
+
+    async def update_service_option(self, option_id: int, updates: Dict) -> bool:
+        return await self._write(await db.update_service_option(option_id, updates))
+
+    async def add_bundle(self, bundle_data: Dict) -> bool:
+        return await self._write(await db.add_bundle(bundle_data))
+
+    async def add_limited_time_offer(self, offer_data: Dict) -> bool:
+        return await self._write(await db.add_limited_time_offer(offer_data))
+
+
+# Create a global catalog instance
+catalog = Catalog()
@@ -0,0 +1,73 @@
+import os
+import time
+import logging
+from typing import List, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Budget from process start to the first getUpdates call, in seconds
+COLD_START_BUDGET = float(os.getenv("COLD_START_BUDGET", "5"))
+
+
+def _process_start() -> float:
+    """Process start time on the time.monotonic() clock
+
+    Read from /proc on Linux so interpreter start-up and imports are counted;
+    elsewhere this falls back to the moment this module was imported.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesised command name; starttime is field 22
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - max(age, 0.0)
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+
+
+PROCESS_START = _process_start()
+_phases: List[Tuple[str, float]] = []
+_reported = False
+
+
+def mark(phase: str) -> float:
+    """Record that a start-up phase finished; returns seconds since process start"""
+    elapsed = time.monotonic() - PROCESS_START
+    _phases.append((phase, elapsed))
+    return elapsed
+
+
+def report(final_phase: str) -> None:
+    """Log the cold-start breakdown once, warning when it exceeds the budget"""
+    global _reported
+    if _reported:
+        return
+    _reported = True
+
+    total = mark(final_phase)
+    previous = 0.0
+    breakdown = []
+    for phase, elapsed in _phases:
+        breakdown.append(f"{phase} +{elapsed - previous:.2f}s")
+        previous = elapsed
+
+    message = f"Cold start {total:.2f}s (budget {COLD_START_BUDGET:.2f}s): " + ", ".join(breakdown)
+    if total > COLD_START_BUDGET:
+        logger.warning(message)
+    else:
+        logger.info(message)
+
+
+class FirstUpdateProbe(BaseRequestMiddleware):
+    """Bot session middleware that closes the cold-start clock on the first getUpdates"""
+
+    async def __call__(self, make_request, bot, method):
+        if not _reported and isinstance(method, GetUpdates):
+            report("first getUpdates")
+        return await make_request(bot, method)
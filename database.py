@@ -1,10 +1,20 @@
 import os
 import json
+import time
+import asyncio
+import functools
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 from datetime import datetime
 import logging
-from typing import Dict, List, Any, Optional, Union
+from typing import AsyncIterator, Dict, Iterator, List, Any, Optional, Tuple, Union
+
+from migrations import apply_migrations
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -12,339 +22,336 @@ logger = logging.getLogger(__name__)
 # PostgreSQL connection details from environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+
+# Rows fetched per round trip by the streaming iter_* methods
+DB_ITER_BATCH_SIZE = int(os.getenv("DB_ITER_BATCH_SIZE", "1000"))
+
+# Unique names for server-side cursors
+_cursor_ids = itertools.count(1)
+
+# Queries behind the iter_* methods, shared by Database and AsyncDatabase
+ITER_USERS_QUERY = "SELECT * FROM users ORDER BY user_id"
+ITER_PURCHASES_QUERY = "SELECT * FROM purchases ORDER BY date"
+ITER_TRANSACTIONS_QUERY = "SELECT * FROM transactions ORDER BY created_at"
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class PooledConnection:
+    """Connection proxy whose close() hands the connection back to the pool"""
+
+    def __init__(self, pool: "ConnectionPool", conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def close(self) -> None:
+        """Return the connection to the pool instead of closing it"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections"""
+
+    def __init__(self, dsn: str, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT, health_check_after: float = DB_POOL_HEALTH_CHECK_AFTER):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size} max={max_size}")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+
+        self._idle = deque()  # (connection, returned_at) pairs, most recently used on the right
+        self._size = 0  # Connections currently open, idle or checked out
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "wait_time": 0.0,
+        }
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        """Open a new raw connection and account for it"""
+        conn = psycopg2.connect(self.dsn)
+        with self._cond:
+            self._size += 1
+            self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn) -> None:
+        """Close a connection that must not be reused"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn, idle_for: float) -> bool:
+        """Health check run on checkout; only pings connections that sat idle for a while"""
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    def getconn(self, timeout: Optional[float] = None) -> PooledConnection:
+        """Check out a connection, waiting up to timeout seconds for one to free up"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn = None
+            returned_at = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    if self._idle:
+                        conn, returned_at = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # Reserve the slot before connecting outside the lock
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {timeout}s "
+                            f"({self._size}/{self.max_size} in use)")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = psycopg2.connect(self.dsn)
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+            elif not self._is_healthy(conn, time.monotonic() - returned_at):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._stats["checkouts"] += 1
+                self._stats["wait_time"] += time.monotonic() - started
+            return PooledConnection(self, conn)
+
+    def putconn(self, conn) -> None:
+        """Return a raw connection to the pool, resetting any open transaction"""
+        if self._closed or conn.closed:
+            self._discard(conn)
+            return
+
+        try:
+            if conn.autocommit:
+                conn.autocommit = False
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool usage counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        return stats
+
+    def close(self) -> None:
+        """Close every idle connection; checked-out ones are closed when returned"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+# Bundles with their items as a JSON array, built in a single statement. Each
+# item is the bundle_items row with its metadata object merged into it (the
+# same shape _merge_metadata produces), ordered by item id.
+BUNDLES_QUERY = """
+SELECT b.*, COALESCE(i.items, '[]'::jsonb) AS items
+FROM bundle_packages b
+LEFT JOIN LATERAL (
+    SELECT jsonb_agg(
+        (to_jsonb(bi) - 'metadata') ||
+        CASE WHEN jsonb_typeof(bi.metadata) = 'object' THEN bi.metadata ELSE '{{}}'::jsonb END
+        ORDER BY bi.id
+    ) AS items
+    FROM bundle_items bi
+    WHERE bi.bundle_id = b.id
+) i ON TRUE
+{where}
+ORDER BY b.created_at, b.id
+"""
+
+
+def format_service_options(rows) -> Dict:
+    """Group service_options rows into the nested layout the menus use"""
+    result = {
+        "video_call": {"durations": []},
+        "group": {"names": [], "durations": []},
+        "private_chat": {"durations": [], "types": []},
+        "album": []
+    }
+    for option in rows:
+        service_type, option_type = option["service_type"], option["option_type"]
+        entry = {"name": option["name"], "price": option["price"]}
+        if service_type == "album":
+            result["album"].append(entry)
+        elif service_type == "group" and option_type == "name":
+            result["group"]["names"].append(option["name"])
+        elif service_type in result and f"{option_type}s" in result[service_type]:
+            result[service_type][f"{option_type}s"].append(entry)
+    return result
+
+
+def _merge_metadata(row) -> Dict:
+    """Convert a row to a plain dict with its JSONB metadata fields merged in"""
+    record = dict(row)
+    metadata = record.pop("metadata", None)
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            metadata = None
+    if isinstance(metadata, dict):
+        record.update(metadata)
+    return record
+
+
 class Database:
     def __init__(self):
-        """Initialize database connection"""
+        """Initialize database settings; no connection is made until open()"""
+        self.pool: Optional[ConnectionPool] = None
+        self._open_lock = threading.Lock()
+
+    def open(self) -> None:
+        """Create the connection pool and migrate the schema (idempotent)"""
+        with self._open_lock:
+            if self.pool is not None:
+                return
+            self.pool = ConnectionPool(DATABASE_URL)
         self.initialize_db()
-    
+
     def get_connection(self):
-        """Get database connection with dictionary cursor"""
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-        
+        """Check out a pooled connection; close() returns it to the pool"""
+        if self.pool is None:
+            raise RuntimeError("Database is not open; call open() (or await db.connect()) first")
+        return self.pool.getconn()
+
     def get_cursor(self, conn):
         """Get a dictionary cursor"""
         return conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
+
+    def iter_batches(self, query: str, params: tuple = (), batch_size: Optional[int] = None) -> Iterator[List[Dict]]:
+        """Stream a query through a server-side cursor, batch_size rows at a time
+
+        The pooled connection is held until the generator is exhausted or closed.
+        Errors are logged and re-raised, so a dropped connection is never
+        mistaken for the end of the results.
+        """
+        batch_size = batch_size or DB_ITER_BATCH_SIZE
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor(name=f"stream_{next(_cursor_ids)}", cursor_factory=psycopg2.extras.DictCursor)
+            cursor.itersize = batch_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
+            cursor.close()
+        except Exception as e:
+            logger.error(f"Error streaming query results: {e}")
+            raise
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def close(self) -> None:
+        """Close the connection pool"""
+        if self.pool is None:
+            return
+        logger.info(f"Closing database pool: {self.pool.stats()}")
+        self.pool.close()
+        self.pool = None
+
     def initialize_db(self):
-        """Create database tables if they don't exist"""
+        """Bring the schema up to date by applying any pending migrations"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = self.get_cursor(conn)
-            
-            # Users table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                joined_date TIMESTAMP,
-                language TEXT DEFAULT 'en',
-                last_active TIMESTAMP
-            )
-            ''')
-            
-            # Purchases table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS purchases (
-                purchase_id TEXT PRIMARY KEY,
-                user_id BIGINT,
-                service_type TEXT,
-                price NUMERIC,
-                original_price NUMERIC,
-                status TEXT,
-                date TIMESTAMP,
-                promo_code TEXT,
-                discount_amount NUMERIC,
-                expiry_date TIMESTAMP,
-                renewal_reminder_sent BOOLEAN DEFAULT FALSE,
-                final_reminder_sent BOOLEAN DEFAULT FALSE,
-                auto_renew BOOLEAN DEFAULT FALSE,
-                metadata JSONB DEFAULT '{}',
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-            ''')
-            
-            # Transactions table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                transaction_id TEXT PRIMARY KEY,
-                user_id BIGINT,
-                username TEXT,
-                service TEXT,
-                amount NUMERIC,
-                original_price NUMERIC,
-                payment_method TEXT,
-                payment_type TEXT,
-                status TEXT,
-                created_at TIMESTAMP,
-                updated_at TIMESTAMP,
-                promo_code TEXT,
-                discount_amount NUMERIC,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-            ''')
-            
-            # Pending payments table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pending_payments (
-                transaction_id TEXT PRIMARY KEY,
-                user_id BIGINT,
-                service_type TEXT,
-                price NUMERIC,
-                timestamp TIMESTAMP,
-                reminder_1_sent BOOLEAN DEFAULT FALSE,
-                reminder_2_sent BOOLEAN DEFAULT FALSE,
-                reminder_3_sent BOOLEAN DEFAULT FALSE,
-                payment_confirmed BOOLEAN DEFAULT FALSE,
-                status TEXT DEFAULT 'pending',
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-            ''')
-            
-            # Promo codes table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS promo_codes (
-                code TEXT PRIMARY KEY,
-                discount NUMERIC,
-                type TEXT,
-                expires TIMESTAMP,
-                uses INTEGER DEFAULT 0,
-                max_uses INTEGER,
-                created_by BIGINT,
-                created_at TIMESTAMP
-            )
-            ''')
-            
-            # Bundle packages table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bundle_packages (
-                id TEXT PRIMARY KEY,
-                name TEXT,
-                description TEXT,
-                original_price NUMERIC,
-                bundle_price NUMERIC,
-                discount_percentage INTEGER,
-                created_by BIGINT,
-                created_at TIMESTAMP,
-                active BOOLEAN DEFAULT TRUE
-            )
-            ''')
-            
-            # Bundle items table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bundle_items (
-                id SERIAL PRIMARY KEY,
-                bundle_id TEXT,
-                service TEXT,
-                item_name TEXT,
-                duration TEXT,
-                metadata JSONB DEFAULT '{}',
-                FOREIGN KEY (bundle_id) REFERENCES bundle_packages (id)
-            )
-            ''')
-            
-            # Limited time offers table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS limited_time_offers (
-                id TEXT PRIMARY KEY,
-                name TEXT,
-                discount NUMERIC,
-                type TEXT,
-                expires TIMESTAMP,
-                created_by BIGINT,
-                created_at TIMESTAMP
-            )
-            ''')
-            
-            # Scheduled tasks table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS scheduled_tasks (
-                task_id TEXT PRIMARY KEY,
-                type TEXT,
-                message TEXT,
-                scheduled_time TIMESTAMP,
-                created_by BIGINT,
-                created_at TIMESTAMP,
-                executed BOOLEAN DEFAULT FALSE
-            )
-            ''')
-            
-            # Feedback table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS feedback (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                text TEXT,
-                date TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-            ''')
-            
-            # Service options table
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS service_options (
-                id SERIAL PRIMARY KEY,
-                service_type TEXT,
-                option_type TEXT,
-                name TEXT,
-                price NUMERIC,
-                metadata JSONB DEFAULT '{}'
-            )
-            ''')
-            
-            # Insert default service options if table is empty
-            cursor.execute("SELECT COUNT(*) as count FROM service_options")
-            count = cursor.fetchone()["count"]
-            
-            if count == 0:
-                # Insert video call durations
-                video_call_durations = [
-                    {"name": "15 min", "price": 10},
-                    {"name": "30 min", "price": 15},
-                    {"name": "60 min", "price": 25}
-                ]
-                for option in video_call_durations:
-                    cursor.execute(
-                        "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
-                        ("video_call", "duration", option["name"], option["price"])
-                    )
-                
-                # Insert group names
-                group_names = ["Exclusive", "Ankita's Den"]
-                for name in group_names:
-                    cursor.execute(
-                        "INSERT INTO service_options (service_type, option_type, name) VALUES (%s, %s, %s)",
-                        ("group", "name", name)
-                    )
-                
-                # Insert group durations
-                group_durations = [
-                    {"name": "2 Months", "price": 20},
-                    {"name": "6 Months", "price": 50},
-                    {"name": "12 Months", "price": 90}
-                ]
-                for option in group_durations:
-                    cursor.execute(
-                        "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
-                        ("group", "duration", option["name"], option["price"])
-                    )
-                
-                # Insert chat durations
-                chat_durations = [
-                    {"name": "2 Hr", "price": 20},
-                    {"name": "4 Hr", "price": 35}
-                ]
-                for option in chat_durations:
-                    cursor.execute(
-                        "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
-                        ("private_chat", "duration", option["name"], option["price"])
-                    )
-                
-                # Insert chat types
-                chat_types = [
-                    {"name": "Sx Chat with Notes", "price": 60},
-                    {"name": "Normal Chat", "price": 35}
-                ]
-                for option in chat_types:
-                    cursor.execute(
-                        "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
-                        ("private_chat", "type", option["name"], option["price"])
-                    )
-                
-                # Insert album options
-                album_options = [
-                    {"name": "Node Pic Full Collection (300+)", "price": 30},
-                    {"name": "Node Pic + Vid Full Collection (800+)", "price": 60},
-                    {"name": "My Exclusive Bj Vids (50 Vids)", "price": 50},
-                    {"name": "Master Album (All-in-One)", "price": 90}
-                ]
-                for option in album_options:
-                    cursor.execute(
-                        "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
-                        ("album", "album", option["name"], option["price"])
-                    )
-            
-            # Insert default bundles if table is empty
-            cursor.execute("SELECT COUNT(*) as count FROM bundle_packages")
-            count = cursor.fetchone()["count"]
-            
-            if count == 0:
-                # Insert default bundles
-                bundles = [
-                    {
-                        "id": "bundle1",
-                        "name": "Starter Bundle",
-                        "description": "1 Month Group + 1 Album",
-                        "original_price": 50,
-                        "bundle_price": 40,
-                        "discount_percentage": 20,
-                        "created_by": 0,
-                        "created_at": datetime.now(),
-                        "items": [
-                            {"service": "group", "item_name": "Exclusive", "duration": "2 Months"},
-                            {"service": "album", "item_name": "Node Pic Full Collection (300+)"}
-                        ]
-                    },
-                    {
-                        "id": "bundle2",
-                        "name": "Premium Bundle",
-                        "description": "6 Months Group + Master Album",
-                        "original_price": 140,
-                        "bundle_price": 110,
-                        "discount_percentage": 21,
-                        "created_by": 0,
-                        "created_at": datetime.now(),
-                        "items": [
-                            {"service": "group", "item_name": "Ankita's Den", "duration": "6 Months"},
-                            {"service": "album", "item_name": "Master Album (All-in-One)"}
-                        ]
-                    }
-                ]
-                
-                for bundle in bundles:
-                    cursor.execute(
-                        """INSERT INTO bundle_packages 
-                        (id, name, description, original_price, bundle_price, discount_percentage, created_by, created_at) 
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                        (
-                            bundle["id"], 
-                            bundle["name"], 
-                            bundle["description"], 
-                            bundle["original_price"], 
-                            bundle["bundle_price"], 
-                            bundle["discount_percentage"], 
-                            bundle["created_by"], 
-                            bundle["created_at"]
-                        )
-                    )
-                    
-                    # Insert bundle items
-                    for item in bundle["items"]:
-                        metadata = json.dumps({k: v for k, v in item.items() if k not in ["service", "item_name", "duration"]})
-                        cursor.execute(
-                            """INSERT INTO bundle_items 
-                            (bundle_id, service, item_name, duration, metadata) 
-                            VALUES (%s, %s, %s, %s, %s)""",
-                            (
-                                bundle["id"],
-                                item["service"],
-                                item["item_name"],
-                                item.get("duration", ""),
-                                metadata
-                            )
-                        )
-            
-            conn.commit()
-            logger.info("Database initialized successfully")
+            applied = apply_migrations(conn)
+            logger.info(f"Database initialized successfully ({applied} migrations applied)")
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     # User methods
     def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
+        conn = None
         try:
             conn = self.get_connection()
             cursor = self.get_cursor(conn)
@@ -354,41 +361,51 @@ class Database:
             logger.error(f"Error getting user {user_id}: {e}")
             return None
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def add_user(self, user_id: int, username: str, first_name: str) -> bool:
         """Add new user or update existing user"""
+        return self.upsert_user_activity([(user_id, username, first_name, datetime.now())]) is not None
+
+    def upsert_user_activity(self, rows: List[tuple], page_size: int = 1000) -> Optional[int]:
+        """Insert or refresh users from (user_id, username, first_name, last_active) rows
+
+        Runs as multi-row INSERT ... ON CONFLICT DO UPDATE statements of up to
+        page_size rows each. An active user can be messaged again, so this
+        also clears the unreachable flag left by an earlier failed send.
+        Returns the number of rows written, or None on error.
+        """
+        conn = None
         try:
             conn = self.get_connection()
             cursor = self.get_cursor(conn)
-            
-            # Check if user exists
-            cursor.execute("SELECT user_id FROM users WHERE user_id = %s", (user_id,))
-            existing_user = cursor.fetchone()
-            
-            if existing_user:
-                # Update existing user
-                cursor.execute(
-                    "UPDATE users SET username = %s, first_name = %s, last_active = %s WHERE user_id = %s",
-                    (username, first_name, datetime.now(), user_id)
-                )
-            else:
-                # Add new user
-                cursor.execute(
-                    "INSERT INTO users (user_id, username, first_name, joined_date, last_active) VALUES (%s, %s, %s, %s, %s)",
-                    (user_id, username, first_name, datetime.now(), datetime.now())
-                )
-            
+            psycopg2.extras.execute_values(
+                cursor,
+                """INSERT INTO users (user_id, username, first_name, joined_date, last_active)
+                VALUES %s
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = EXCLUDED.username,
+                    first_name = EXCLUDED.first_name,
+                    last_active = GREATEST(users.last_active, EXCLUDED.last_active),
+                    reachable = TRUE,
+                    unreachable_since = NULL""",
+                [(user_id, username, first_name, last_active, last_active)
+                 for user_id, username, first_name, last_active in rows],
+                page_size=page_size
+            )
             conn.commit()
-            return True
+            return len(rows)
         except Exception as e:
-            logger.error(f"Error adding/updating user {user_id}: {e}")
-            return False
+            logger.error(f"Error upserting activity for {len(rows)} users: {e}")
+            return None
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def update_user_language(self, user_id: int, language: str) -> bool:
         """Update user's preferred language"""
+        conn = None
         try:
             conn = self.get_connection()
             cursor = self.get_cursor(conn)
@@ -402,10 +419,12 @@ class Database:
             logger.error(f"Error updating language for user {user_id}: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_user_language(self, user_id: int) -> str:
         """Get user's preferred language"""
+        conn = None
         try:
             conn = self.get_connection()
             cursor = self.get_cursor(conn)
@@ -416,10 +435,12 @@ class Database:
             logger.error(f"Error getting language for user {user_id}: {e}")
             return "en"
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_all_users(self) -> List[Dict]:
         """Get all users"""
+        conn = None
         try:
             conn = self.get_connection()
             cursor = self.get_cursor(conn)
@@ -429,11 +450,18 @@ class Database:
             logger.error(f"Error getting all users: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
+    def iter_users(self, batch_size: Optional[int] = None) -> Iterator[Dict]:
+        """Stream all users without loading the whole table"""
+        for batch in self.iter_batches(ITER_USERS_QUERY, (), batch_size):
+            yield from batch
+
     # Purchase methods
     def add_purchase(self, purchase_data: Dict) -> bool:
         """Add new purchase"""
+        conn = None
         try:
             conn = self.get_connection()
             cursor = self.get_cursor(conn)
@@ -480,10 +508,12 @@ class Database:
             logger.error(f"Error adding purchase: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def update_purchase_status(self, purchase_id: str, status: str) -> bool:
         """Update purchase status"""
+        conn = None
         try:
             conn = self.get_connection()
             cursor = self.get_cursor(conn)
@@ -497,86 +527,78 @@ class Database:
             logger.error(f"Error updating purchase status: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_user_purchases(self, user_id: int) -> List[Dict]:
         """Get all purchases for a user"""
+        conn = None
         try:
             conn = self.get_connection()
             cursor = self.get_cursor(conn)
             cursor.execute("SELECT * FROM purchases WHERE user_id = %s ORDER BY date DESC", (user_id,))
-            purchases = cursor.fetchall()
-            
-            # Parse metadata JSON
-            for purchase in purchases:
-                if "metadata" in purchase and purchase["metadata"]:
-                    try:
-                        metadata = json.loads(purchase["metadata"])
-                        purchase.update(metadata)
-                    except:
-                        pass
-                purchase.pop("metadata", None)
-            
-            return purchases
+            return [_merge_metadata(purchase) for purchase in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Error getting purchases for user {user_id}: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
-    def get_expiring_subscriptions(self, days_threshold: int) -> List[Dict]:
-        """Get subscriptions expiring within the given days threshold"""
+    def iter_purchases(self, batch_size: Optional[int] = None) -> Iterator[Dict]:
+        """Stream all purchases, oldest first, with their metadata merged in"""
+        for batch in self.iter_batches(ITER_PURCHASES_QUERY, (), batch_size):
+            yield from (_merge_metadata(row) for row in batch)
+
+    def get_expiring_subscriptions(self, start: datetime, end: datetime,
+                                   after: Optional[Tuple[datetime, str]] = None,
+                                   limit: int = DB_ITER_BATCH_SIZE) -> List[Dict]:
+        """Get completed group subscriptions expiring in (start, end] that still owe a reminder
+        or have auto-renew on, soonest first. Pages by keyset: pass the (expiry_date,
+        purchase_id) of the last row returned as after."""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # Calculate date threshold
-            today = datetime.now().date()
-            target_date = (today + datetime.timedelta(days=days_threshold)).isoformat()
+            cursor = self.get_cursor(conn)
             
+            # Range scan over idx_purchases_expiry
             cursor.execute(
-                """SELECT p.*, u.user_id, u.username, u.language 
+                """SELECT p.*, u.username, u.language 
                 FROM purchases p
                 JOIN users u ON p.user_id = u.user_id
                 WHERE p.service_type = 'group' 
                 AND p.status = 'completed'
-                AND p.expiry_date <= ?
-                AND p.expiry_date >= ?
+                AND p.expiry_date > %s
+                AND p.expiry_date <= %s
+                AND (p.expiry_date, p.purchase_id) > (%s, %s)
+                AND (p.auto_renew OR NOT p.renewal_reminder_sent OR NOT p.final_reminder_sent)
+                ORDER BY p.expiry_date, p.purchase_id
+                LIMIT %s
                 """, 
-                (target_date, today.isoformat())
+                (start, end, *(after or (start, "")), limit)
             )
             
-            subscriptions = cursor.fetchall()
-            
-            # Parse metadata JSON
-            for subscription in subscriptions:
-                if "metadata" in subscription and subscription["metadata"]:
-                    try:
-                        metadata = json.loads(subscription["metadata"])
-                        subscription.update(metadata)
-                    except:
-                        pass
-                subscription.pop("metadata", None)
-            
-            return subscriptions
+            return [_merge_metadata(row) for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Error getting expiring subscriptions: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     # Transaction methods
     def add_transaction(self, transaction_data: Dict) -> bool:
         """Add new transaction"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             cursor.execute(
                 """INSERT INTO transactions 
                 (transaction_id, user_id, username, service, amount, original_price, 
                 payment_method, payment_type, status, created_at, updated_at, promo_code, discount_amount) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
                 (
                     transaction_data["transaction_id"],
                     transaction_data["user_id"],
@@ -600,15 +622,17 @@ class Database:
             logger.error(f"Error adding transaction: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def update_transaction_status(self, transaction_id: str, status: str) -> bool:
         """Update transaction status"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "UPDATE transactions SET status = ?, updated_at = ? WHERE transaction_id = ?",
+                "UPDATE transactions SET status = %s, updated_at = %s WHERE transaction_id = %s",
                 (status, datetime.now().isoformat(), transaction_id)
             )
             conn.commit()
@@ -617,45 +641,56 @@ class Database:
             logger.error(f"Error updating transaction status: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_transaction(self, transaction_id: str) -> Optional[Dict]:
         """Get transaction by ID"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM transactions WHERE transaction_id = ?", (transaction_id,))
+            cursor = self.get_cursor(conn)
+            cursor.execute("SELECT * FROM transactions WHERE transaction_id = %s", (transaction_id,))
             return cursor.fetchone()
         except Exception as e:
             logger.error(f"Error getting transaction {transaction_id}: {e}")
             return None
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_all_transactions(self) -> List[Dict]:
         """Get all transactions"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             cursor.execute("SELECT * FROM transactions ORDER BY created_at DESC")
             return cursor.fetchall()
         except Exception as e:
             logger.error(f"Error getting all transactions: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
+    def iter_transactions(self, batch_size: Optional[int] = None) -> Iterator[Dict]:
+        """Stream all transactions, oldest first, without loading the whole table"""
+        for batch in self.iter_batches(ITER_TRANSACTIONS_QUERY, (), batch_size):
+            yield from batch
+
     # Pending payment methods
     def add_pending_payment(self, payment_data: Dict) -> bool:
         """Add new pending payment"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             cursor.execute(
                 """INSERT INTO pending_payments 
                 (transaction_id, user_id, service_type, price, timestamp) 
-                VALUES (?, ?, ?, ?, ?)""",
+                VALUES (%s, %s, %s, %s, %s)""",
                 (
                     payment_data["transaction_id"],
                     payment_data["user_id"],
@@ -671,19 +706,21 @@ class Database:
             logger.error(f"Error adding pending payment: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def update_pending_payment(self, transaction_id: str, updates: Dict) -> bool:
         """Update pending payment fields"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
-            set_clause = ", ".join([f"{key} = ?" for key in updates.keys()])
+            set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
             params = list(updates.values()) + [transaction_id]
             
             cursor.execute(
-                f"UPDATE pending_payments SET {set_clause} WHERE transaction_id = ?",
+                f"UPDATE pending_payments SET {set_clause} WHERE transaction_id = %s",
                 params
             )
             
@@ -693,35 +730,41 @@ class Database:
             logger.error(f"Error updating pending payment {transaction_id}: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def delete_pending_payment(self, transaction_id: str) -> bool:
         """Delete pending payment"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM pending_payments WHERE transaction_id = ?", (transaction_id,))
+            cursor = self.get_cursor(conn)
+            cursor.execute("DELETE FROM pending_payments WHERE transaction_id = %s", (transaction_id,))
             conn.commit()
             return True
         except Exception as e:
             logger.error(f"Error deleting pending payment {transaction_id}: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
-    def get_pending_payments_for_reminders(self) -> List[Dict]:
-        """Get pending payments that need reminders"""
+    def get_pending_payments_for_reminders(self, until: Optional[datetime] = None) -> List[Dict]:
+        """Get pending payments whose next reminder or expiry is due, soonest first"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
-            # Get all pending payments
+            # Range scan over idx_pending_payments_next_action
             cursor.execute(
                 """SELECT p.*, u.user_id, u.username, u.language 
                 FROM pending_payments p
                 JOIN users u ON p.user_id = u.user_id
-                WHERE p.payment_confirmed = 0
-                """
+                WHERE p.next_action_at <= %s AND p.payment_confirmed = FALSE
+                ORDER BY p.next_action_at
+                """,
+                (until or datetime.now(),)
             )
             
             return cursor.fetchall()
@@ -729,19 +772,21 @@ class Database:
             logger.error(f"Error getting pending payments for reminders: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     # Promo code methods
     def add_promo_code(self, promo_data: Dict) -> bool:
         """Add new promo code"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             cursor.execute(
                 """INSERT INTO promo_codes 
                 (code, discount, type, expires, max_uses, created_by, created_at) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                VALUES (%s, %s, %s, %s, %s, %s, %s)""",
                 (
                     promo_data["code"],
                     promo_data["discount"],
@@ -759,28 +804,32 @@ class Database:
             logger.error(f"Error adding promo code: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_promo_code(self, code: str) -> Optional[Dict]:
         """Get promo code by code"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM promo_codes WHERE code = ?", (code,))
+            cursor = self.get_cursor(conn)
+            cursor.execute("SELECT * FROM promo_codes WHERE code = %s", (code,))
             return cursor.fetchone()
         except Exception as e:
             logger.error(f"Error getting promo code {code}: {e}")
             return None
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def increment_promo_usage(self, code: str) -> bool:
         """Increment promo code usage count"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "UPDATE promo_codes SET uses = uses + 1 WHERE code = ?",
+                "UPDATE promo_codes SET uses = uses + 1 WHERE code = %s",
                 (code,)
             )
             conn.commit()
@@ -789,102 +838,79 @@ class Database:
             logger.error(f"Error incrementing promo code usage {code}: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_all_promo_codes(self) -> List[Dict]:
         """Get all promo codes"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             cursor.execute("SELECT * FROM promo_codes ORDER BY created_at DESC")
             return cursor.fetchall()
         except Exception as e:
             logger.error(f"Error getting all promo codes: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     # Bundle methods
+    def _fetch_bundles(self, cursor, where: str = "", params: tuple = ()) -> List[Dict]:
+        """Fetch bundles with their items in one round trip, aggregated server-side"""
+        cursor.execute(BUNDLES_QUERY.format(where=where), params)
+        return [dict(row) for row in cursor.fetchall()]
+
     def get_all_bundles(self) -> List[Dict]:
         """Get all bundle packages with their items"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # Get all active bundles
-            cursor.execute("SELECT * FROM bundle_packages WHERE active = 1")
-            bundles = cursor.fetchall()
-            
-            # Get items for each bundle
-            for bundle in bundles:
-                cursor.execute("SELECT * FROM bundle_items WHERE bundle_id = ?", (bundle["id"],))
-                items = cursor.fetchall()
-                
-                # Parse metadata JSON for each item
-                for item in items:
-                    if "metadata" in item and item["metadata"]:
-                        try:
-                            metadata = json.loads(item["metadata"])
-                            item.update(metadata)
-                        except:
-                            pass
-                    item.pop("metadata", None)
-                
-                bundle["items"] = items
-            
-            return bundles
+            cursor = self.get_cursor(conn)
+            return self._fetch_bundles(cursor, "WHERE b.active = TRUE")
         except Exception as e:
             logger.error(f"Error getting all bundles: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_bundle(self, bundle_id: str) -> Optional[Dict]:
         """Get bundle by ID with its items"""
+        return self.get_bundles([bundle_id]).get(bundle_id)
+
+    def get_bundles(self, bundle_ids: List[str]) -> Dict[str, Dict]:
+        """Get several bundles with their items in one query, keyed by bundle ID"""
+        bundle_ids = list(dict.fromkeys(bundle_ids))
+        if not bundle_ids:
+            return {}
+
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # Get bundle
-            cursor.execute("SELECT * FROM bundle_packages WHERE id = ?", (bundle_id,))
-            bundle = cursor.fetchone()
-            
-            if not bundle:
-                return None
-            
-            # Get items
-            cursor.execute("SELECT * FROM bundle_items WHERE bundle_id = ?", (bundle_id,))
-            items = cursor.fetchall()
-            
-            # Parse metadata JSON for each item
-            for item in items:
-                if "metadata" in item and item["metadata"]:
-                    try:
-                        metadata = json.loads(item["metadata"])
-                        item.update(metadata)
-                    except:
-                        pass
-                item.pop("metadata", None)
-            
-            bundle["items"] = items
-            return bundle
+            cursor = self.get_cursor(conn)
+            bundles = self._fetch_bundles(cursor, "WHERE b.id = ANY(%s)", (bundle_ids,))
+            return {bundle["id"]: bundle for bundle in bundles}
         except Exception as e:
-            logger.error(f"Error getting bundle {bundle_id}: {e}")
-            return None
+            logger.error(f"Error getting bundles {bundle_ids}: {e}")
+            return {}
         finally:
-            conn.close()
-    
+            if conn is not None:
+                conn.close()
+
     def add_bundle(self, bundle_data: Dict) -> bool:
         """Add new bundle package with its items"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             # Insert bundle
             cursor.execute(
                 """INSERT INTO bundle_packages 
                 (id, name, description, original_price, bundle_price, discount_percentage, created_by, created_at) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
                 (
                     bundle_data["id"],
                     bundle_data["name"],
@@ -904,7 +930,7 @@ class Database:
                 cursor.execute(
                     """INSERT INTO bundle_items 
                     (bundle_id, service, item_name, duration, metadata) 
-                    VALUES (?, ?, ?, ?, ?)""",
+                    VALUES (%s, %s, %s, %s, %s)""",
                     (
                         bundle_data["id"],
                         item["service"],
@@ -920,19 +946,21 @@ class Database:
             logger.error(f"Error adding bundle: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     # Limited time offer methods
     def add_limited_time_offer(self, offer_data: Dict) -> bool:
         """Add new limited time offer"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             cursor.execute(
                 """INSERT INTO limited_time_offers 
                 (id, name, discount, type, expires, created_by, created_at) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                VALUES (%s, %s, %s, %s, %s, %s, %s)""",
                 (
                     offer_data["id"],
                     offer_data["name"],
@@ -950,17 +978,19 @@ class Database:
             logger.error(f"Error adding limited time offer: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_active_offers(self) -> List[Dict]:
         """Get active limited time offers"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             current_time = datetime.now().isoformat()
             cursor.execute(
-                "SELECT * FROM limited_time_offers WHERE expires > ?",
+                "SELECT * FROM limited_time_offers WHERE expires > %s",
                 (current_time,)
             )
             
@@ -969,19 +999,21 @@ class Database:
             logger.error(f"Error getting active offers: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     # Scheduled task methods
     def add_scheduled_task(self, task_data: Dict) -> bool:
         """Add new scheduled task"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             cursor.execute(
                 """INSERT INTO scheduled_tasks 
                 (task_id, type, message, scheduled_time, created_by, created_at) 
-                VALUES (?, ?, ?, ?, ?, ?)""",
+                VALUES (%s, %s, %s, %s, %s, %s)""",
                 (
                     task_data["task_id"],
                     task_data["type"],
@@ -998,17 +1030,19 @@ class Database:
             logger.error(f"Error adding scheduled task: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_pending_tasks(self) -> List[Dict]:
         """Get pending scheduled tasks that are due"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             current_time = datetime.now().isoformat()
             cursor.execute(
-                "SELECT * FROM scheduled_tasks WHERE executed = 0 AND scheduled_time <= ?",
+                "SELECT * FROM scheduled_tasks WHERE executed = FALSE AND scheduled_time <= %s",
                 (current_time,)
             )
             
@@ -1017,15 +1051,17 @@ class Database:
             logger.error(f"Error getting pending tasks: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def mark_task_executed(self, task_id: str) -> bool:
         """Mark scheduled task as executed"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "UPDATE scheduled_tasks SET executed = 1 WHERE task_id = ?",
+                "UPDATE scheduled_tasks SET executed = TRUE WHERE task_id = %s",
                 (task_id,)
             )
             conn.commit()
@@ -1034,17 +1070,19 @@ class Database:
             logger.error(f"Error marking task {task_id} as executed: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     # Feedback methods
     def add_feedback(self, user_id: int, text: str) -> bool:
         """Add user feedback"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             cursor.execute(
-                "INSERT INTO feedback (user_id, text, date) VALUES (?, ?, ?)",
+                "INSERT INTO feedback (user_id, text, date) VALUES (%s, %s, %s)",
                 (user_id, text, datetime.now().isoformat())
             )
             
@@ -1054,15 +1092,17 @@ class Database:
             logger.error(f"Error adding feedback for user {user_id}: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def get_user_feedback(self, user_id: int) -> List[Dict]:
         """Get all feedback from a user"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "SELECT * FROM feedback WHERE user_id = ? ORDER BY date DESC",
+                "SELECT * FROM feedback WHERE user_id = %s ORDER BY date DESC",
                 (user_id,)
             )
             return cursor.fetchall()
@@ -1070,14 +1110,16 @@ class Database:
             logger.error(f"Error getting feedback for user {user_id}: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     # Service options methods
     def get_service_options(self, service_type: str = None, option_type: str = None) -> List[Dict]:
         """Get service options, optionally filtered by service type and option type"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             query = "SELECT * FROM service_options"
             params = []
@@ -1086,14 +1128,14 @@ class Database:
                 query += " WHERE"
                 
                 if service_type:
-                    query += " service_type = ?"
+                    query += " service_type = %s"
                     params.append(service_type)
                     
                     if option_type:
-                        query += " AND option_type = ?"
+                        query += " AND option_type = %s"
                         params.append(option_type)
                 elif option_type:
-                    query += " option_type = ?"
+                    query += " option_type = %s"
                     params.append(option_type)
             
             cursor.execute(query, params)
@@ -1102,13 +1144,15 @@ class Database:
             logger.error(f"Error getting service options: {e}")
             return []
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def add_service_option(self, option_data: Dict) -> bool:
         """Add new service option"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
             metadata = {k: v for k, v in option_data.items() if k not in [
                 "service_type", "option_type", "name", "price"
@@ -1117,7 +1161,7 @@ class Database:
             cursor.execute(
                 """INSERT INTO service_options 
                 (service_type, option_type, name, price, metadata) 
-                VALUES (?, ?, ?, ?, ?)""",
+                VALUES (%s, %s, %s, %s, %s)""",
                 (
                     option_data["service_type"],
                     option_data["option_type"],
@@ -1133,19 +1177,21 @@ class Database:
             logger.error(f"Error adding service option: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
     def update_service_option(self, option_id: int, updates: Dict) -> bool:
         """Update service option"""
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_cursor(conn)
             
-            set_clause = ", ".join([f"{key} = ?" for key in updates.keys()])
+            set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
             params = list(updates.values()) + [option_id]
             
             cursor.execute(
-                f"UPDATE service_options SET {set_clause} WHERE id = ?",
+                f"UPDATE service_options SET {set_clause} WHERE id = %s",
                 params
             )
             
@@ -1155,90 +1201,666 @@ class Database:
             logger.error(f"Error updating service option {option_id}: {e}")
             return False
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
     
-    # Helper methods to convert between database and in-memory formats
-    def get_all_service_options_formatted(self) -> Dict:
-        """Get all service options formatted as in the original code"""
+    # Bulk state methods used by the write-behind store
+    def load_state(self) -> Optional[Dict[str, List[Dict]]]:
+        """Load the small persisted bot stores in one pass, as plain dicts
+
+        Users, purchases and transactions can be large; the store streams
+        them with iter_users, iter_purchases and iter_transactions instead.
+        """
+        conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            result = {
-                "video_call": {"durations": []},
-                "group": {"names": [], "durations": []},
-                "private_chat": {"durations": [], "types": []},
-                "album": []
-            }
-            
-            # Get video call durations
+            cursor = self.get_cursor(conn)
+            state = {}
+
+            cursor.execute("SELECT * FROM pending_payments")
+            state["pending_payments"] = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute("SELECT * FROM promo_codes")
+            state["promo_codes"] = [dict(row) for row in cursor.fetchall()]
+
+
+            cursor.execute("SELECT * FROM scheduled_tasks WHERE executed = FALSE")
+            state["scheduled_tasks"] = [dict(row) for row in cursor.fetchall()]
+
+            return state
+        except Exception as e:
+            logger.error(f"Error loading bot state: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def write_batch(self, batch: Dict[str, List]) -> bool:
+        """Apply a batch of buffered writes in a single transaction
+
+        Keys are optional; rows are tuples in the column order of the
+        statements below. Tables are written parent-first so foreign keys hold.
+        """
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
+            execute_values = psycopg2.extras.execute_values
+
+            if batch.get("user_ids"):
+                # Make sure every referenced user exists before child rows land
+                execute_values(
+                    cursor,
+                    "INSERT INTO users (user_id, joined_date) VALUES %s ON CONFLICT (user_id) DO NOTHING",
+                    [(user_id, datetime.now()) for user_id in batch["user_ids"]]
+                )
+
+            if batch.get("users"):
+                execute_values(
+                    cursor,
+                    """INSERT INTO users (user_id, username, first_name, joined_date, language, active_promos)
+                    VALUES %s
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        username = EXCLUDED.username,
+                        first_name = COALESCE(EXCLUDED.first_name, users.first_name),
+                        joined_date = COALESCE(users.joined_date, EXCLUDED.joined_date),
+                        language = EXCLUDED.language,
+                        active_promos = EXCLUDED.active_promos""",
+                    batch["users"]
+                )
+
+            if batch.get("purchases"):
+                execute_values(
+                    cursor,
+                    """INSERT INTO purchases
+                    (purchase_id, user_id, service_type, price, original_price, status, date, promo_code,
+                    discount_amount, expiry_date, renewal_reminder_sent, final_reminder_sent, auto_renew, metadata)
+                    VALUES %s
+                    ON CONFLICT (purchase_id) DO UPDATE SET
+                        service_type = EXCLUDED.service_type,
+                        price = EXCLUDED.price,
+                        original_price = EXCLUDED.original_price,
+                        status = EXCLUDED.status,
+                        promo_code = EXCLUDED.promo_code,
+                        discount_amount = EXCLUDED.discount_amount,
+                        expiry_date = EXCLUDED.expiry_date,
+                        renewal_reminder_sent = EXCLUDED.renewal_reminder_sent,
+                        final_reminder_sent = EXCLUDED.final_reminder_sent,
+                        auto_renew = EXCLUDED.auto_renew,
+                        metadata = EXCLUDED.metadata""",
+                    batch["purchases"]
+                )
+
+            if batch.get("transactions"):
+                execute_values(
+                    cursor,
+                    """INSERT INTO transactions
+                    (transaction_id, user_id, username, service, amount, original_price, payment_method,
+                    payment_type, status, created_at, updated_at, promo_code, discount_amount)
+                    VALUES %s
+                    ON CONFLICT (transaction_id) DO UPDATE SET
+                        service = EXCLUDED.service,
+                        amount = EXCLUDED.amount,
+                        original_price = EXCLUDED.original_price,
+                        payment_method = EXCLUDED.payment_method,
+                        payment_type = EXCLUDED.payment_type,
+                        status = EXCLUDED.status,
+                        updated_at = EXCLUDED.updated_at,
+                        promo_code = EXCLUDED.promo_code,
+                        discount_amount = EXCLUDED.discount_amount""",
+                    batch["transactions"]
+                )
+
+            if batch.get("pending_payments"):
+                execute_values(
+                    cursor,
+                    """INSERT INTO pending_payments
+                    (transaction_id, user_id, service_type, price, timestamp, reminder_1_sent,
+                    reminder_2_sent, reminder_3_sent, payment_confirmed, status, next_action_at)
+                    VALUES %s
+                    ON CONFLICT (transaction_id) DO UPDATE SET
+                        service_type = EXCLUDED.service_type,
+                        price = EXCLUDED.price,
+                        reminder_1_sent = EXCLUDED.reminder_1_sent,
+                        reminder_2_sent = EXCLUDED.reminder_2_sent,
+                        reminder_3_sent = EXCLUDED.reminder_3_sent,
+                        payment_confirmed = EXCLUDED.payment_confirmed,
+                        status = EXCLUDED.status,
+                        next_action_at = EXCLUDED.next_action_at""",
+                    batch["pending_payments"]
+                )
+
+            if batch.get("deleted_pending_payments"):
+                cursor.execute(
+                    "DELETE FROM pending_payments WHERE transaction_id = ANY(%s)",
+                    (list(batch["deleted_pending_payments"]),)
+                )
+
+            if batch.get("promo_codes"):
+                execute_values(
+                    cursor,
+                    """INSERT INTO promo_codes
+                    (code, discount, type, expires, uses, max_uses, created_by, created_at)
+                    VALUES %s
+                    ON CONFLICT (code) DO UPDATE SET
+                        discount = EXCLUDED.discount,
+                        type = EXCLUDED.type,
+                        expires = EXCLUDED.expires,
+                        uses = EXCLUDED.uses,
+                        max_uses = EXCLUDED.max_uses""",
+                    batch["promo_codes"]
+                )
+
+            if batch.get("scheduled_tasks"):
+                execute_values(
+                    cursor,
+                    """INSERT INTO scheduled_tasks (task_id, type, message, scheduled_time, created_by, created_at)
+                    VALUES %s
+                    ON CONFLICT (task_id) DO UPDATE SET
+                        message = EXCLUDED.message,
+                        scheduled_time = EXCLUDED.scheduled_time""",
+                    batch["scheduled_tasks"]
+                )
+
+            if batch.get("executed_tasks"):
+                cursor.execute(
+                    "UPDATE scheduled_tasks SET executed = TRUE WHERE task_id = ANY(%s)",
+                    (list(batch["executed_tasks"]),)
+                )
+
+            if batch.get("feedback"):
+                execute_values(
+                    cursor,
+                    "INSERT INTO feedback (user_id, text, date) VALUES %s",
+                    batch["feedback"]
+                )
+
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error writing batch: {e}")
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # Broadcast methods
+    def create_broadcast(self, broadcast_data: Dict) -> bool:
+        """Record a new broadcast before its first message is sent"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "SELECT * FROM service_options WHERE service_type = 'video_call' AND option_type = 'duration'"
+                """INSERT INTO broadcasts
+                (id, message, created_by, status, report_chat_id, report_message_id, created_at, updated_at)
+                VALUES (%s, %s, %s, 'running', %s, %s, %s, %s)""",
+                (
+                    broadcast_data["id"],
+                    broadcast_data["message"],
+                    broadcast_data.get("created_by"),
+                    broadcast_data.get("report_chat_id"),
+                    broadcast_data.get("report_message_id"),
+                    broadcast_data["created_at"],
+                    broadcast_data["created_at"]
+                )
             )
-            for option in cursor.fetchall():
-                result["video_call"]["durations"].append({
-                    "name": option["name"],
-                    "price": option["price"]
-                })
-            
-            # Get group names
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error creating broadcast: {e}")
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def get_running_broadcasts(self) -> List[Dict]:
+        """Broadcasts that were interrupted before they finished"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
+            cursor.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY created_at")
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting running broadcasts: {e}")
+            return []
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def update_broadcast(self, broadcast_id: str, updates: Dict) -> bool:
+        """Checkpoint a broadcast's cursor, counters or status"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
+            updates = {**updates, "updated_at": datetime.now()}
+            set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
             cursor.execute(
-                "SELECT * FROM service_options WHERE service_type = 'group' AND option_type = 'name'"
+                f"UPDATE broadcasts SET {set_clause} WHERE id = %s",
+                list(updates.values()) + [broadcast_id]
             )
-            for option in cursor.fetchall():
-                result["group"]["names"].append(option["name"])
-            
-            # Get group durations
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error updating broadcast {broadcast_id}: {e}")
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def get_user_ids_after(self, after_user_id: int, limit: int) -> Optional[List[int]]:
+        """Next page of reachable user IDs in ascending order (keyset pagination); None on error"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "SELECT * FROM service_options WHERE service_type = 'group' AND option_type = 'duration'"
+                "SELECT user_id FROM users WHERE user_id > %s AND reachable ORDER BY user_id LIMIT %s",
+                (after_user_id, limit)
             )
-            for option in cursor.fetchall():
-                result["group"]["durations"].append({
-                    "name": option["name"],
-                    "price": option["price"]
-                })
-            
-            # Get chat durations
+            return [row["user_id"] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting user IDs after {after_user_id}: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def count_users_after(self, after_user_id: int = 0) -> int:
+        """Number of reachable users with an ID above the given one"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
+            cursor.execute("SELECT COUNT(*) FROM users WHERE user_id > %s AND reachable", (after_user_id,))
+            return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error counting users: {e}")
+            return 0
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def mark_users_unreachable(self, user_ids: List[int]) -> bool:
+        """Flag users whose sends failed permanently so broadcasts skip them"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "SELECT * FROM service_options WHERE service_type = 'private_chat' AND option_type = 'duration'"
+                """UPDATE users SET reachable = FALSE, unreachable_since = %s
+                WHERE user_id = ANY(%s) AND reachable""",
+                (datetime.now(), list(user_ids))
             )
-            for option in cursor.fetchall():
-                result["private_chat"]["durations"].append({
-                    "name": option["name"],
-                    "price": option["price"]
-                })
-            
-            # Get chat types
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error marking {len(user_ids)} users unreachable: {e}")
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def count_unreachable_users(self) -> int:
+        """Number of users currently excluded from broadcasts"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
+            cursor.execute("SELECT COUNT(*) FROM users WHERE NOT reachable")
+            return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error counting unreachable users: {e}")
+            return 0
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # FSM storage methods
+    def load_fsm_records(self, keys: List[str], ttl: float) -> Optional[Dict[str, Dict]]:
+        """Get state and data for the given FSM keys, ignoring records idle longer than ttl seconds"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "SELECT * FROM service_options WHERE service_type = 'private_chat' AND option_type = 'type'"
+                """SELECT key, state, data FROM fsm_states
+                WHERE key = ANY(%s) AND updated_at > NOW() - make_interval(secs => %s)""",
+                (list(keys), ttl)
             )
-            for option in cursor.fetchall():
-                result["private_chat"]["types"].append({
-                    "name": option["name"],
-                    "price": option["price"]
-                })
-            
-            # Get album options
+            return {row["key"]: {"state": row["state"], "data": row["data"] or {}} for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"Error loading FSM records: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def save_fsm_records(self, rows: List[tuple], deleted_keys: List[str]) -> bool:
+        """Upsert (key, state, data) rows and delete cleared keys in one transaction"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
+            if rows:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    """INSERT INTO fsm_states (key, state, data, updated_at) VALUES %s
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = EXCLUDED.state,
+                        data = EXCLUDED.data,
+                        updated_at = EXCLUDED.updated_at""",
+                    [(key, state, psycopg2.extras.Json(data)) for key, state, data in rows],
+                    template="(%s, %s, %s, NOW())"
+                )
+            if deleted_keys:
+                cursor.execute("DELETE FROM fsm_states WHERE key = ANY(%s)", (list(deleted_keys),))
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error saving FSM records: {e}")
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def purge_fsm_records(self, ttl: float) -> Optional[int]:
+        """Delete FSM records idle longer than ttl seconds; returns the number removed"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
             cursor.execute(
-                "SELECT * FROM service_options WHERE service_type = 'album'"
+                "DELETE FROM fsm_states WHERE updated_at <= NOW() - make_interval(secs => %s)",
+                (ttl,)
             )
-            for option in cursor.fetchall():
-                result["album"].append({
-                    "name": option["name"],
-                    "price": option["price"]
-                })
-            
-            return result
+            conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error purging FSM records: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # Helper methods to convert between database and in-memory formats
+    def get_all_service_options_formatted(self) -> Dict:
+        """Get all service options formatted as in the original code"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
+            cursor.execute("SELECT * FROM service_options ORDER BY id")
+            return format_service_options(cursor.fetchall())
         except Exception as e:
             logger.error(f"Error getting formatted service options: {e}")
-            return {
-                "video_call": {"durations": []},
-                "group": {"names": [], "durations": []},
-                "private_chat": {"durations": [], "types": []},
-                "album": []
-            }
+            return format_service_options([])
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
+
+    def load_catalog(self) -> Optional[Dict[str, List[Dict]]]:
+        """Load service options, active bundles and current offers on one connection"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = self.get_cursor(conn)
+
+            cursor.execute("SELECT * FROM service_options ORDER BY id")
+            service_options = [dict(row) for row in cursor.fetchall()]
+
+            bundles = self._fetch_bundles(cursor, "WHERE b.active = TRUE")
+
+            cursor.execute(
+                "SELECT * FROM limited_time_offers WHERE expires > %s ORDER BY expires",
+                (datetime.now(),)
+            )
+            offers = [dict(row) for row in cursor.fetchall()]
+
+            return {"service_options": service_options, "bundles": bundles, "offers": offers}
+        except Exception as e:
+            logger.error(f"Error loading catalog: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+class AsyncDatabase:
+    """Awaitable facade over Database that runs every query on a dedicated thread pool
+
+    psycopg2 is blocking, so each call is handed to an executor sized to the
+    connection pool; the aiogram event loop keeps polling while queries run.
+    Every method mirrors the Database method of the same name and returns the
+    same shape.
+    """
+
+    def __init__(self, database: Database, max_workers: Optional[int] = None):
+        self.sync = database
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or DB_POOL_MAX_SIZE,
+            thread_name_prefix="db")
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking Database call on the executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _iterate(self, query: str, params: tuple = (), batch_size: Optional[int] = None) -> AsyncIterator[Dict]:
+        """Async counterpart of Database.iter_batches; each batch is fetched on the executor"""
+        batches = self.sync.iter_batches(query, params, batch_size)
+        try:
+            while True:
+                batch = await self._run(next, batches, None)
+                if batch is None:
+                    return
+                for row in batch:
+                    yield row
+        finally:
+            # Closing the generator returns its connection to the pool
+            await self._run(batches.close)
+
+    async def connect(self) -> None:
+        """Open the pool, apply migrations and verify a connection works"""
+        def ping():
+            self.sync.open()
+            conn = self.sync.get_connection()
+            try:
+                cursor = self.sync.get_cursor(conn)
+                cursor.execute("SELECT 1")
+            finally:
+                conn.close()
+
+        await self._run(ping)
+        logger.info(f"Database ready: {self.pool_stats()}")
+
+    async def close(self) -> None:
+        """Close the pool and stop the executor"""
+        await self._run(self.sync.close)
+        self._executor.shutdown(wait=True)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool usage counters"""
+        return self.sync.pool.stats() if self.sync.pool is not None else {}
+
+    # User methods
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        return await self._run(self.sync.get_user, user_id)
+
+    async def add_user(self, user_id: int, username: str, first_name: str) -> bool:
+        return await self._run(self.sync.add_user, user_id, username, first_name)
+
+    async def upsert_user_activity(self, rows: List[tuple], page_size: int = 1000) -> Optional[int]:
+        return await self._run(self.sync.upsert_user_activity, rows, page_size)
+
+    async def update_user_language(self, user_id: int, language: str) -> bool:
+        return await self._run(self.sync.update_user_language, user_id, language)
+
+    async def get_user_language(self, user_id: int) -> str:
+        return await self._run(self.sync.get_user_language, user_id)
+
+    async def get_all_users(self) -> List[Dict]:
+        return await self._run(self.sync.get_all_users)
+
+    def iter_users(self, batch_size: Optional[int] = None) -> AsyncIterator[Dict]:
+        return self._iterate(ITER_USERS_QUERY, (), batch_size)
+
+    # Purchase methods
+    async def add_purchase(self, purchase_data: Dict) -> bool:
+        return await self._run(self.sync.add_purchase, purchase_data)
+
+    async def update_purchase_status(self, purchase_id: str, status: str) -> bool:
+        return await self._run(self.sync.update_purchase_status, purchase_id, status)
+
+    async def get_user_purchases(self, user_id: int) -> List[Dict]:
+        return await self._run(self.sync.get_user_purchases, user_id)
+
+    async def iter_purchases(self, batch_size: Optional[int] = None) -> AsyncIterator[Dict]:
+        async for row in self._iterate(ITER_PURCHASES_QUERY, (), batch_size):
+            yield _merge_metadata(row)
+
+    async def get_expiring_subscriptions(self, start: datetime, end: datetime,
+                                         after: Optional[Tuple[datetime, str]] = None,
+                                         limit: int = DB_ITER_BATCH_SIZE) -> List[Dict]:
+        return await self._run(self.sync.get_expiring_subscriptions, start, end, after, limit)
+
+    # Transaction methods
+    async def add_transaction(self, transaction_data: Dict) -> bool:
+        return await self._run(self.sync.add_transaction, transaction_data)
+
+    async def update_transaction_status(self, transaction_id: str, status: str) -> bool:
+        return await self._run(self.sync.update_transaction_status, transaction_id, status)
+
+    async def get_transaction(self, transaction_id: str) -> Optional[Dict]:
+        return await self._run(self.sync.get_transaction, transaction_id)
+
+    async def get_all_transactions(self) -> List[Dict]:
+        return await self._run(self.sync.get_all_transactions)
+
+    def iter_transactions(self, batch_size: Optional[int] = None) -> AsyncIterator[Dict]:
+        return self._iterate(ITER_TRANSACTIONS_QUERY, (), batch_size)
+
+    # Pending payment methods
+    async def add_pending_payment(self, payment_data: Dict) -> bool:
+        return await self._run(self.sync.add_pending_payment, payment_data)
+
+    async def update_pending_payment(self, transaction_id: str, updates: Dict) -> bool:
+        return await self._run(self.sync.update_pending_payment, transaction_id, updates)
+
+    async def delete_pending_payment(self, transaction_id: str) -> bool:
+        return await self._run(self.sync.delete_pending_payment, transaction_id)
+
+    async def get_pending_payments_for_reminders(self, until: Optional[datetime] = None) -> List[Dict]:
+        return await self._run(self.sync.get_pending_payments_for_reminders, until)
+
+    # Promo code methods
+    async def add_promo_code(self, promo_data: Dict) -> bool:
+        return await self._run(self.sync.add_promo_code, promo_data)
+
+    async def get_promo_code(self, code: str) -> Optional[Dict]:
+        return await self._run(self.sync.get_promo_code, code)
+
+    async def increment_promo_usage(self, code: str) -> bool:
+        return await self._run(self.sync.increment_promo_usage, code)
+
+    async def get_all_promo_codes(self) -> List[Dict]:
+        return await self._run(self.sync.get_all_promo_codes)
+
+    # Bundle methods
+    async def get_all_bundles(self) -> List[Dict]:
+        return await self._run(self.sync.get_all_bundles)
+
+    async def get_bundle(self, bundle_id: str) -> Optional[Dict]:
+        return await self._run(self.sync.get_bundle, bundle_id)
+
+    async def get_bundles(self, bundle_ids: List[str]) -> Dict[str, Dict]:
+        return await self._run(self.sync.get_bundles, bundle_ids)
+
+    async def add_bundle(self, bundle_data: Dict) -> bool:
+        return await self._run(self.sync.add_bundle, bundle_data)
+
+    # Limited time offer methods
+    async def add_limited_time_offer(self, offer_data: Dict) -> bool:
+        return await self._run(self.sync.add_limited_time_offer, offer_data)
+
+    async def get_active_offers(self) -> List[Dict]:
+        return await self._run(self.sync.get_active_offers)
+
+    # Scheduled task methods
+    async def add_scheduled_task(self, task_data: Dict) -> bool:
+        return await self._run(self.sync.add_scheduled_task, task_data)
+
+    async def get_pending_tasks(self) -> List[Dict]:
+        return await self._run(self.sync.get_pending_tasks)
+
+    async def mark_task_executed(self, task_id: str) -> bool:
+        return await self._run(self.sync.mark_task_executed, task_id)
+
+    # Feedback methods
+    async def add_feedback(self, user_id: int, text: str) -> bool:
+        return await self._run(self.sync.add_feedback, user_id, text)
+
+    async def get_user_feedback(self, user_id: int) -> List[Dict]:
+        return await self._run(self.sync.get_user_feedback, user_id)
+
+    # Service options methods
+    async def get_service_options(self, service_type: str = None, option_type: str = None) -> List[Dict]:
+        return await self._run(self.sync.get_service_options, service_type, option_type)
+
+    async def add_service_option(self, option_data: Dict) -> bool:
+        return await self._run(self.sync.add_service_option, option_data)
+
+    async def update_service_option(self, option_id: int, updates: Dict) -> bool:
+        return await self._run(self.sync.update_service_option, option_id, updates)
+
+    async def get_all_service_options_formatted(self) -> Dict:
+        return await self._run(self.sync.get_all_service_options_formatted)
+
+    async def load_catalog(self) -> Optional[Dict[str, List[Dict]]]:
+        return await self._run(self.sync.load_catalog)
+
+    # Broadcast methods
+    async def create_broadcast(self, broadcast_data: Dict) -> bool:
+        return await self._run(self.sync.create_broadcast, broadcast_data)
+
+    async def get_running_broadcasts(self) -> List[Dict]:
+        return await self._run(self.sync.get_running_broadcasts)
+
+    async def update_broadcast(self, broadcast_id: str, updates: Dict) -> bool:
+        return await self._run(self.sync.update_broadcast, broadcast_id, updates)
+
+    async def get_user_ids_after(self, after_user_id: int, limit: int) -> Optional[List[int]]:
+        return await self._run(self.sync.get_user_ids_after, after_user_id, limit)
+
+    async def count_users_after(self, after_user_id: int = 0) -> int:
+        return await self._run(self.sync.count_users_after, after_user_id)
+
+    async def mark_users_unreachable(self, user_ids: List[int]) -> bool:
+        return await self._run(self.sync.mark_users_unreachable, user_ids)
+
+    async def count_unreachable_users(self) -> int:
+        return await self._run(self.sync.count_unreachable_users)
+
+    # FSM storage methods
+    async def load_fsm_records(self, keys: List[str], ttl: float) -> Optional[Dict[str, Dict]]:
+        return await self._run(self.sync.load_fsm_records, keys, ttl)
+
+    async def save_fsm_records(self, rows: List[tuple], deleted_keys: List[str]) -> bool:
+        return await self._run(self.sync.save_fsm_records, rows, deleted_keys)
+
+    async def purge_fsm_records(self, ttl: float) -> Optional[int]:
+        return await self._run(self.sync.purge_fsm_records, ttl)
+
+    # Bulk state methods
+    async def load_state(self) -> Optional[Dict[str, List[Dict]]]:
+        return await self._run(self.sync.load_state)
+
+    async def write_batch(self, batch: Dict[str, List]) -> bool:
+        return await self._run(self.sync.write_batch, batch)
+
 
-# Create a global database instance
-db = Database()
\ No newline at end of file
+# Create the global database instances: sync_db for scripts, db for handlers.
+# Neither connects on import; call sync_db.open() or await db.connect() first.
+sync_db = Database()
+db = AsyncDatabase(sync_db)
\ No newline at end of file
@@ -0,0 +1,185 @@
+import os
+import copy
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from database import db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# FSM storage settings: idle seconds before a conversation's state expires,
+# how long a cached record is trusted before re-reading it (keep this short
+# when several instances share the database), how many records the cache
+# holds, and how often coalesced writes are flushed
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "5"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.2"))
+
+# Expired records are purged from the table this often, in seconds
+FSM_PURGE_INTERVAL = 3600
+
+
+class _Record:
+    __slots__ = ("state", "data", "loaded_at")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.loaded_at = time.monotonic()
+
+
+class PostgresStorage(BaseStorage):
+    """FSM storage kept in the fsm_states table, shared by every bot instance
+
+    Reads go through a bounded per-process cache; a cached record is trusted
+    for cache_ttl seconds, then re-read so changes made by another instance
+    show up. Writes update the cache at once and are written behind: every
+    set_state/set_data/update_data on a key between two flushes coalesces
+    into one upsert. A record idle for longer than state_ttl is treated as
+    empty and eventually purged.
+    """
+
+    def __init__(self, state_ttl: float = FSM_STATE_TTL, cache_ttl: float = FSM_CACHE_TTL,
+                 cache_size: int = FSM_CACHE_SIZE, flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Dict[str, _Record] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._purged_at = 0.0
+        self.stats = {"hits": 0, "misses": 0, "flushes": 0, "rows": 0, "failures": 0}
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def _remember(self, name: str, record: _Record) -> None:
+        self._cache[name] = record
+        self._cache.move_to_end(name)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _get(self, key: StorageKey) -> _Record:
+        """Cached record for a key, read through from the database when missing or stale"""
+        name = self._key(key)
+        record = self._dirty.get(name) or self._cache.get(name)
+        if record is not None and (name in self._dirty or time.monotonic() - record.loaded_at < self.cache_ttl):
+            self.stats["hits"] += 1
+            return record
+
+        self.stats["misses"] += 1
+        rows = await db.load_fsm_records([name], self.state_ttl)
+        if rows is None:
+            # Database unavailable: keep using what we have rather than resetting the user
+            return record or _Record()
+
+        # A write may have landed while the read was in flight
+        if name in self._dirty:
+            return self._dirty[name]
+        row = rows.get(name)
+        record = _Record(row["state"], row["data"]) if row else _Record()
+        self._remember(name, record)
+        return record
+
+    def _write(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        name = self._key(key)
+        record = _Record(state, data)
+        self._remember(name, record)
+        self._dirty[name] = record
+        if self._task is None:
+            # Not started (e.g. scripts): nothing will flush in the background
+            asyncio.ensure_future(self.flush())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        record = await self._get(key)
+        self._write(key, state, record.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get(key)
+        self._write(key, record.state, copy.deepcopy(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._get(key)).data)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        record = await self._get(key)
+        merged = {**record.data, **copy.deepcopy(data)}
+        self._write(key, record.state, merged)
+        return copy.deepcopy(merged)
+
+    async def flush(self) -> bool:
+        """Write every coalesced change; cleared records are deleted"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return True
+
+            dirty, self._dirty = self._dirty, {}
+            rows = [(name, record.state, record.data) for name, record in dirty.items()
+                    if record.state is not None or record.data]
+            deleted = [name for name, record in dirty.items()
+                       if record.state is None and not record.data]
+
+            if await db.save_fsm_records(rows, deleted):
+                self.stats["flushes"] += 1
+                self.stats["rows"] += len(dirty)
+                return True
+
+            # Keep the failed changes unless the key has been written again since
+            for name, record in dirty.items():
+                self._dirty.setdefault(name, record)
+            self.stats["failures"] += 1
+            return False
+
+    async def purge(self) -> None:
+        """Delete expired records from the table"""
+        self._purged_at = time.monotonic()
+        removed = await db.purge_fsm_records(self.state_ttl)
+        if removed:
+            logger.info(f"Purged {removed} expired FSM records")
+
+    async def _run(self) -> None:
+        """Flush every flush_interval seconds and purge expired records hourly"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._purged_at >= FSM_PURGE_INTERVAL:
+                    await self.purge()
+            except Exception as e:
+                logger.error(f"Error in FSM storage flush loop: {e}")
+
+    def start(self) -> None:
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop the flush loop and write out pending changes; safe to call twice"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if not await self.flush():
+            logger.error(f"{len(self._dirty)} FSM records could not be persisted on shutdown")
+
+
+# Create a global FSM storage instance
+storage = PostgresStorage()
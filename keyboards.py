@@ -0,0 +1,204 @@
+import logging
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from callbacks import callbacks
+from catalog import CatalogSnapshot, catalog
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+Builder = Callable[[CatalogSnapshot, str], InlineKeyboardMarkup]
+
+# Payment methods (label, method) offered for each payment type; crypto goes straight to the details
+PAYMENT_METHODS = {
+    "indian": (
+        ("UPI ID/QR Code", "upi"),
+        ("Amazon Gift Card", "amazon_india"),
+    ),
+    "international": (
+        ("Remitly", "remitly"),
+        ("Paysend", "paysend"),
+        ("Wise", "wise"),
+        ("Amazon Gift Card", "amazon_intl"),
+        ("Western Union", "wu"),
+        ("PayPal", "paypal"),
+        ("Other", "other"),
+    ),
+}
+
+
+def create_back_button(builder: InlineKeyboardBuilder) -> None:
+    builder.button(text="« Back to Main Menu", callback_data="back_to_main")
+
+
+class KeyboardCache:
+    """Prebuilt inline keyboards keyed by (screen, language, catalog version)
+
+    Most menus are the same for every user, so each screen is built once per
+    language and catalog version and the same InlineKeyboardMarkup is handed
+    out after that. A new catalog snapshot drops every cached markup, as does
+    invalidate(), which is called when the translations change.
+    """
+
+    def __init__(self):
+        self._builders: Dict[str, Builder] = {}
+        self._markups: Dict[Tuple[str, str], InlineKeyboardMarkup] = {}
+        # (catalog version, translations generation) the cached markups were built for
+        self._built_for: Optional[Tuple[int, int]] = None
+        self._generation = 0
+        self.stats = {"hits": 0, "builds": 0}
+
+    def register(self, name: str, builder: Builder) -> None:
+        self._builders[name] = builder
+
+    def screen(self, name: str) -> Callable[[Builder], Builder]:
+        """Decorator registering the builder for a screen"""
+        def decorator(builder: Builder) -> Builder:
+            self.register(name, builder)
+            return builder
+        return decorator
+
+    def invalidate(self) -> None:
+        """Drop every cached markup, e.g. after the translations change"""
+        self._generation += 1
+
+    async def get(self, name: str, language: str = "en") -> InlineKeyboardMarkup:
+        """The markup for a screen, built on first use for this language and catalog"""
+        snapshot = await catalog.get()
+        built_for = (snapshot.version, self._generation)
+        if built_for != self._built_for:
+            self._markups.clear()
+            self._built_for = built_for
+
+        key = (name, language)
+        markup = self._markups.get(key)
+        if markup is not None:
+            self.stats["hits"] += 1
+            return markup
+
+        markup = self._builders[name](snapshot, language)
+        self._markups[key] = markup
+        self.stats["builds"] += 1
+        return markup
+
+
+# Create a global keyboard cache
+keyboards = KeyboardCache()
+
+
+@keyboards.screen("main_menu")
+def _main_menu(snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="📞 Video Call", callback_data="video_call")
+    kb.button(text="👥 Join Group", callback_data="group")
+    kb.button(text="💬 Private Chat", callback_data="private_chat")
+    kb.button(text="📸 Album", callback_data="album")
+    kb.button(text="📦 Bundle Packages", callback_data="bundles")
+    kb.button(text="🎁 Enter Promo Code", callback_data="enter_promo")
+    kb.button(text="📝 Leave Feedback", callback_data="feedback")
+    kb.button(text="❓ Help", callback_data="help")
+    kb.button(text="🌐 Change Language", callback_data="change_language")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+@keyboards.screen("payment_types")
+def _payment_types(snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🇮🇳 Indian Payment", callback_data=callbacks.pack("payment_type", "indian"))
+    kb.button(text="🌍 International Payment", callback_data=callbacks.pack("payment_type", "international"))
+    kb.button(text="💰 Crypto Payment", callback_data=callbacks.pack("payment_type", "crypto"))
+    create_back_button(kb)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+def _payment_methods(payment_type: str, snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    for text, method in PAYMENT_METHODS[payment_type]:
+        kb.button(text=text, callback_data=callbacks.pack("pay", method))
+    kb.button(text="« Back to Payment Types", callback_data="back_to_payment_types")
+    create_back_button(kb)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+for _payment_type in PAYMENT_METHODS:
+    keyboards.register(f"payment_methods_{_payment_type}", partial(_payment_methods, _payment_type))
+
+
+@keyboards.screen("video_call")
+def _video_call(snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    for option in snapshot.service_options["video_call"]["durations"]:
+        kb.button(text=f"{option['name']} - ${option['price']}",
+                  callback_data=callbacks.pack("price", option['price']))
+    create_back_button(kb)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+@keyboards.screen("group")
+def _group(snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    for name in snapshot.service_options["group"]["names"]:
+        kb.button(text=name, callback_data=callbacks.pack("group_name", name))
+    create_back_button(kb)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+@keyboards.screen("group_durations")
+def _group_durations(snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    for duration in snapshot.service_options["group"]["durations"]:
+        kb.button(text=f"{duration['name']} - ${duration['price']}",
+                  callback_data=callbacks.pack("group_duration", duration['price']))
+    create_back_button(kb)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+@keyboards.screen("album")
+def _album(snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    for album in snapshot.service_options["album"]:
+        kb.button(text=f"{album['name']} - ${album['price']}",
+                  callback_data=callbacks.pack("album_option", album['price']))
+    create_back_button(kb)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+@keyboards.screen("bundles")
+def _bundles(snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    for bundle in snapshot.bundles:
+        kb.button(
+            text=f"{bundle['name']} - ${bundle['bundle_price']} (Save {bundle['discount_percentage']}%)",
+            callback_data=callbacks.pack("bundle", bundle['id'])
+        )
+    create_back_button(kb)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+@keyboards.screen("admin_panel")
+def _admin_panel(snapshot: CatalogSnapshot, language: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="📊 User Statistics", callback_data="admin_stats")
+    kb.button(text="📣 Broadcast Message", callback_data="admin_broadcast")
+    kb.button(text="📅 Schedule Broadcast", callback_data="admin_schedule_broadcast")
+    kb.button(text="💰 Custom Price Quote", callback_data="admin_custom_price")
+    kb.button(text="🛠️ Manage Services", callback_data="admin_manage_services")
+    kb.button(text="💲 Manage Pricing", callback_data="admin_manage_pricing")
+    kb.button(text="🎁 Create Promo Code", callback_data="admin_create_promo")
+    kb.button(text="📦 Manage Bundles", callback_data="admin_manage_bundles")
+    kb.button(text="⏱️ Create Limited Offer", callback_data="admin_create_offer")
+    kb.button(text="📊 Advanced Analytics", callback_data="admin_advanced_analytics")
+    kb.adjust(1)
+    return kb.as_markup()
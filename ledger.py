@@ -0,0 +1,128 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from analytics import aggregates
+from models import Purchase, Status, Transaction, to_status
+from persistence import store
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class OrderLedger:
+    """Orders indexed by transaction ID and by (user_id, status)
+
+    Each order is a transaction in the store's transaction list, plus the
+    purchase it pays for. The purchase carries the order's transaction_id,
+    which is kept in the purchase metadata, so the link survives a restart.
+    Looking an order up and changing its status are dict operations on that
+    exact order. Nothing scans the history, and nothing guesses "the first
+    pending purchase".
+    """
+
+    def __init__(self, transactions: List[Transaction], users: Dict[int, Dict]):
+        self.transactions = transactions
+        self.users = users
+        self._orders: Dict[str, Transaction] = {}
+        self._purchases: Dict[str, Tuple[int, Purchase]] = {}
+        # (user_id, status) -> {transaction_id: transaction}, oldest first
+        self._by_user_status: Dict[Tuple[int, Status], Dict[str, Transaction]] = {}
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __contains__(self, transaction_id: str) -> bool:
+        return transaction_id in self._orders
+
+    def _index(self, transaction: Transaction) -> None:
+        key = (transaction["user_id"], to_status(transaction.get("status")))
+        self._by_user_status.setdefault(key, {})[transaction["transaction_id"]] = transaction
+
+    def _unindex(self, transaction: Transaction) -> None:
+        key = (transaction["user_id"], to_status(transaction.get("status")))
+        orders = self._by_user_status.get(key)
+        if orders is not None:
+            orders.pop(transaction["transaction_id"], None)
+            if not orders:
+                del self._by_user_status[key]
+
+    @staticmethod
+    def _save(transaction: Transaction) -> None:
+        """Persist a transaction change and keep the admin aggregates current"""
+        store.mark_transaction(transaction)
+        aggregates.record(transaction)
+
+    def load(self) -> None:
+        """Index the loaded transactions and the purchases linked to them; done once at startup"""
+        self._orders.clear()
+        self._purchases.clear()
+        self._by_user_status.clear()
+        for transaction in self.transactions:
+            self._orders[transaction["transaction_id"]] = transaction
+            self._index(transaction)
+
+        for user_id, user in self.users.items():
+            for purchase in user.get("purchases", []):
+                transaction_id = purchase.get("transaction_id")
+                if transaction_id in self._orders:
+                    self._purchases[transaction_id] = (user_id, purchase)
+        logger.info(f"Indexed {len(self._orders)} orders, {len(self._purchases)} with purchases")
+
+    def get(self, transaction_id: str) -> Optional[Transaction]:
+        """The transaction for an order, or None"""
+        return self._orders.get(transaction_id)
+
+    def purchase(self, transaction_id: str) -> Optional[Purchase]:
+        """The purchase an order pays for, or None"""
+        entry = self._purchases.get(transaction_id)
+        return entry[1] if entry is not None else None
+
+    def by_user_status(self, user_id: int, status: Status) -> List[Transaction]:
+        """A user's orders in the given status, oldest first"""
+        return list(self._by_user_status.get((user_id, status), {}).values())
+
+    def add(self, transaction: Transaction, purchase_id: Optional[str] = None) -> bool:
+        """Log a new order and link it to the purchase it pays for; False if it is already logged"""
+        transaction_id = transaction["transaction_id"]
+        if transaction_id in self._orders:
+            return False
+
+        self.transactions.append(transaction)
+        self._orders[transaction_id] = transaction
+        self._index(transaction)
+        self._save(transaction)
+
+        if purchase_id:
+            user_id = transaction["user_id"]
+            purchases = self.users.get(user_id, {}).get("purchases", [])
+            # The purchase was recorded a few steps earlier, so it is at the end of the list
+            purchase = next((p for p in reversed(purchases) if p.get("purchase_id") == purchase_id), None)
+            if purchase is not None and not purchase.get("transaction_id"):
+                purchase["transaction_id"] = transaction_id
+                self._purchases[transaction_id] = (user_id, purchase)
+                store.mark_purchase(user_id, purchase)
+        return True
+
+    def set_status(self, transaction_id: str, status: Status) -> Optional[Purchase]:
+        """Move an order and its purchase to a new status; returns the purchase, None if there is none"""
+        transaction = self._orders.get(transaction_id)
+        if transaction is None:
+            return None
+
+        if to_status(transaction.get("status")) is not status:
+            self._unindex(transaction)
+            transaction["status"] = status
+            self._index(transaction)
+        self._save(transaction)
+
+        entry = self._purchases.get(transaction_id)
+        if entry is None:
+            return None
+        user_id, purchase = entry
+        purchase["status"] = status
+        store.mark_purchase(user_id, purchase)
+        return purchase
+
+
+# Create a global order ledger over the store's transactions and purchases
+ledger = OrderLedger(store.transactions, store.users)
@@ -2,8 +2,7 @@ import asyncio
 import logging
 import os
 
-from bot import bot, dp, background_tasks
-from database import db
+from bot import startup, run, shutdown
 
 # Configure logging
 logging.basicConfig(
@@ -13,16 +12,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 async def main():
-    # Initialize database
-    await db.connect()
+    # Connect to the database, load persisted state, build the bot and
+    # start the background job scheduler
+    bot, dp = await startup()
     logger.info("Database initialized")
     
-    # Start background tasks
-    asyncio.create_task(background_tasks())
-    logger.info("Background tasks started")
-    
-    # Start the bot
-    await dp.start_polling(bot)
+    try:
+        # Start the bot (long polling, or webhook when BOT_MODE=webhook)
+        await run(bot, dp)
+    finally:
+        # Flush buffered writes before the process exits
+        await shutdown()
 
 if __name__ == "__main__":
     try:
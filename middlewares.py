@@ -0,0 +1,274 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+from aiogram.types import TelegramObject, Update, User
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Admission control: handlers allowed to run at once, how many may wait for
+# a slot and how much event-loop lag (seconds) is tolerated before the lower
+# priority classes are shed, and how often the loop lag is sampled
+ADMISSION_CONCURRENCY = int(os.getenv("ADMISSION_CONCURRENCY", "100"))
+ADMISSION_QUEUE_LIMIT = int(os.getenv("ADMISSION_QUEUE_LIMIT", "200"))
+ADMISSION_LAG_LIMIT = float(os.getenv("ADMISSION_LAG_LIMIT", "0.5"))
+ADMISSION_PROBE_INTERVAL = 0.5
+
+# Priority classes, most important first
+PAYMENT = 0   # payments, screenshots and admin actions; never shed
+CHECKOUT = 1  # steps of an order in progress
+BROWSING = 2  # menus, help and everything else
+
+# Overload at which each class starts being shed
+SHED_AT = {CHECKOUT: 2.0, BROWSING: 1.0}
+
+BUSY_TEXT = "The bot is busy right now, please try again in a moment."
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+Classifier = Callable[[Update, Dict[str, Any]], int]
+
+
+class Mailbox:
+    """Updates from one user waiting for their turn, in arrival order"""
+
+    __slots__ = ("queued", "max_depth")
+
+    def __init__(self):
+        self.queued: Deque[Tuple[Handler, TelegramObject, Dict[str, Any]]] = deque()
+        self.max_depth = 1
+
+
+class UserMailboxes(BaseMiddleware):
+    """Processes one update at a time per user, in the order they arrived
+
+    Handlers mutate per-user state (active promos, purchases, FSM data)
+    across await points, so two quick taps from the same user could
+    interleave. An update from an idle user is handled straight away in the
+    task that received it. An update from a user who is already being served
+    joins that user's mailbox and its caller returns at once, so a user
+    tapping repeatedly never ties up more than one polling task or webhook
+    worker. When the running update finishes, one drainer task per mailbox
+    handles the queued updates in order. Before each one its FSM state is
+    read again, since the update ahead of it may have changed it. Errors go
+    to the dispatcher's error handlers as usual. A mailbox is dropped as
+    soon as it is empty, so idle users cost nothing.
+    """
+
+    def __init__(self):
+        self._mailboxes: Dict[int, Mailbox] = {}
+        self._drainers: Set[asyncio.Task] = set()
+        self.stats = {"updates": 0, "queued": 0, "max_depth": 0, "evicted": 0}
+
+    def __len__(self) -> int:
+        return len(self._mailboxes)
+
+    def depths(self) -> Dict[int, int]:
+        """Current queue depth of every active mailbox, counting the update being handled"""
+        return {user_id: len(mailbox.queued) + 1 for user_id, mailbox in self._mailboxes.items()}
+
+    def max_depths(self) -> Dict[int, int]:
+        """Deepest queue each active mailbox has reached"""
+        return {user_id: mailbox.max_depth for user_id, mailbox in self._mailboxes.items()}
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user: User = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        self.stats["updates"] += 1
+        mailbox = self._mailboxes.get(user.id)
+        if mailbox is not None:
+            # The user is being served; queue the update and free the caller
+            mailbox.queued.append((handler, event, data))
+            depth = len(mailbox.queued) + 1
+            mailbox.max_depth = max(mailbox.max_depth, depth)
+            self.stats["queued"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], depth)
+            return None
+
+        mailbox = self._mailboxes[user.id] = Mailbox()
+        try:
+            return await handler(event, data)
+        finally:
+            if mailbox.queued:
+                task = asyncio.create_task(self._drain(user.id, mailbox))
+                self._drainers.add(task)
+                task.add_done_callback(self._drainers.discard)
+            else:
+                self._evict(user.id, mailbox)
+
+    async def _drain(self, user_id: int, mailbox: Mailbox) -> None:
+        """Handle a mailbox's queued updates one by one until it is empty"""
+        try:
+            while mailbox.queued:
+                handler, event, data = mailbox.queued.popleft()
+                state = data.get("state")
+                try:
+                    if state is not None:
+                        data["raw_state"] = await state.get_state()
+                    dispatcher = data.get("dispatcher")
+                    if dispatcher is not None:
+                        await ErrorsMiddleware(dispatcher)(handler, event, data)
+                    else:
+                        await handler(event, data)
+                except Exception as e:
+                    logger.error(f"Error handling queued update from user {user_id}: {e}")
+        finally:
+            if mailbox.queued:
+                logger.error(f"Dropped {len(mailbox.queued)} queued updates from user {user_id}")
+                mailbox.queued.clear()
+            self._evict(user_id, mailbox)
+
+    def _evict(self, user_id: int, mailbox: Mailbox) -> None:
+        if self._mailboxes.get(user_id) is mailbox:
+            del self._mailboxes[user_id]
+            self.stats["evicted"] += 1
+
+    async def close(self, drain_timeout: float = 10) -> None:
+        """Let drainers finish queued updates (for up to drain_timeout seconds), then stop them"""
+        if self._drainers:
+            _, pending = await asyncio.wait(set(self._drainers), timeout=drain_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        logger.info(f"User mailboxes closed: {self.stats}")
+
+
+# Create a global per-user mailbox middleware
+mailboxes = UserMailboxes()
+
+
+class AdmissionControl(BaseMiddleware):
+    """Bounded handler concurrency with priority classes and load shedding
+
+    At most concurrency updates are handled at once. When every slot is
+    taken, updates wait and a freed slot goes to the most important waiting
+    class first (oldest first within a class), so an admin approving a
+    payment is not stuck behind a crowd browsing the menus. Overload is
+    measured as the larger of event-loop lag over lag_limit and waiting
+    updates over queue_limit: from 1 browsing updates are shed, from 2
+    checkout steps too. A shed update gets a short "busy" answer instead of
+    its handler. Payments are never shed.
+
+    Each update's class comes from the function registered with classifier().
+    """
+
+    def __init__(self, concurrency: int = ADMISSION_CONCURRENCY, queue_limit: int = ADMISSION_QUEUE_LIMIT,
+                 lag_limit: float = ADMISSION_LAG_LIMIT, probe_interval: float = ADMISSION_PROBE_INTERVAL):
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = max(1, queue_limit)
+        self.lag_limit = lag_limit
+        self.probe_interval = probe_interval
+        self.lag = 0.0
+        self.in_flight = 0
+        self.waiting = 0
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._classify: Classifier = lambda update, data: BROWSING
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"admitted": 0, "queued": 0, "shed": 0, "shed_by_class": [0, 0, 0]}
+
+    def classifier(self, func: Classifier) -> Classifier:
+        """Decorator registering the function that gives an update its priority class"""
+        self._classify = func
+        return func
+
+    @property
+    def overload(self) -> float:
+        lag = self.lag / self.lag_limit if self.lag_limit > 0 else 0.0
+        return max(lag, self.waiting / self.queue_limit)
+
+    def admits(self, priority: int) -> bool:
+        """Whether an update of this class is admitted at the current load"""
+        return priority == PAYMENT or self.overload < SHED_AT[priority]
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        priority = self._classify(event, data)
+        if not self.admits(priority):
+            self.stats["shed"] += 1
+            self.stats["shed_by_class"][priority] += 1
+            await self._shed(event)
+            return None
+
+        await self._acquire(priority)
+        self.stats["admitted"] += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int) -> None:
+        if self.in_flight < self.concurrency and not self.waiting:
+            self.in_flight += 1
+            return
+
+        slot = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), slot))
+        self.waiting += 1
+        self.stats["queued"] += 1
+        try:
+            await slot
+        except asyncio.CancelledError:
+            if slot.cancelled():
+                # Cancelled while waiting; the entry is skipped when it comes up
+                self.waiting -= 1
+            else:
+                # The slot was handed over just as the update was cancelled
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        """Hand the slot to the most important waiting update, or free it"""
+        while self._heap:
+            _, _, slot = heapq.heappop(self._heap)
+            if not slot.done():
+                self.waiting -= 1
+                slot.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @staticmethod
+    async def _shed(update: Update) -> None:
+        """Answer a shed update cheaply so the user knows to retry"""
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(BUSY_TEXT)
+            elif update.message is not None:
+                await update.message.answer(BUSY_TEXT)
+        except Exception as e:
+            logger.error(f"Failed to answer shed update {update.update_id}: {e}")
+
+    async def _probe(self) -> None:
+        """Sample event-loop lag: how late a short sleep wakes up"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.probe_interval)
+            self.lag = max(0.0, loop.time() - started - self.probe_interval)
+
+    def start(self) -> None:
+        """Start sampling event-loop lag; calling it again has no effect"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._probe())
+
+    async def close(self) -> None:
+        """Stop the lag probe"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info(f"Admission control closed: {self.stats}")
+
+
+# Create a global admission controller
+admission = AdmissionControl()
@@ -0,0 +1,575 @@
+import json
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Union
+
+import psycopg2.extras
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for the advisory lock that keeps replicas from migrating at the same time
+MIGRATION_LOCK_KEY = 7310042
+
+
+def _create_baseline_schema(cursor) -> None:
+    """Tables as originally created by Database.initialize_db"""
+    # Users table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        joined_date TIMESTAMP,
+        language TEXT DEFAULT 'en',
+        last_active TIMESTAMP
+    )
+    ''')
+    
+    # Purchases table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS purchases (
+        purchase_id TEXT PRIMARY KEY,
+        user_id BIGINT,
+        service_type TEXT,
+        price NUMERIC,
+        original_price NUMERIC,
+        status TEXT,
+        date TIMESTAMP,
+        promo_code TEXT,
+        discount_amount NUMERIC,
+        expiry_date TIMESTAMP,
+        renewal_reminder_sent BOOLEAN DEFAULT FALSE,
+        final_reminder_sent BOOLEAN DEFAULT FALSE,
+        auto_renew BOOLEAN DEFAULT FALSE,
+        metadata JSONB DEFAULT '{}',
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    
+    # Transactions table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        transaction_id TEXT PRIMARY KEY,
+        user_id BIGINT,
+        username TEXT,
+        service TEXT,
+        amount NUMERIC,
+        original_price NUMERIC,
+        payment_method TEXT,
+        payment_type TEXT,
+        status TEXT,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        promo_code TEXT,
+        discount_amount NUMERIC,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    
+    # Pending payments table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS pending_payments (
+        transaction_id TEXT PRIMARY KEY,
+        user_id BIGINT,
+        service_type TEXT,
+        price NUMERIC,
+        timestamp TIMESTAMP,
+        reminder_1_sent BOOLEAN DEFAULT FALSE,
+        reminder_2_sent BOOLEAN DEFAULT FALSE,
+        reminder_3_sent BOOLEAN DEFAULT FALSE,
+        payment_confirmed BOOLEAN DEFAULT FALSE,
+        status TEXT DEFAULT 'pending',
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    
+    # Promo codes table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS promo_codes (
+        code TEXT PRIMARY KEY,
+        discount NUMERIC,
+        type TEXT,
+        expires TIMESTAMP,
+        uses INTEGER DEFAULT 0,
+        max_uses INTEGER,
+        created_by BIGINT,
+        created_at TIMESTAMP
+    )
+    ''')
+    
+    # Bundle packages table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bundle_packages (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        description TEXT,
+        original_price NUMERIC,
+        bundle_price NUMERIC,
+        discount_percentage INTEGER,
+        created_by BIGINT,
+        created_at TIMESTAMP,
+        active BOOLEAN DEFAULT TRUE
+    )
+    ''')
+    
+    # Bundle items table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bundle_items (
+        id SERIAL PRIMARY KEY,
+        bundle_id TEXT,
+        service TEXT,
+        item_name TEXT,
+        duration TEXT,
+        metadata JSONB DEFAULT '{}',
+        FOREIGN KEY (bundle_id) REFERENCES bundle_packages (id)
+    )
+    ''')
+    
+    # Limited time offers table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS limited_time_offers (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        discount NUMERIC,
+        type TEXT,
+        expires TIMESTAMP,
+        created_by BIGINT,
+        created_at TIMESTAMP
+    )
+    ''')
+    
+    # Scheduled tasks table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS scheduled_tasks (
+        task_id TEXT PRIMARY KEY,
+        type TEXT,
+        message TEXT,
+        scheduled_time TIMESTAMP,
+        created_by BIGINT,
+        created_at TIMESTAMP,
+        executed BOOLEAN DEFAULT FALSE
+    )
+    ''')
+    
+    # Feedback table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS feedback (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT,
+        text TEXT,
+        date TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    
+    # Service options table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS service_options (
+        id SERIAL PRIMARY KEY,
+        service_type TEXT,
+        option_type TEXT,
+        name TEXT,
+        price NUMERIC,
+        metadata JSONB DEFAULT '{}'
+    )
+    ''')
+
+
+def _seed_defaults(cursor) -> None:
+    """Default service options and bundles for an empty database"""
+    # Insert default service options if table is empty
+    cursor.execute("SELECT COUNT(*) as count FROM service_options")
+    count = cursor.fetchone()["count"]
+    
+    if count == 0:
+        # Insert video call durations
+        video_call_durations = [
+            {"name": "15 min", "price": 10},
+            {"name": "30 min", "price": 15},
+            {"name": "60 min", "price": 25}
+        ]
+        for option in video_call_durations:
+            cursor.execute(
+                "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
+                ("video_call", "duration", option["name"], option["price"])
+            )
+        
+        # Insert group names
+        group_names = ["Exclusive", "Ankita's Den"]
+        for name in group_names:
+            cursor.execute(
+                "INSERT INTO service_options (service_type, option_type, name) VALUES (%s, %s, %s)",
+                ("group", "name", name)
+            )
+        
+        # Insert group durations
+        group_durations = [
+            {"name": "2 Months", "price": 20},
+            {"name": "6 Months", "price": 50},
+            {"name": "12 Months", "price": 90}
+        ]
+        for option in group_durations:
+            cursor.execute(
+                "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
+                ("group", "duration", option["name"], option["price"])
+            )
+        
+        # Insert chat durations
+        chat_durations = [
+            {"name": "2 Hr", "price": 20},
+            {"name": "4 Hr", "price": 35}
+        ]
+        for option in chat_durations:
+            cursor.execute(
+                "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
+                ("private_chat", "duration", option["name"], option["price"])
+            )
+        
+        # Insert chat types
+        chat_types = [
+            {"name": "Sx Chat with Notes", "price": 60},
+            {"name": "Normal Chat", "price": 35}
+        ]
+        for option in chat_types:
+            cursor.execute(
+                "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
+                ("private_chat", "type", option["name"], option["price"])
+            )
+        
+        # Insert album options
+        album_options = [
+            {"name": "Node Pic Full Collection (300+)", "price": 30},
+            {"name": "Node Pic + Vid Full Collection (800+)", "price": 60},
+            {"name": "My Exclusive Bj Vids (50 Vids)", "price": 50},
+            {"name": "Master Album (All-in-One)", "price": 90}
+        ]
+        for option in album_options:
+            cursor.execute(
+                "INSERT INTO service_options (service_type, option_type, name, price) VALUES (%s, %s, %s, %s)",
+                ("album", "album", option["name"], option["price"])
+            )
+    
+    # Insert default bundles if table is empty
+    cursor.execute("SELECT COUNT(*) as count FROM bundle_packages")
+    count = cursor.fetchone()["count"]
+    
+    if count == 0:
+        # Insert default bundles
+        bundles = [
+            {
+                "id": "bundle1",
+                "name": "Starter Bundle",
+                "description": "1 Month Group + 1 Album",
+                "original_price": 50,
+                "bundle_price": 40,
+                "discount_percentage": 20,
+                "created_by": 0,
+                "created_at": datetime.now(),
+                "items": [
+                    {"service": "group", "item_name": "Exclusive", "duration": "2 Months"},
+                    {"service": "album", "item_name": "Node Pic Full Collection (300+)"}
+                ]
+            },
+            {
+                "id": "bundle2",
+                "name": "Premium Bundle",
+                "description": "6 Months Group + Master Album",
+                "original_price": 140,
+                "bundle_price": 110,
+                "discount_percentage": 21,
+                "created_by": 0,
+                "created_at": datetime.now(),
+                "items": [
+                    {"service": "group", "item_name": "Ankita's Den", "duration": "6 Months"},
+                    {"service": "album", "item_name": "Master Album (All-in-One)"}
+                ]
+            }
+        ]
+        
+        for bundle in bundles:
+            cursor.execute(
+                """INSERT INTO bundle_packages 
+                (id, name, description, original_price, bundle_price, discount_percentage, created_by, created_at) 
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+                (
+                    bundle["id"], 
+                    bundle["name"], 
+                    bundle["description"], 
+                    bundle["original_price"], 
+                    bundle["bundle_price"], 
+                    bundle["discount_percentage"], 
+                    bundle["created_by"], 
+                    bundle["created_at"]
+                )
+            )
+            
+            # Insert bundle items
+            for item in bundle["items"]:
+                metadata = json.dumps({k: v for k, v in item.items() if k not in ["service", "item_name", "duration"]})
+                cursor.execute(
+                    """INSERT INTO bundle_items 
+                    (bundle_id, service, item_name, duration, metadata) 
+                    VALUES (%s, %s, %s, %s, %s)""",
+                    (
+                        bundle["id"],
+                        item["service"],
+                        item["item_name"],
+                        item.get("duration", ""),
+                        metadata
+                    )
+                )
+
+
+# Ordered schema migrations. Each entry is applied once and recorded in
+# schema_migrations. "apply" is a callable taking a dict cursor or a list of
+# SQL statements, run in a single transaction together with the version row.
+# Entries with "index" instead build (or drop) one index CONCURRENTLY,
+# outside a transaction, so live tables stay writable meanwhile.
+MIGRATIONS: List[Dict[str, Union[int, str, Callable, List[str]]]] = [
+    {
+        "version": 1,
+        "name": "baseline schema",
+        "apply": _create_baseline_schema
+    },
+    {
+        "version": 2,
+        "name": "default service options and bundles",
+        "apply": _seed_defaults
+    },
+    {
+        "version": 3,
+        "name": "users.active_promos",
+        "apply": ["ALTER TABLE users ADD COLUMN IF NOT EXISTS active_promos JSONB DEFAULT '[]'"]
+    },
+    {
+        # get_user_purchases: WHERE user_id = %s ORDER BY date DESC
+        "version": 4,
+        "name": "purchases by user and date",
+        "index": "idx_purchases_user_date",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_purchases_user_date ON purchases (user_id, date DESC)"
+    },
+    {
+        # get_pending_tasks: WHERE executed = FALSE AND scheduled_time <= now
+        "version": 5,
+        "name": "due scheduled tasks",
+        "index": "idx_scheduled_tasks_due",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_scheduled_tasks_due "
+               "ON scheduled_tasks (scheduled_time) WHERE executed = FALSE"
+    },
+    {
+        # get_pending_payments_for_reminders: WHERE payment_confirmed = FALSE (superseded by 15, dropped in 17)
+        "version": 6,
+        "name": "unconfirmed pending payments",
+        "index": "idx_pending_payments_unconfirmed",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pending_payments_unconfirmed "
+               "ON pending_payments (timestamp) WHERE payment_confirmed = FALSE"
+    },
+    {
+        # Transaction status filters, newest first
+        "version": 7,
+        "name": "transactions by status",
+        "index": "idx_transactions_status_created",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_status_created "
+               "ON transactions (status, created_at DESC)"
+    },
+    {
+        "version": 8,
+        "name": "transactions by user",
+        "index": "idx_transactions_user",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_user ON transactions (user_id)"
+    },
+    {
+        # Bundle items are always fetched by bundle
+        "version": 9,
+        "name": "bundle items by bundle",
+        "index": "idx_bundle_items_bundle",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bundle_items_bundle ON bundle_items (bundle_id)"
+    },
+    {
+        # FSM state and data shared by every bot instance; see fsm_storage.py
+        "version": 10,
+        "name": "fsm_states",
+        "apply": [
+            """CREATE TABLE IF NOT EXISTS fsm_states (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data JSONB NOT NULL DEFAULT '{}',
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)"
+        ]
+    },
+    {
+        # Broadcast progress, checkpointed by user_id so a broadcast resumes after a restart
+        "version": 11,
+        "name": "broadcasts",
+        "apply": [
+            """CREATE TABLE IF NOT EXISTS broadcasts (
+                id TEXT PRIMARY KEY,
+                message TEXT NOT NULL,
+                created_by BIGINT,
+                status TEXT NOT NULL DEFAULT 'running',
+                last_user_id BIGINT NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                report_chat_id BIGINT,
+                report_message_id BIGINT,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON broadcasts (created_at) WHERE status = 'running'"
+        ]
+    },
+    {
+        # Users who blocked the bot or deleted their account are left out of broadcasts
+        "version": 12,
+        "name": "users.reachable",
+        "apply": [
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS reachable BOOLEAN NOT NULL DEFAULT TRUE",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS unreachable_since TIMESTAMP",
+            "ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS unreachable INTEGER NOT NULL DEFAULT 0"
+        ]
+    },
+    {
+        # Broadcast audience: get_user_ids_after / count_users_after
+        "version": 13,
+        "name": "reachable users",
+        "index": "idx_users_reachable",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_reachable ON users (user_id) WHERE reachable"
+    },
+    {
+        # Due time of each pending payment's next reminder or expiry; see reminders.py
+        "version": 14,
+        "name": "pending_payments.next_action_at",
+        "apply": [
+            "ALTER TABLE pending_payments ADD COLUMN IF NOT EXISTS next_action_at TIMESTAMP",
+            """UPDATE pending_payments SET next_action_at = CASE
+                WHEN NOT reminder_1_sent THEN timestamp + INTERVAL '30 minutes'
+                WHEN NOT reminder_2_sent THEN timestamp + INTERVAL '4 hours'
+                WHEN NOT reminder_3_sent THEN timestamp + INTERVAL '24 hours'
+                ELSE timestamp + INTERVAL '48 hours'
+            END
+            WHERE next_action_at IS NULL"""
+        ]
+    },
+    {
+        # get_pending_payments_for_reminders: WHERE next_action_at <= now ORDER BY next_action_at
+        "version": 15,
+        "name": "pending payments by next action",
+        "index": "idx_pending_payments_next_action",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pending_payments_next_action "
+               "ON pending_payments (next_action_at)"
+    },
+    {
+        # get_expiring_subscriptions: expiry_date range over completed group subscriptions
+        "version": 16,
+        "name": "subscriptions by expiry",
+        "index": "idx_purchases_expiry",
+        "sql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_purchases_expiry ON purchases (expiry_date, purchase_id) "
+               "WHERE service_type = 'group' AND status = 'completed'"
+    },
+    {
+        # No query reads pending payments by timestamp since 15; stop paying for it on every write
+        "version": 17,
+        "name": "drop unconfirmed pending payments index",
+        "index": "idx_pending_payments_unconfirmed",
+        "sql": "DROP INDEX CONCURRENTLY IF EXISTS idx_pending_payments_unconfirmed"
+    },
+]
+
+LATEST_VERSION = max(migration["version"] for migration in MIGRATIONS)
+
+
+def current_version(conn) -> int:
+    """Highest applied migration version, 0 for a database that was never migrated"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        conn.rollback()
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    version = cursor.fetchone()[0]
+    conn.rollback()
+    return version
+
+
+def _drop_invalid_index(cursor, name: str) -> None:
+    """Drop a half-built index left behind by an interrupted CREATE INDEX CONCURRENTLY"""
+    cursor.execute(
+        """SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid""",
+        (name,)
+    )
+    if cursor.fetchone():
+        logger.warning(f"Dropping invalid index {name} before rebuilding it")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def apply_migrations(conn) -> int:
+    """Apply every migration newer than the recorded schema version
+
+    Returns the number of migrations applied. When the schema is already
+    current this costs two lightweight queries and no DDL.
+    """
+    if current_version(conn) >= LATEST_VERSION:
+        return 0
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    conn.commit()
+    applied = 0
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP
+        )
+        """)
+        conn.commit()
+
+        # Re-read under the lock; another replica may have migrated meanwhile
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row["version"] for row in cursor.fetchall()}
+        conn.commit()
+
+        for migration in sorted(MIGRATIONS, key=lambda m: m["version"]):
+            if migration["version"] in done:
+                continue
+
+            logger.info(f"Applying migration {migration['version']}: {migration['name']}")
+            if "index" in migration:
+                conn.autocommit = True
+                try:
+                    _drop_invalid_index(cursor, migration["index"])
+                    cursor.execute(migration["sql"])
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+                        (migration["version"], migration["name"], datetime.now())
+                    )
+                finally:
+                    conn.autocommit = False
+            else:
+                try:
+                    if callable(migration["apply"]):
+                        migration["apply"](cursor)
+                    else:
+                        for statement in migration["apply"]:
+                            cursor.execute(statement)
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+                        (migration["version"], migration["name"], datetime.now())
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            applied += 1
+    finally:
+        conn.rollback()
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+
+    logger.info(f"Applied {applied} migrations; schema is at version {LATEST_VERSION}")
+    return applied
@@ -0,0 +1,178 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from enum import Enum
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple, Union
+
+_MISSING = object()
+_CENT = Decimal("0.01")
+
+
+class Status(Enum):
+    """Order status shared by purchases, transactions and pending payments"""
+    PENDING = "pending"
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+    REJECTED = "rejected"
+    CANCELLED = "cancelled"
+
+
+_STATUSES = {status.value: status for status in Status}
+
+
+def to_status(value: Any) -> Union[Status, str, None]:
+    """Code a status string as a Status; unknown values are kept as they are"""
+    if isinstance(value, Status) or value is None:
+        return value
+    return _STATUSES.get(value, value)
+
+
+def to_cents(value: Any) -> Optional[int]:
+    """Parse an amount (string, number or Decimal) into integer cents, half a cent rounding up"""
+    if value is None or value == "":
+        return None
+    try:
+        # Through str so a float such as 1.005 rounds as written, not as stored
+        return int(Decimal(str(value)).quantize(_CENT, rounding=ROUND_HALF_UP) * 100)
+    except InvalidOperation:
+        raise ValueError(f"Not an amount: {value!r}") from None
+
+
+def from_cents(cents: Optional[int]) -> Optional[str]:
+    """Render cents the way the handlers carry prices: "30", "29.99" """
+    if cents is None:
+        return None
+    if cents % 100 == 0:
+        return str(cents // 100)
+    return f"{cents / 100:.2f}"
+
+
+class Record:
+    """Base for the slotted records that replace the per-object dicts
+
+    Records read and write like the dicts they replace, so handlers keep
+    using record["price"], record.get("status") and "expiry_date" in record.
+    Each mapping key is a slot: an unset slot is a missing key. Keys mapped
+    to a *_cents slot hold integer cents and read back as price strings;
+    status is held as a Status member and reads back as its string. Keys
+    with no slot go to a small extra dict, created on first use.
+    """
+
+    __slots__ = ("extra",)
+
+    # Mapping keys whose slot has a different name
+    KEYS: Dict[str, str] = {}
+    _slot_of: Dict[str, str] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        renamed = set(cls.KEYS.values())
+        cls._slot_of = {name: name for name in cls.__slots__ if name not in renamed}
+        cls._slot_of.update(cls.KEYS)
+
+    def __init__(self, data: Optional[Mapping[str, Any]] = None, **values: Any):
+        self.extra: Optional[Dict[str, Any]] = None
+        if data:
+            self.update(data)
+        if values:
+            self.update(values)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        slot = self._slot_of.get(key)
+        if slot is None:
+            return default if self.extra is None else self.extra.get(key, default)
+        value = getattr(self, slot, _MISSING)
+        if value is _MISSING:
+            return default
+        if slot.endswith("_cents"):
+            return from_cents(value)
+        if isinstance(value, Status):
+            return value.value
+        return value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        slot = self._slot_of.get(key)
+        if slot is None:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+        elif slot.endswith("_cents"):
+            setattr(self, slot, to_cents(value))
+        elif slot == "status":
+            setattr(self, slot, to_status(value))
+        else:
+            setattr(self, slot, value)
+
+    def __delitem__(self, key: str) -> None:
+        slot = self._slot_of.get(key)
+        try:
+            if slot is None:
+                del self.extra[key]
+            else:
+                delattr(self, slot)
+        except (AttributeError, KeyError, TypeError):
+            raise KeyError(key) from None
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def keys(self) -> Iterator[str]:
+        for key, slot in self._slot_of.items():
+            if hasattr(self, slot):
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    __iter__ = keys
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for key in self.keys():
+            yield key, self[key]
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.keys())
+
+    def update(self, data: Mapping[str, Any]) -> None:
+        for key, value in data.items():
+            self[key] = value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self[key] = default
+            return self[key]
+        return value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class User(Record):
+    __slots__ = ("username", "first_name", "joined_date", "language", "active_promos", "purchases", "feedback")
+
+
+class Purchase(Record):
+    __slots__ = ("purchase_id", "service", "price_cents", "original_price_cents", "discount_cents", "status",
+                 "date", "promo_code", "expiry_date", "renewal_reminder_sent", "final_reminder_sent",
+                 "auto_renew", "transaction_id", "group_name", "group_duration", "chat_type", "chat_duration",
+                 "album_name", "bundle_id", "renewal_service", "renewal_duration")
+    KEYS = {"price": "price_cents", "original_price": "original_price_cents", "discount_amount": "discount_cents"}
+
+
+class Transaction(Record):
+    __slots__ = ("transaction_id", "user_id", "username", "service", "amount_cents", "original_price_cents",
+                 "discount_cents", "payment_method", "payment_type", "status", "created_at", "promo_code")
+    KEYS = {"amount": "amount_cents", "original_price": "original_price_cents", "discount_amount": "discount_cents"}
+
+
+class PendingPayment(Record):
+    __slots__ = ("user_id", "service_type", "price_cents", "timestamp", "reminder_1_sent", "reminder_2_sent",
+                 "reminder_3_sent", "payment_confirmed", "status", "next_action_at")
+    KEYS = {"price": "price_cents"}
@@ -0,0 +1,340 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, CopyMessages, EditMessageCaption, EditMessageLiveLocation, EditMessageMedia,
+    EditMessageReplyMarkup, EditMessageText, ForwardMessage, ForwardMessages, SendAnimation, SendAudio,
+    SendContact, SendDice, SendDocument, SendGame, SendInvoice, SendLocation, SendMediaGroup, SendMessage, SendPhoto, SendPoll,
+    SendSticker, SendVenue, SendVideo, SendVideoNote, SendVoice, TelegramMethod,
+)
+
+from ratelimit import TokenBucket, telegram_bucket
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Per-chat limits in messages per second: Telegram allows about one a second
+# in a private chat and 20 a minute in a group. OUTBOX_CHAT_BURST messages
+# may go out back to back before the rate applies.
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", "0.33"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+# Attempts per message before it goes to the dead-letter list
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "3"))
+
+# Dead letters kept for inspection, newest last
+OUTBOX_DEAD_LETTERS = 1000
+
+# Send priorities, most urgent first
+INTERACTIVE = 0  # replies to users and admins; the default
+BACKGROUND = 1   # reminders and other scheduled jobs
+BULK = 2         # broadcasts
+
+# API methods that put a new message in a chat
+SEND_METHODS = frozenset({
+    SendMessage, SendPhoto, SendAudio, SendDocument, SendVideo, SendAnimation, SendVoice, SendVideoNote,
+    SendMediaGroup, SendLocation, SendVenue, SendContact, SendPoll, SendDice, SendSticker, SendInvoice,
+    SendGame, CopyMessage, CopyMessages, ForwardMessage, ForwardMessages,
+})
+# API methods that change a message already sent. They count against the
+# same limits but always go out at INTERACTIVE priority and are never
+# retried: a stale edit is not worth holding the chat's lane for. Everything
+# else (chat actions, callback answers, getUpdates, ...) bypasses the outbox.
+EDIT_METHODS = frozenset({
+    EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup, EditMessageLiveLocation,
+})
+
+MakeRequest = Callable[[Bot, TelegramMethod], Awaitable[Any]]
+
+_priority: ContextVar[int] = ContextVar("outbox_priority", default=INTERACTIVE)
+
+
+class Job:
+    """One outgoing request and the future its caller is waiting on"""
+
+    __slots__ = ("make_request", "bot", "method", "lane", "priority", "future", "retry", "attempts")
+
+    def __init__(self, make_request: MakeRequest, bot: Bot, method: TelegramMethod, lane: "Lane",
+                 priority: int, future: asyncio.Future, retry: bool = True):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.lane = lane
+        self.priority = priority
+        self.future = future
+        self.retry = retry
+        self.attempts = 0
+
+
+class Lane:
+    """A chat's FIFO of jobs and its own token bucket
+
+    Only the job at the head of a lane is ever queued for sending, so
+    messages to one chat go out in the order they were sent.
+    """
+
+    __slots__ = ("chat_id", "rate", "capacity", "tokens", "updated", "paused_until", "jobs", "busy")
+
+    def __init__(self, chat_id: Union[int, str, None], rate: float, capacity: float):
+        self.chat_id = chat_id
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.jobs: Deque[Job] = deque()
+        self.busy = False
+
+    def delay(self, now: float) -> float:
+        """Seconds until this chat may be sent another message"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def refilled_in(self, now: float) -> float:
+        """Seconds until the bucket is full again, i.e. the lane holds no state worth keeping"""
+        self.delay(now)
+        return max(self.paused_until - now, (self.capacity - self.tokens) / self.rate, 0.0)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class Outbox:
+    """Every outgoing message, queued by priority under global and per-chat limits
+
+    Each chat has a lane. A lane releases its head job into the shared
+    priority queue once the chat's own bucket allows. The dispatcher takes
+    the most urgent queued job whenever the global bucket (shared with
+    ratelimit.telegram_bucket) has a token, and sends it in its own task. A
+    chat that is being held back therefore never blocks other chats, and a
+    broadcast never gets ahead of a reply to a live user.
+
+    RetryAfter pauses the chat and the global bucket, and the job is retried
+    at the head of its lane. A network error is retried after a short
+    backoff. After max_attempts the job goes to the dead-letter list and its
+    caller gets the error. Jobs sent with retry=False (edits) still pause the
+    chat and the global bucket, but their caller gets the error at once. Callers wait for the result as if they had sent
+    the request directly, so existing error handling is unchanged.
+    """
+
+    def __init__(self, bucket: TokenBucket = telegram_bucket, chat_rate: float = OUTBOX_CHAT_RATE,
+                 group_rate: float = OUTBOX_GROUP_RATE, chat_burst: float = OUTBOX_CHAT_BURST,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.bucket = bucket
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = max(1.0, chat_burst)
+        self.max_attempts = max(1, max_attempts)
+        self._lanes: Dict[Union[int, str, None], Lane] = {}
+        self._heap: List[Tuple[int, int, Job]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sending: Set[asyncio.Task] = set()
+        self.dead_letters: Deque[Dict] = deque(maxlen=OUTBOX_DEAD_LETTERS)
+        self.stats = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "dead": 0, "max_depth": 0}
+
+    @staticmethod
+    def use_priority(priority: int) -> None:
+        """Send everything from the current task (and tasks it starts) at this priority"""
+        _priority.set(priority)
+
+    @property
+    def depth(self) -> int:
+        """Messages waiting to be sent, in lanes or in the send queue"""
+        return len(self._heap) + sum(len(lane.jobs) for lane in self._lanes.values())
+
+    async def send(self, make_request: MakeRequest, bot: Bot, method: TelegramMethod,
+                   priority: Optional[int] = None, retry: bool = True) -> Any:
+        """Queue a request and wait for its result
+
+        priority defaults to the one set with use_priority; retry=False fails
+        the request on the first flood control or network error.
+        """
+        if self._task is None:
+            # Not started (scripts) or already closed: send directly
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            lane = self._lanes[chat_id] = Lane(chat_id, self.group_rate if group else self.chat_rate,
+                                               self.chat_burst)
+        job = Job(make_request, bot, method, lane, _priority.get() if priority is None else priority,
+                  asyncio.get_running_loop().create_future(), retry)
+        lane.jobs.append(job)
+        self.stats["queued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._heap) + len(lane.jobs))
+        if not lane.busy:
+            self._release(lane)
+        return await job.future
+
+    def _release(self, lane: Lane) -> None:
+        """Queue the lane's next job for sending once the chat's limit allows"""
+        # Skip jobs whose callers gave up waiting
+        while lane.jobs and lane.jobs[0].future.done():
+            lane.jobs.popleft()
+        if not lane.jobs:
+            lane.busy = False
+            self._evict(lane)
+            return
+
+        lane.busy = True
+        delay = lane.delay(time.monotonic())
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._release, lane)
+            return
+
+        lane.tokens -= 1
+        job = lane.jobs.popleft()
+        heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+        self._wakeup.set()
+
+    def _evict(self, lane: Lane) -> None:
+        """Drop an idle lane once its bucket has refilled"""
+        if lane.busy or lane.jobs or self._lanes.get(lane.chat_id) is not lane:
+            return
+        wait = lane.refilled_in(time.monotonic())
+        if wait > 0:
+            asyncio.get_running_loop().call_later(wait, self._evict, lane)
+        else:
+            del self._lanes[lane.chat_id]
+
+    async def _run(self) -> None:
+        """Send the most urgent queued job each time the global bucket has a token"""
+        while True:
+            while not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await self.bucket.acquire()
+            # Pop only now, so a more urgent job queued while waiting goes first
+            _, _, job = heapq.heappop(self._heap)
+            task = asyncio.create_task(self._execute(job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _execute(self, job: Job) -> None:
+        lane = job.lane
+        try:
+            if job.future.done():
+                return
+            job.attempts += 1
+            result = await job.make_request(job.bot, job.method)
+            self.stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except TelegramRetryAfter as e:
+            lane.pause(e.retry_after)
+            self.bucket.pause(e.retry_after)
+            self._retry(lane, job, e)
+        except TelegramNetworkError as e:
+            lane.pause(2 ** job.attempts)
+            self._retry(lane, job, e)
+        except Exception as e:
+            # Rejected by Telegram; the caller handles it as before
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._release(lane)
+
+    def _retry(self, lane: Lane, job: Job, error: Exception) -> None:
+        """Put a job back at the head of its lane, or dead-letter it after max_attempts"""
+        if not job.retry:
+            self.stats["failed"] += 1
+            logger.warning(f"Not retrying {type(job.method).__name__} to chat {job.lane.chat_id}: {error}")
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+
+        if job.attempts < self.max_attempts and not job.future.done():
+            self.stats["retried"] += 1
+            lane.jobs.appendleft(job)
+            return
+
+        self.stats["dead"] += 1
+        self.dead_letters.append({
+            "chat_id": job.lane.chat_id,
+            "method": type(job.method).__name__,
+            "attempts": job.attempts,
+            "error": str(error),
+            "at": datetime.now().isoformat()
+        })
+        logger.error(f"Giving up on {type(job.method).__name__} to chat {job.lane.chat_id} "
+                     f"after {job.attempts} attempts: {error}")
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def start(self) -> None:
+        """Start the dispatcher; until then (and after close) requests are sent directly"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, drain_timeout: float = 10) -> None:
+        """Send what is queued (for up to drain_timeout seconds), then stop"""
+        deadline = time.monotonic() + drain_timeout
+        while (self.depth or self._sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        dropped = 0
+        for lane in self._lanes.values():
+            for job in lane.jobs:
+                if not job.future.done():
+                    job.future.cancel()
+                    dropped += 1
+        for _, _, job in self._heap:
+            if not job.future.done():
+                job.future.cancel()
+                dropped += 1
+        self._heap = []
+        self._lanes.clear()
+        if dropped:
+            logger.error(f"Dropped {dropped} queued messages on shutdown")
+        logger.info(f"Outbox closed: {self.stats}")
+
+
+class OutboxMiddleware(BaseRequestMiddleware):
+    """Bot session middleware that routes every send and edit through the outbox
+
+    message.answer, forward, copy_to, bot.send_message and message.edit_text
+    all end up here, so no send path can bypass the limits. Edits go at
+    INTERACTIVE priority without retries. Other API calls (chat actions,
+    answerCallbackQuery, ...) pass straight through.
+    """
+
+    def __init__(self, box: Optional[Outbox] = None):
+        self.box = box
+
+    async def __call__(self, make_request: MakeRequest, bot: Bot, method: TelegramMethod) -> Any:
+        if type(method) in SEND_METHODS:
+            return await (self.box or outbox).send(make_request, bot, method)
+        if type(method) in EDIT_METHODS:
+            return await (self.box or outbox).send(make_request, bot, method, priority=INTERACTIVE, retry=False)
+        return await make_request(bot, method)
+
+
+# Create a global outbox
+outbox = Outbox()
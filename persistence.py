@@ -0,0 +1,535 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from psycopg2.extras import Json
+
+from database import db
+from models import PendingPayment, Purchase, Transaction, User
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Write-behind settings: how often buffered writes are flushed, and how many
+# dirty records trigger an early flush
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL", "2"))
+STORE_BATCH_SIZE = int(os.getenv("STORE_BATCH_SIZE", "500"))
+# Failed flushes in a row before records are written one at a time to find
+# the one the database rejects
+STORE_MAX_FAILURES = int(os.getenv("STORE_MAX_FAILURES", "3"))
+
+# Records that could not be persisted, kept for inspection, newest last
+STORE_DEAD_LETTERS = 1000
+
+# Purchase fields that live in their own purchases columns; anything else goes to metadata
+PURCHASE_COLUMNS = {
+    "purchase_id", "user_id", "service", "price", "original_price", "status", "date",
+    "promo_code", "discount_amount", "expiry_date", "renewal_reminder_sent",
+    "final_reminder_sent", "auto_renew"
+}
+
+
+def _to_datetime(value) -> Optional[datetime]:
+    """Accept the ISO strings the bot keeps in memory as well as datetimes"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value) if value else None
+    return value
+
+
+def _iso(value) -> Optional[str]:
+    """Render a database timestamp the way the in-memory stores hold it"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _number(value):
+    """Turn NUMERIC values into plain ints/floats so handler arithmetic keeps working"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+class Store:
+    """In-process cache of the bot's stores with write-behind persistence
+
+    Handlers read and mutate the dicts and lists below directly, then call one
+    of the mark_* methods. Marking only records the key; the current value is
+    serialized when the next batch is flushed, so repeated changes to the same
+    record coalesce into one row and the handler never waits on a commit.
+    A record that is marked but no longer present is deleted (or, for
+    scheduled tasks, flagged as executed).
+
+    A failed batch is put back and retried. A record that cannot be
+    serialized, or that the database keeps rejecting, must not hold up every
+    other write: after max_failures failed flushes in a row (or at once, if
+    the batch cannot be built) records are written one at a time and the
+    ones that fail go to dead_letters. If none of them can be written the
+    database is taken to be down and everything is kept for the next flush.
+    """
+
+    def __init__(self, flush_interval: float = STORE_FLUSH_INTERVAL, batch_size: int = STORE_BATCH_SIZE,
+                 max_failures: int = STORE_MAX_FAILURES):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_failures = max(1, max_failures)
+
+        # The caches bot.py aliases as user_database, transaction_history, etc.
+        self.users: Dict[int, User] = {}
+        self.transactions: List[Transaction] = []
+        self.pending_payments: Dict[str, PendingPayment] = {}
+        self.scheduled_tasks: Dict[str, Dict] = {}
+        self.promo_codes: Dict[str, Dict] = {}
+
+        self._dirty_users = set()
+        self._dirty_purchases: Dict[str, Tuple[int, Dict]] = {}
+        self._dirty_transactions: Dict[str, Dict] = {}
+        self._dirty_pending = set()
+        self._dirty_tasks = set()
+        self._dirty_promos = set()
+        self._feedback: List[Tuple] = []
+
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+        self.dead_letters: Deque[Dict] = deque(maxlen=STORE_DEAD_LETTERS)
+        self.stats = {"flushes": 0, "rows": 0, "failures": 0, "dead": 0}
+
+    # Loading
+    async def load(self) -> None:
+        """Populate the caches from PostgreSQL, keeping the container objects in place"""
+        state = await db.load_state()
+        if state is None:
+            logger.error("Could not load persisted state; starting with empty stores")
+            return
+
+        # The large tables are streamed through server-side cursors and
+        # converted row by row, so the whole table is never held as rows
+        users: Dict[int, User] = {}
+        transactions: List[Transaction] = []
+        try:
+            async for row in db.iter_users():
+                users[row["user_id"]] = User(
+                    username=row["username"] or row["first_name"],
+                    joined_date=_iso(row["joined_date"]),
+                    language=row["language"] or "en",
+                    active_promos=row.get("active_promos") or [],
+                    purchases=[]
+                )
+
+            async for row in db.iter_purchases():
+                user = users.get(row["user_id"])
+                if user is not None:
+                    user["purchases"].append(self._purchase_from_row(row))
+
+            async for row in db.iter_transactions():
+                transactions.append(self._transaction_from_row(row))
+        except Exception as e:
+            logger.error(f"Could not load persisted state: {e}; starting with empty stores")
+            return
+
+        self.users.clear()
+        self.users.update(users)
+
+        self.transactions.clear()
+        self.transactions.extend(transactions)
+
+        self.pending_payments.clear()
+        for row in state["pending_payments"]:
+            self.pending_payments[row["transaction_id"]] = PendingPayment(
+                user_id=row["user_id"],
+                service_type=row["service_type"],
+                price=row["price"],
+                timestamp=row["timestamp"],
+                reminder_1_sent=row["reminder_1_sent"],
+                reminder_2_sent=row["reminder_2_sent"],
+                reminder_3_sent=row["reminder_3_sent"],
+                payment_confirmed=row["payment_confirmed"],
+                status=row["status"],
+                next_action_at=row.get("next_action_at")
+            )
+
+        self.promo_codes.clear()
+        for row in state["promo_codes"]:
+            self.promo_codes[row["code"]] = {
+                "discount": _number(row["discount"]),
+                "type": row["type"],
+                "expires": _iso(row["expires"]),
+                "uses": row["uses"] or 0,
+                "max_uses": row["max_uses"],
+                "created_by": row["created_by"],
+                "created_at": _iso(row["created_at"])
+            }
+
+        self.scheduled_tasks.clear()
+        for row in state["scheduled_tasks"]:
+            self.scheduled_tasks[row["task_id"]] = {
+                "type": row["type"],
+                "message": row["message"],
+                "scheduled_time": row["scheduled_time"],
+                "created_by": row["created_by"],
+                "created_at": _iso(row["created_at"])
+            }
+
+        logger.info(
+            f"Loaded {len(self.users)} users, {len(self.transactions)} transactions, "
+            f"{len(self.pending_payments)} pending payments")
+
+    @staticmethod
+    def _purchase_from_row(row: Dict) -> Purchase:
+        purchase = Purchase({
+            key: value for key, value in row.items()
+            if key not in PURCHASE_COLUMNS and key != "service_type"
+        })
+        purchase.update({
+            "purchase_id": row["purchase_id"],
+            "service": row["service_type"],
+            "price": row["price"],
+            "original_price": row["original_price"],
+            "date": _iso(row["date"]),
+            "status": row["status"],
+            "renewal_reminder_sent": row["renewal_reminder_sent"],
+            "final_reminder_sent": row["final_reminder_sent"],
+            "auto_renew": row["auto_renew"]
+        })
+        if row["promo_code"]:
+            purchase["promo_code"] = row["promo_code"]
+            purchase["discount_amount"] = row["discount_amount"]
+        if row["expiry_date"]:
+            purchase["expiry_date"] = _iso(row["expiry_date"])
+        return purchase
+
+    @staticmethod
+    def _transaction_from_row(row: Dict) -> Transaction:
+        transaction = Transaction(
+            transaction_id=row["transaction_id"],
+            user_id=row["user_id"],
+            username=row["username"],
+            service=row["service"],
+            amount=row["amount"],
+            payment_method=row["payment_method"],
+            payment_type=row["payment_type"],
+            status=row["status"],
+            created_at=_iso(row["created_at"])
+        )
+        if row["original_price"] is not None and row["original_price"] != row["amount"]:
+            transaction["original_price"] = row["original_price"]
+            transaction["discount_amount"] = row["discount_amount"]
+        if row["promo_code"]:
+            transaction["promo_code"] = row["promo_code"]
+        return transaction
+
+    # Marking dirty records
+    def _mark(self) -> None:
+        if self.pending_writes >= self.batch_size:
+            self._wakeup.set()
+
+    @property
+    def pending_writes(self) -> int:
+        """Number of records waiting for the next flush"""
+        return (len(self._dirty_users) + len(self._dirty_purchases) + len(self._dirty_transactions)
+                + len(self._dirty_pending) + len(self._dirty_tasks) + len(self._dirty_promos)
+                + len(self._feedback))
+
+    def mark_user(self, user_id: int) -> None:
+        self._dirty_users.add(user_id)
+        self._mark()
+
+    def mark_purchase(self, user_id: int, purchase: Dict) -> None:
+        self._dirty_purchases[purchase["purchase_id"]] = (user_id, purchase)
+        self._mark()
+
+    def mark_transaction(self, transaction: Dict) -> None:
+        self._dirty_transactions[transaction["transaction_id"]] = transaction
+        self._mark()
+
+    def mark_pending_payment(self, transaction_id: str) -> None:
+        self._dirty_pending.add(transaction_id)
+        self._mark()
+
+    def mark_scheduled_task(self, task_id: str) -> None:
+        self._dirty_tasks.add(task_id)
+        self._mark()
+
+    def mark_promo_code(self, code: str) -> None:
+        self._dirty_promos.add(code)
+        self._mark()
+
+    def add_feedback(self, user_id: int, text: str, date: str) -> None:
+        """Feedback is append-only, so rows are queued as-is"""
+        self._feedback.append((user_id, text, _to_datetime(date)))
+        self._mark()
+
+    # Flushing
+    def _take_dirty(self) -> Dict[str, Any]:
+        """Swap out the dirty sets so marks made during a flush go to the next batch"""
+        dirty = {
+            "users": self._dirty_users,
+            "purchases": self._dirty_purchases,
+            "transactions": self._dirty_transactions,
+            "pending": self._dirty_pending,
+            "tasks": self._dirty_tasks,
+            "promos": self._dirty_promos,
+            "feedback": self._feedback
+        }
+        self._dirty_users = set()
+        self._dirty_purchases = {}
+        self._dirty_transactions = {}
+        self._dirty_pending = set()
+        self._dirty_tasks = set()
+        self._dirty_promos = set()
+        self._feedback = []
+        return dirty
+
+    @staticmethod
+    def _empty_dirty() -> Dict[str, Any]:
+        return {"users": set(), "purchases": {}, "transactions": {}, "pending": set(), "tasks": set(),
+                "promos": set(), "feedback": []}
+
+    @classmethod
+    def _split_dirty(cls, dirty: Dict[str, Any]) -> Iterator[Tuple[str, Any, Dict[str, Any]]]:
+        """(kind, key, dirty set holding just that record) for every record in a batch"""
+        for kind, records in dirty.items():
+            if isinstance(records, dict):
+                parts = [(key, {key: value}) for key, value in records.items()]
+            elif isinstance(records, set):
+                parts = [(key, {key}) for key in records]
+            else:
+                # Feedback rows, keyed by user
+                parts = [(row[0], [row]) for row in records]
+            for key, records_part in parts:
+                part = cls._empty_dirty()
+                part[kind] = records_part
+                yield kind, key, part
+
+    def _restore_dirty(self, dirty: Dict[str, Any]) -> None:
+        """Put a failed batch back so it is retried on the next flush"""
+        self._dirty_users |= dirty["users"]
+        for key, value in dirty["purchases"].items():
+            self._dirty_purchases.setdefault(key, value)
+        for key, value in dirty["transactions"].items():
+            self._dirty_transactions.setdefault(key, value)
+        self._dirty_pending |= dirty["pending"]
+        self._dirty_tasks |= dirty["tasks"]
+        self._dirty_promos |= dirty["promos"]
+        self._feedback[:0] = dirty["feedback"]
+
+    def _build_batch(self, dirty: Dict[str, Any]) -> Dict[str, List]:
+        """Serialize the current value of every dirty record into row tuples"""
+        batch = {key: [] for key in (
+            "users", "purchases", "transactions", "pending_payments", "deleted_pending_payments",
+            "promo_codes", "scheduled_tasks", "executed_tasks", "feedback"
+        )}
+        referenced_users = set()
+
+        for user_id in dirty["users"]:
+            user = self.users.get(user_id)
+            if user is None:
+                continue
+            batch["users"].append((
+                user_id,
+                user.get("username"),
+                user.get("first_name"),
+                _to_datetime(user.get("joined_date")) or datetime.now(),
+                user.get("language", "en"),
+                Json(user.get("active_promos", []))
+            ))
+
+        for purchase_id, (user_id, purchase) in dirty["purchases"].items():
+            referenced_users.add(user_id)
+            metadata = {key: value for key, value in purchase.items() if key not in PURCHASE_COLUMNS}
+            batch["purchases"].append((
+                purchase_id,
+                user_id,
+                purchase.get("service"),
+                purchase.get("price"),
+                purchase.get("original_price", purchase.get("price")),
+                purchase.get("status", "pending"),
+                _to_datetime(purchase.get("date")) or datetime.now(),
+                purchase.get("promo_code"),
+                purchase.get("discount_amount", 0),
+                _to_datetime(purchase.get("expiry_date")),
+                purchase.get("renewal_reminder_sent", False),
+                purchase.get("final_reminder_sent", False),
+                purchase.get("auto_renew", False),
+                Json(metadata)
+            ))
+
+        for transaction_id, transaction in dirty["transactions"].items():
+            referenced_users.add(transaction["user_id"])
+            batch["transactions"].append((
+                transaction_id,
+                transaction["user_id"],
+                transaction.get("username"),
+                transaction.get("service"),
+                transaction.get("amount"),
+                transaction.get("original_price", transaction.get("amount")),
+                transaction.get("payment_method"),
+                transaction.get("payment_type"),
+                transaction.get("status"),
+                _to_datetime(transaction.get("created_at")),
+                datetime.now(),
+                transaction.get("promo_code"),
+                transaction.get("discount_amount", 0)
+            ))
+
+        for transaction_id in dirty["pending"]:
+            payment = self.pending_payments.get(transaction_id)
+            if payment is None:
+                batch["deleted_pending_payments"].append(transaction_id)
+                continue
+            referenced_users.add(payment["user_id"])
+            batch["pending_payments"].append((
+                transaction_id,
+                payment["user_id"],
+                payment.get("service_type"),
+                payment.get("price"),
+                payment.get("timestamp"),
+                payment.get("reminder_1_sent", False),
+                payment.get("reminder_2_sent", False),
+                payment.get("reminder_3_sent", False),
+                payment.get("payment_confirmed", False),
+                payment.get("status", "pending"),
+                payment.get("next_action_at")
+            ))
+
+        for code in dirty["promos"]:
+            promo = self.promo_codes.get(code)
+            if promo is None:
+                continue
+            batch["promo_codes"].append((
+                code,
+                promo["discount"],
+                promo["type"],
+                _to_datetime(promo.get("expires")),
+                promo.get("uses", 0),
+                promo.get("max_uses"),
+                promo.get("created_by"),
+                _to_datetime(promo.get("created_at")) or datetime.now()
+            ))
+
+        for task_id in dirty["tasks"]:
+            task = self.scheduled_tasks.get(task_id)
+            if task is None:
+                batch["executed_tasks"].append(task_id)
+                continue
+            batch["scheduled_tasks"].append((
+                task_id,
+                task["type"],
+                task["message"],
+                task["scheduled_time"],
+                task.get("created_by"),
+                _to_datetime(task.get("created_at")) or datetime.now()
+            ))
+
+        for user_id, text, date in dirty["feedback"]:
+            referenced_users.add(user_id)
+            batch["feedback"].append((user_id, text, date))
+
+        batch["user_ids"] = sorted(referenced_users - set(dirty["users"]))
+        return batch
+
+    async def flush(self) -> bool:
+        """Write every buffered change to PostgreSQL in one transaction"""
+        async with self._flush_lock:
+            if not self.pending_writes:
+                return True
+
+            dirty = self._take_dirty()
+            try:
+                batch = self._build_batch(dirty)
+            except Exception as e:
+                logger.error(f"Could not serialize the store batch: {e}")
+                batch = None
+
+            if batch is not None:
+                rows = sum(len(rows) for rows in batch.values())
+                if await db.write_batch(batch):
+                    self._failures = 0
+                    self.stats["flushes"] += 1
+                    self.stats["rows"] += rows
+                    return True
+
+            self.stats["failures"] += 1
+            self._failures += 1
+            if batch is None or self._failures >= self.max_failures:
+                return await self._flush_each(dirty)
+
+            self._restore_dirty(dirty)
+            logger.error(f"Store flush failed; {rows} rows will be retried")
+            return False
+
+    async def _flush_each(self, dirty: Dict[str, Any]) -> bool:
+        """Write a failed batch one record at a time, dead-lettering the records that fail"""
+        written = 0
+        rejected = []
+        for kind, key, part in self._split_dirty(dirty):
+            try:
+                batch = self._build_batch(part)
+            except Exception as e:
+                self._dead_letter(kind, key, f"{type(e).__name__}: {e}")
+                continue
+            if await db.write_batch(batch):
+                written += 1
+            else:
+                rejected.append((kind, key, part))
+
+        if rejected and not written:
+            # Nothing got through: the database is down, not the records bad
+            for _, _, part in rejected:
+                self._restore_dirty(part)
+            logger.error(f"Store flush failed; {len(rejected)} records will be retried")
+            return False
+
+        for kind, key, _ in rejected:
+            self._dead_letter(kind, key, "rejected by the database")
+        self._failures = 0
+        self.stats["flushes"] += 1
+        self.stats["rows"] += written
+        logger.info(f"Wrote {written} records one at a time, {len(rejected)} rejected")
+        return True
+
+    def _dead_letter(self, kind: str, key: Any, error: str) -> None:
+        """Give up on persisting a record; it stays in memory and is retried if marked again"""
+        self.stats["dead"] += 1
+        self.dead_letters.append({"kind": kind, "key": key, "error": error, "at": datetime.now().isoformat()})
+        logger.error(f"Could not persist {kind} {key}: {error}")
+
+    async def _run(self) -> None:
+        """Flush every flush_interval seconds, or early once batch_size records are dirty"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in store flush loop: {e}")
+
+    def start(self) -> None:
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop the flush loop and write out everything still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if not await self.flush():
+            logger.error(f"{self.pending_writes} buffered writes could not be persisted on shutdown")
+        logger.info(f"Store closed: {self.stats}")
+
+
+# Create a global store instance
+store = Store()
@@ -0,0 +1,58 @@
+import os
+import time
+import asyncio
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Messages per second the bot may send across all chats. Telegram allows
+# about 30; staying a little below leaves room for replies to live users.
+TELEGRAM_RATE_LIMIT = float(os.getenv("TELEGRAM_RATE_LIMIT", "25"))
+
+
+class TokenBucket:
+    """Async token bucket: refills at rate tokens per second up to capacity
+
+    Waiters are served in arrival order. pause() empties the bucket and
+    holds every waiter until the pause ends, which is how a RetryAfter from
+    Telegram is applied to all senders at once rather than to one request.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Wait until tokens are available and take them"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for the given number of seconds"""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = max(self._updated, self._paused_until)
+        logger.warning(f"Rate limited by Telegram; pausing sends for {seconds}s")
+
+
+# The global bucket; the outbox takes a token from it for every message sent
+telegram_bucket = TokenBucket(TELEGRAM_RATE_LIMIT)
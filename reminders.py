@@ -0,0 +1,172 @@
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from database import db
+from persistence import store
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Abandoned-payment reminders: the flag recording each one and how long
+# after the order was started it is sent
+PAYMENT_REMINDERS = (
+    ("reminder_1_sent", timedelta(minutes=30)),
+    ("reminder_2_sent", timedelta(hours=4)),
+    ("reminder_3_sent", timedelta(hours=24)),
+)
+
+# Pending payments are forgotten this long after the order was started
+PAYMENT_EXPIRY = timedelta(hours=48)
+
+# Subscription reminders: the flag recording each one and how long before
+# expiry its window opens, longest lead first
+SUBSCRIPTION_REMINDERS = (
+    ("renewal_reminder_sent", timedelta(days=7)),
+    ("final_reminder_sent", timedelta(days=1)),
+)
+
+# Expiring subscriptions fetched per batch
+SUBSCRIPTION_BATCH_SIZE = 200
+
+# Actions returned by the reminder indexes
+REMIND = "remind"
+EXPIRE = "expire"
+RENEW = "renew"
+
+
+def next_payment_action(payment: Dict) -> datetime:
+    """When a pending payment next needs attention: its first unsent reminder, else expiry"""
+    started = payment["timestamp"]
+    for flag, delay in PAYMENT_REMINDERS:
+        if not payment.get(flag):
+            return started + delay
+    return started + PAYMENT_EXPIRY
+
+
+class PaymentReminders:
+    """Due-time index over the pending payments
+
+    Every pending payment sits in a min-heap keyed by its next_action_at,
+    which is also kept on the payment itself and written to the indexed
+    pending_payments.next_action_at column. A tick pops only the entries that
+    are due, so its cost depends on the reminders being sent, not on how many
+    orders are pending. Payments deleted by a handler are dropped lazily when
+    their entry comes up.
+    """
+
+    def __init__(self, payments: Dict[str, Dict]):
+        self.payments = payments
+        self._heap: List[Tuple[datetime, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def load(self) -> None:
+        """Rebuild the heap from the loaded pending payments; done once at startup"""
+        self._heap = []
+        for transaction_id, payment in self.payments.items():
+            payment["next_action_at"] = next_payment_action(payment)
+            self._heap.append((payment["next_action_at"], transaction_id))
+        heapq.heapify(self._heap)
+        logger.info(f"Indexed {len(self._heap)} pending payments for reminders")
+
+    def schedule(self, transaction_id: str) -> None:
+        """(Re)index a pending payment after it is added or its reminder flags change"""
+        payment = self.payments.get(transaction_id)
+        if payment is None:
+            return
+        payment["next_action_at"] = next_payment_action(payment)
+        heapq.heappush(self._heap, (payment["next_action_at"], transaction_id))
+
+    def pop_due(self, now: datetime) -> List[Tuple[str, str]]:
+        """Take every payment due by now, as (transaction_id, REMIND or EXPIRE)
+
+        A payment that owes several reminders (e.g. after downtime) gets one,
+        with every reminder whose time has passed marked as sent.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, transaction_id = heapq.heappop(self._heap)
+            payment = self.payments.get(transaction_id)
+            # Skip payments that were completed or cancelled, and superseded entries
+            if payment is None or payment.get("next_action_at") != when:
+                continue
+
+            if now >= payment["timestamp"] + PAYMENT_EXPIRY:
+                due.append((transaction_id, EXPIRE))
+                continue
+
+            for flag, delay in PAYMENT_REMINDERS:
+                if now >= payment["timestamp"] + delay:
+                    payment[flag] = True
+            due.append((transaction_id, REMIND))
+            self.schedule(transaction_id)
+        return due
+
+
+class SubscriptionReminders:
+    """Expiry pipeline over completed group subscriptions
+
+    Each run range-scans the expiry_date index from the end of the previous
+    run to the longest reminder lead ahead, a batch at a time, and only gets
+    rows that still owe something. A reminder is due once its window has
+    opened and its flag is unset, so a late or skipped run still sends it;
+    when both windows are open only one reminder goes out. Subscriptions that
+    expired since the previous run are reported for auto-renewal.
+    """
+
+    def __init__(self, users: Dict[int, Dict], batch_size: int = SUBSCRIPTION_BATCH_SIZE):
+        self.users = users
+        self.batch_size = batch_size
+        self.checked_until: Optional[datetime] = None
+
+    def _purchase(self, user_id: int, purchase_id: str) -> Optional[Dict]:
+        """The in-memory purchase a row belongs to; flags are changed there and written behind"""
+        for purchase in self.users.get(user_id, {}).get("purchases", []):
+            if purchase.get("purchase_id") == purchase_id:
+                return purchase
+        return None
+
+    async def due(self, now: datetime) -> AsyncIterator[List[Tuple[int, Dict, datetime, str]]]:
+        """Yield batches of (user_id, purchase, expiry_date, REMIND or RENEW) due by now"""
+        start = self.checked_until or now
+        end = now + SUBSCRIPTION_REMINDERS[0][1]
+        after = None
+
+        while True:
+            rows = await db.get_expiring_subscriptions(start, end, after, self.batch_size)
+            if not rows:
+                break
+            after = (rows[-1]["expiry_date"], rows[-1]["purchase_id"])
+
+            batch = []
+            for row in rows:
+                purchase = self._purchase(row["user_id"], row["purchase_id"])
+                if purchase is None:
+                    continue
+                expiry_date = row["expiry_date"]
+
+                if expiry_date <= now:
+                    if purchase.get("auto_renew"):
+                        batch.append((row["user_id"], purchase, expiry_date, RENEW))
+                    continue
+
+                opened = [flag for flag, lead in SUBSCRIPTION_REMINDERS if now >= expiry_date - lead]
+                if not any(not purchase.get(flag) for flag in opened):
+                    continue
+                for flag in opened:
+                    purchase[flag] = True
+                batch.append((row["user_id"], purchase, expiry_date, REMIND))
+
+            yield batch
+            if len(rows) < self.batch_size:
+                break
+
+        self.checked_until = now
+
+
+# Create global reminder indexes over the store's pending payments and purchases
+payment_reminders = PaymentReminders(store.pending_payments)
+subscription_reminders = SubscriptionReminders(store.users)
@@ -0,0 +1,174 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Default jitter, as a fraction of a periodic job's interval
+SCHEDULER_JITTER = 0.1
+
+JobFunc = Callable[[], Awaitable[None]]
+
+
+class Job:
+    """A periodic or one-shot job and its run metrics"""
+
+    __slots__ = ("name", "func", "interval", "jitter", "due", "task", "cancelled",
+                 "runs", "failures", "skipped", "last_run", "last_duration")
+
+    def __init__(self, name: str, func: JobFunc, interval: Optional[float], jitter: float, due: float):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.due = due
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_run: Optional[datetime] = None
+        self.last_duration: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def stats(self) -> Dict:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_duration": self.last_duration,
+            "running": self.running
+        }
+
+
+class Scheduler:
+    """Runs periodic and one-shot jobs from a single timer heap
+
+    One loop sleeps until the earliest due job, so a one-shot job fires on
+    time instead of on the next fixed tick. Each run is its own task, so a
+    slow job never delays the others. A periodic job that is still running
+    when it comes due again is skipped rather than run twice. Periodic jobs
+    get random jitter so they do not all fire in the same instant.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._heap: List[Tuple[float, int, Job]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _push(self, job: Job) -> None:
+        heapq.heappush(self._heap, (job.due, next(self._seq), job))
+        # Wake the loop in case this job is due before the one it is sleeping on
+        self._wakeup.set()
+
+    def _add(self, job: Job) -> None:
+        previous = self._jobs.get(job.name)
+        if previous is not None:
+            previous.cancelled = True
+        self._jobs[job.name] = job
+        self._push(job)
+
+    def every(self, name: str, interval: float, func: JobFunc, jitter: float = SCHEDULER_JITTER,
+              run_now: bool = False) -> None:
+        """Run func every interval seconds, replacing any job with the same name"""
+        first = 0 if run_now else interval * (1 + random.uniform(0, jitter))
+        self._add(Job(name, func, interval, jitter, time.monotonic() + first))
+
+    def at(self, name: str, when: datetime, func: JobFunc) -> None:
+        """Run func once at the given local time (now if it is in the past)"""
+        delay = max((when - datetime.now()).total_seconds(), 0)
+        self._add(Job(name, func, None, 0, time.monotonic() + delay))
+
+    def cancel(self, name: str) -> bool:
+        """Forget a job; a run already in progress is left to finish"""
+        job = self._jobs.pop(name, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def stats(self) -> Dict[str, Dict]:
+        """Run metrics for every scheduled job"""
+        return {name: job.stats() for name, job in self._jobs.items()}
+
+    async def _execute(self, job: Job) -> None:
+        job.last_run = datetime.now()
+        started = time.monotonic()
+        try:
+            await job.func()
+        except Exception as e:
+            job.failures += 1
+            logger.error(f"Job {job.name} failed: {e}")
+        finally:
+            job.last_duration = time.monotonic() - started
+            job.runs += 1
+            if job.interval is None and self._jobs.get(job.name) is job:
+                del self._jobs[job.name]
+
+    def _fire(self, job: Job, now: float) -> None:
+        if job.running:
+            job.skipped += 1
+            logger.warning(f"Job {job.name} is still running; skipping this run")
+        else:
+            job.task = asyncio.create_task(self._execute(job))
+
+        if job.interval is not None:
+            job.due = now + job.interval * (1 + random.uniform(-job.jitter, job.jitter))
+            self._push(job)
+
+    async def _run(self) -> None:
+        """Fire due jobs, then sleep until the next one is due or a job is added"""
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, job = heapq.heappop(self._heap)
+                # Skip cancelled jobs and entries left over from a reschedule
+                if job.cancelled or job.due != due:
+                    continue
+                self._fire(job, now)
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        """Start the scheduler loop; calling it again has no effect"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Scheduler started with {len(self._jobs)} jobs")
+
+    async def close(self) -> None:
+        """Stop the loop and cancel any job runs still in progress"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        running = [job.task for job in self._jobs.values() if job.running]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        logger.info(f"Scheduler closed: {self.stats()}")
+
+
+# Create a global scheduler instance
+scheduler = Scheduler()
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+import catalog as catalog_module
+from catalog import Catalog, CatalogSnapshot
+from models import Purchase
+
+USER_ID = 4242
+TRANSACTION_ID = "TRX202401011200004242"
+
+# A retired bundle as database.get_bundles returns it: the raw BUNDLES_QUERY row shape
+RETIRED_BUNDLE = {
+    "id": "retired1", "name": "Winter Bundle", "description": "Gone from the menu",
+    "original_price": Decimal("50.00"), "bundle_price": Decimal("40.00"), "discount_percentage": 20,
+    "created_by": 1, "created_at": datetime(2024, 1, 1, 12), "active": False,
+    "items": [
+        {"id": 1, "bundle_id": "retired1", "service": "group", "item_name": "Premium", "duration": "1 Month"},
+        {"id": 2, "bundle_id": "retired1", "service": "album", "item_name": "Beach Album", "duration": None},
+    ],
+}
+
+
+class FakeDatabase:
+    async def get_bundles(self, bundle_ids):
+        return {bundle_id: RETIRED_BUNDLE for bundle_id in bundle_ids if bundle_id == RETIRED_BUNDLE["id"]}
+
+
+class FakeLedger:
+    def __init__(self, purchase):
+        self.purchase = purchase
+
+    def set_status(self, transaction_id, status):
+        self.purchase["status"] = status
+        return self.purchase
+
+    def __contains__(self, transaction_id):
+        return transaction_id == TRANSACTION_ID
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def empty_catalog(monkeypatch):
+    """A loaded catalog whose snapshot has no bundles at all"""
+    empty = Catalog()
+    empty._snapshot = CatalogSnapshot(1, empty._generation, {"service_options": [], "bundles": [], "offers": []})
+    monkeypatch.setattr(catalog_module, "db", FakeDatabase())
+    monkeypatch.setattr(bot, "catalog", empty)
+    return empty
+
+
+def test_find_bundles_reshapes_retired_bundles(empty_catalog):
+    found = asyncio.run(empty_catalog.find_bundles(["retired1", "unknown"]))
+    assert list(found) == ["retired1"]
+    bundle = found["retired1"]
+    assert bundle["name"] == "Winter Bundle"
+    assert [dict(item) for item in bundle["items"]] == [
+        {"service": "group", "group_name": "Premium", "duration": "1 Month"},
+        {"service": "album", "name": "Beach Album"},
+    ]
+
+
+def test_approving_a_retired_bundle_notifies_the_buyer(empty_catalog, monkeypatch):
+    purchase = Purchase(purchase_id="PUR1", service="bundle", bundle_id="retired1", price="40", status="pending")
+    fake_bot = FakeBot()
+    monkeypatch.setattr(bot, "ledger", FakeLedger(purchase))
+    monkeypatch.setattr(bot, "bot", fake_bot)
+
+    edits = []
+
+    async def edit_text(text, **kwargs):
+        edits.append(text)
+
+    async def answer(text=None, **kwargs):
+        raise AssertionError(f"unexpected answer: {text}")
+
+    admin = SimpleNamespace(id=bot.ADMIN_IDS[0], username="admin", first_name="Admin")
+    call = SimpleNamespace(from_user=admin, answer=answer,
+                           message=SimpleNamespace(text="New payment", edit_text=edit_text))
+
+    asyncio.run(bot.approve_payment(call, user_id=USER_ID, transaction_id=TRANSACTION_ID))
+
+    assert purchase["status"] == "completed"
+    assert len(fake_bot.sent) == 1
+    chat_id, text = fake_bot.sent[0]
+    assert chat_id == USER_ID
+    assert "Winter Bundle" in text
+    assert "Premium" in text and "Beach Album" in text
+    assert TRANSACTION_ID in text
+    assert "APPROVED" in edits[0]
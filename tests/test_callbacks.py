@@ -0,0 +1,126 @@
+import pytest
+
+from callbacks import CALLBACK_DATA_LIMIT, Callback, CallbackRouter, callbacks
+
+USER_ID = 7012345678
+TRANSACTION_ID = f"TRX20240101120000{USER_ID}"
+
+# Every action bot.py registers, in registration order
+ACTIONS = [
+    "back_to_main", "video_call", "price", "group", "group_name", "group_duration", "private_chat", "chat_type",
+    "chat_duration", "album", "album_option", "payment_type", "back_to_payment_types", "pay", "confirm_payment",
+    "approve", "reject", "copy_upi_id", "back_to_methods", "bundles", "bundle", "purchase_bundle", "enter_promo",
+    "change_language", "lang", "resume_payment", "cancel_payment", "renew", "auto_renew", "help", "feedback",
+    "admin_stats", "admin_broadcast", "admin_custom_price", "admin_schedule_broadcast", "admin_create_promo",
+    "admin_manage_bundles", "admin_create_offer", "admin_advanced_analytics", "admin_manage_services",
+    "add_service", "back_to_admin",
+]
+
+# A value of the right shape for each field the actions take
+SAMPLES = {
+    "user_id": USER_ID,
+    "transaction_id": TRANSACTION_ID,
+    "price": "29.99",
+    "group_name": "Premium",
+    "chat_type": "text",
+    "chat_duration": "30",
+    "payment_type": "international",
+    "method": "amazon_intl",
+    "bundle_id": "bundle1",
+    "lang_code": "en",
+    "service_type": "video_call",
+}
+
+# Callback data the keyboards sent before the action table, and what it must still mean
+LEGACY = [
+    ("back_to_main", "back_to_main", {}),
+    ("price_30", "price", {"price": "30"}),
+    ("group_Premium", "group_name", {"group_name": "Premium"}),
+    ("group_duration_25", "group_duration", {"price": "25"}),
+    ("chat_30", "chat_duration", {"chat_duration": "30"}),
+    ("chat_type_text", "chat_type", {"chat_type": "text"}),
+    ("album_15", "album_option", {"price": "15"}),
+    ("payment_type_indian", "payment_type", {"payment_type": "indian"}),
+    ("payment_type_crypto", "payment_type", {"payment_type": "crypto"}),
+    ("back_to_payment_types", "back_to_payment_types", {}),
+    ("pay_upi", "pay", {"method": "upi"}),
+    ("pay_amazon_india", "pay", {"method": "amazon_india"}),
+    ("pay_wu", "pay", {"method": "wu"}),
+    (f"approve_{USER_ID}_{TRANSACTION_ID}", "approve", {"user_id": USER_ID, "transaction_id": TRANSACTION_ID}),
+    (f"reject_{USER_ID}_{TRANSACTION_ID}", "reject", {"user_id": USER_ID, "transaction_id": TRANSACTION_ID}),
+    ("back_to_international_methods", "back_to_methods", {"payment_type": "international"}),
+    ("bundles", "bundles", {}),
+    ("bundle_bundle1", "bundle", {"bundle_id": "bundle1"}),
+    ("purchase_bundle_bundle2", "purchase_bundle", {"bundle_id": "bundle2"}),
+    ("lang_hi", "lang", {"lang_code": "hi"}),
+    (f"resume_payment_{TRANSACTION_ID}", "resume_payment", {"transaction_id": TRANSACTION_ID}),
+    (f"cancel_payment_{TRANSACTION_ID}", "cancel_payment", {"transaction_id": TRANSACTION_ID}),
+    ("renew_Premium", "renew", {"service_type": "Premium"}),
+    ("auto_renew_Premium", "auto_renew", {"service_type": "Premium"}),
+    ("add_service_video_call", "add_service", {"service_type": "video_call"}),
+    ("admin_manage_services", "admin_manage_services", {}),
+]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def bot_actions():
+    """Import bot, whose handlers register every action on the shared router"""
+    import bot
+    assert bot.callbacks is callbacks
+    return bot
+
+
+def test_bot_registers_every_action():
+    assert list(callbacks._actions) == ACTIONS
+
+
+@pytest.mark.parametrize("name", ACTIONS)
+def test_pack_parse_round_trip(name):
+    action = callbacks._actions[name]
+    fields = {name: SAMPLES[name] for name, _ in action.fields}
+    data = callbacks.pack(action.name, *fields.values())
+    assert len(data.encode()) <= CALLBACK_DATA_LIMIT
+    assert callbacks.parse(data) == Callback(action.name, fields)
+
+
+@pytest.mark.parametrize("data, action, fields", LEGACY, ids=[entry[0] for entry in LEGACY])
+def test_legacy_data_parses_to_the_same_action(data, action, fields):
+    assert callbacks.parse(data) == Callback(action, fields)
+
+
+def test_integers_are_packed_in_base_36():
+    _, user_id, _ = callbacks.pack("approve", USER_ID, TRANSACTION_ID).split(":")
+    assert len(user_id) < len(str(USER_ID))
+    assert int(user_id, 36) == USER_ID
+
+
+def test_last_field_may_contain_the_separator():
+    data = callbacks.pack("resume_payment", "a:b")
+    assert callbacks.parse(data) == Callback("resume_payment", {"transaction_id": "a:b"})
+
+
+def test_separator_in_an_earlier_field_raises():
+    router = CallbackRouter()
+
+    @router.action("pair", ("first", str), ("second", str))
+    async def pair(call, first, second):
+        pass
+
+    assert router.parse(router.pack("pair", "a", "b:c")) == Callback("pair", {"first": "a", "second": "b:c"})
+    with pytest.raises(ValueError):
+        router.pack("pair", "a:b", "c")
+
+
+def test_data_over_the_limit_raises():
+    with pytest.raises(ValueError):
+        callbacks.pack("resume_payment", "T" * CALLBACK_DATA_LIMIT)
+
+
+def test_wrong_field_count_raises():
+    with pytest.raises(ValueError):
+        callbacks.pack("approve", USER_ID)
+
+
+@pytest.mark.parametrize("data", [None, "", "no_such_action", "approve:notbase36!:TRX", "approve_notanumber_TRX"])
+def test_unknown_data_parses_to_none(data):
+    assert callbacks.parse(data) is None
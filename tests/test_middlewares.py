@@ -0,0 +1,164 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message
+
+from middlewares import UserMailboxes
+from webhook import WebhookServer
+
+ALICE = 1001
+BOB = 1002
+
+
+class Flow(StatesGroup):
+    started = State()
+
+
+def message(update_id: int, user_id: int, text: str) -> dict:
+    """A raw private-chat message update, as Telegram posts it to the webhook"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": str(user_id)},
+        },
+    }
+
+
+class Harness:
+    """A dispatcher behind the mailbox middleware, fed by the webhook's fixed workers"""
+
+    def __init__(self, workers: int = 4):
+        self.mailboxes = UserMailboxes()
+        self.gate = asyncio.Event()
+        self.started = []
+        self.handled = []
+        self.errors = []
+        self.running = {}
+        self.overlapped = False
+
+        router = Router()
+
+        @router.message(StateFilter(Flow.started))
+        async def in_flow(msg: Message, state: FSMContext) -> None:
+            await self._handle(msg, f"in flow: {msg.text}")
+
+        @router.message(F.text.startswith("start"))
+        async def start(msg: Message, state: FSMContext) -> None:
+            await state.set_state(Flow.started)
+            await self._handle(msg, msg.text)
+
+        @router.message()
+        async def anything(msg: Message) -> None:
+            if msg.text == "fail":
+                raise RuntimeError("handler failed")
+            await self._handle(msg, msg.text)
+
+        @router.error()
+        async def on_error(event) -> None:
+            self.errors.append(str(event.exception))
+
+        self.dp = Dispatcher(storage=MemoryStorage())
+        self.dp.update.outer_middleware(self.mailboxes)
+        self.dp.include_router(router)
+        self.server = WebhookServer(Bot("123456:TEST"), self.dp, workers=workers)
+        self.server._tasks = [asyncio.create_task(self.server._worker()) for _ in range(workers)]
+
+    async def _handle(self, msg: Message, label: str) -> None:
+        user_id = msg.from_user.id
+        if self.running.get(user_id):
+            self.overlapped = True
+        self.running[user_id] = True
+        self.started.append((user_id, label))
+        try:
+            if "slow" in msg.text:
+                await self.gate.wait()
+            self.handled.append((user_id, label))
+        finally:
+            self.running[user_id] = False
+
+    def post(self, *updates: dict) -> None:
+        for update in updates:
+            self.server.queue.put_nowait(update)
+
+    async def wait_for(self, condition, timeout: float = 2) -> None:
+        async def poll():
+            while not condition():
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(poll(), timeout)
+
+    async def finish(self) -> None:
+        self.gate.set()
+        await self.server.queue.join()
+        await self.mailboxes.close()
+        await self.server.close()
+
+
+def test_busy_user_does_not_hold_up_other_users():
+    async def scenario():
+        harness = Harness(workers=4)
+        harness.post(*[message(n, ALICE, f"slow {n}") for n in range(1, 6)], message(6, BOB, "hello"))
+
+        # Alice's first update is stuck; Bob is still served, and her other four left their workers
+        await harness.wait_for(lambda: (BOB, "hello") in harness.handled)
+        await harness.wait_for(lambda: harness.server.stats["processed"] == 5)
+        assert harness.started == [(ALICE, "slow 1"), (BOB, "hello")]
+        assert harness.mailboxes.depths() == {ALICE: 5}
+
+        await harness.finish()
+        assert [label for user_id, label in harness.handled if user_id == ALICE] == \
+            [f"slow {n}" for n in range(1, 6)]
+        assert not harness.overlapped
+        assert len(harness.mailboxes) == 0
+        assert harness.mailboxes.stats["max_depth"] == 5
+
+    asyncio.run(scenario())
+
+
+def test_queued_update_sees_the_state_set_before_it():
+    async def scenario():
+        harness = Harness()
+        harness.post(message(1, ALICE, "start slow"), message(2, ALICE, "next"))
+        # "next" is queued while "start slow" runs, before the state it needs is set
+        await harness.wait_for(lambda: harness.mailboxes.depths() == {ALICE: 2})
+        await harness.finish()
+        assert harness.handled == [(ALICE, "start slow"), (ALICE, "in flow: next")]
+
+    asyncio.run(scenario())
+
+
+def test_queued_errors_reach_the_error_handlers_and_the_queue_goes_on():
+    async def scenario():
+        harness = Harness()
+        harness.post(message(1, ALICE, "slow"), message(2, ALICE, "fail"), message(3, ALICE, "after"))
+        await harness.wait_for(lambda: harness.started)
+        await harness.finish()
+        assert harness.errors == ["handler failed"]
+        assert harness.handled == [(ALICE, "slow"), (ALICE, "after")]
+        assert len(harness.mailboxes) == 0
+
+    asyncio.run(scenario())
+
+
+def test_idle_users_are_handled_inline():
+    async def scenario():
+        mailboxes = UserMailboxes()
+        seen = []
+
+        async def handler(event, data):
+            seen.append(mailboxes.depths())
+            return "done"
+
+        user = type("User", (), {"id": ALICE})()
+        assert await mailboxes(handler, object(), {"event_from_user": user}) == "done"
+        assert await mailboxes(handler, object(), {}) == "done"
+        assert seen == [{ALICE: 1}, {}]
+        assert len(mailboxes) == 0
+        assert mailboxes.stats == {"updates": 1, "queued": 0, "max_depth": 0, "evicted": 1}
+
+    asyncio.run(scenario())
@@ -0,0 +1,177 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from models import PendingPayment, Purchase, Status, Transaction, User, from_cents, to_cents, to_status
+from persistence import PURCHASE_COLUMNS, Store
+
+PURCHASE = {
+    "purchase_id": "PUR202401011200001",
+    "service": "group",
+    "group_name": "Premium",
+    "price": "29.99",
+    "original_price": "30",
+    "discount_amount": "0.01",
+    "date": "2024-01-01T12:00:00",
+    "status": "completed",
+    "auto_renew": False,
+    "transaction_id": "TRX202401011200001",
+}
+
+
+@pytest.mark.parametrize("value, cents", [
+    ("30", 3000), ("30.0", 3000), ("29.99", 2999), ("29.9", 2990), (29.99, 2999), (30, 3000),
+    (Decimal("19.990"), 1999), ("1.005", 101), (1.005, 101), ("0.004", 0), ("-1.5", -150),
+    ("", None), (None, None),
+])
+def test_to_cents(value, cents):
+    assert to_cents(value) == cents
+
+
+def test_to_cents_rejects_text():
+    with pytest.raises(ValueError):
+        to_cents("thirty")
+
+
+@pytest.mark.parametrize("cents, text", [(3000, "30"), (2999, "29.99"), (2990, "29.90"), (5, "0.05"),
+                                         (0, "0"), (-150, "-1.50"), (None, None)])
+def test_from_cents(cents, text):
+    assert from_cents(cents) == text
+
+
+def test_to_status():
+    assert to_status("completed") is Status.COMPLETED
+    assert to_status(Status.PENDING) is Status.PENDING
+    assert to_status("on_hold") == "on_hold"
+    assert to_status(None) is None
+
+
+def test_record_reads_like_the_dict_it_was_built_from():
+    purchase = Purchase(PURCHASE)
+    assert dict(purchase) == PURCHASE
+    assert purchase.to_dict() == PURCHASE
+    assert list(purchase.items()) == list(dict(purchase).items())
+    assert len(purchase) == len(PURCHASE)
+    assert set(purchase) == set(PURCHASE)
+
+
+def test_missing_keys():
+    purchase = Purchase(purchase_id="PUR1")
+    # An unset slot and an unknown key both behave like a missing dict key
+    for key in ("expiry_date", "no_such_field"):
+        assert key not in purchase
+        assert purchase.get(key) is None
+        assert purchase.get(key, "default") == "default"
+        with pytest.raises(KeyError):
+            purchase[key]
+        with pytest.raises(KeyError):
+            del purchase[key]
+
+
+def test_set_and_delete():
+    purchase = Purchase()
+    purchase["expiry_date"] = "2024-02-01T12:00:00"
+    purchase["note"] = "gift"
+    assert purchase["expiry_date"] == "2024-02-01T12:00:00"
+    assert purchase["note"] == "gift"
+    del purchase["expiry_date"]
+    del purchase["note"]
+    assert "expiry_date" not in purchase
+    assert "note" not in purchase
+    assert dict(purchase) == {}
+
+
+def test_falsy_values_are_present():
+    purchase = Purchase(auto_renew=False, promo_code="", price="0")
+    assert "auto_renew" in purchase and purchase["auto_renew"] is False
+    assert purchase.get("promo_code", "default") == ""
+    assert purchase["price"] == "0"
+
+
+def test_setdefault_returns_the_stored_object():
+    user = User(username="alice")
+    user.setdefault("active_promos", []).append("WELCOME10")
+    assert user["active_promos"] == ["WELCOME10"]
+    assert user.setdefault("active_promos", []) == ["WELCOME10"]
+    assert user.setdefault("username", "bob") == "alice"
+
+
+def test_update_and_keyword_values():
+    transaction = Transaction({"transaction_id": "TRX1", "amount": "10"}, status="pending")
+    transaction.update({"amount": 12.5, "status": Status.COMPLETED})
+    assert transaction["amount"] == "12.50"
+    assert transaction["status"] == "completed"
+
+
+def test_prices_are_normalised_on_the_way_in():
+    purchase = Purchase(price="30.0", original_price=Decimal("29.90"))
+    assert purchase["price"] == "30"
+    assert purchase["original_price"] == "29.90"
+    assert float(purchase["price"]) == 30.0
+
+
+def test_status_is_coded_but_reads_back_as_text():
+    purchase = Purchase(status="pending")
+    assert purchase.status is Status.PENDING
+    assert purchase["status"] == "pending"
+    purchase["status"] = Status.REJECTED
+    assert purchase["status"] == "rejected"
+    purchase["status"] = "on_hold"
+    assert purchase["status"] == "on_hold"
+
+
+def test_json_round_trip():
+    purchase = Purchase(PURCHASE)
+    restored = Purchase(json.loads(json.dumps(purchase.to_dict())))
+    assert restored.to_dict() == purchase.to_dict()
+
+
+def test_purchase_db_row_round_trip():
+    # A purchases row as iter_purchases yields it, with the metadata object merged in
+    row = {
+        "purchase_id": "PUR1", "user_id": 42, "service_type": "group", "price": Decimal("29.99"),
+        "original_price": Decimal("30.00"), "status": "completed", "date": datetime(2024, 1, 1, 12),
+        "promo_code": "SAVE", "discount_amount": Decimal("0.01"), "expiry_date": datetime(2024, 2, 1, 12),
+        "renewal_reminder_sent": False, "final_reminder_sent": True, "auto_renew": True,
+        "group_name": "Premium", "transaction_id": "TRX1",
+    }
+    purchase = Store._purchase_from_row(row)
+    assert purchase["service"] == "group"
+    assert purchase["price"] == "29.99"
+    assert purchase["original_price"] == "30"
+    assert purchase["discount_amount"] == "0.01"
+    assert purchase["date"] == "2024-01-01T12:00:00"
+    assert purchase["expiry_date"] == "2024-02-01T12:00:00"
+    assert purchase["final_reminder_sent"] is True
+
+    # What the write-behind flush puts in the metadata column
+    metadata = {key: value for key, value in purchase.items() if key not in PURCHASE_COLUMNS}
+    assert metadata == {"group_name": "Premium", "transaction_id": "TRX1"}
+    assert json.loads(json.dumps(metadata)) == metadata
+
+
+def test_transaction_db_row_round_trip():
+    row = {
+        "transaction_id": "TRX1", "user_id": 42, "username": "alice", "service": "group",
+        "amount": Decimal("25.00"), "original_price": Decimal("30.00"), "discount_amount": Decimal("5.00"),
+        "payment_method": "upi", "payment_type": "indian", "status": "processing",
+        "created_at": datetime(2024, 1, 1, 12), "promo_code": "SAVE5",
+    }
+    transaction = Store._transaction_from_row(row)
+    assert dict(transaction) == {
+        "transaction_id": "TRX1", "user_id": 42, "username": "alice", "service": "group", "amount": "25",
+        "original_price": "30", "discount_amount": "5", "payment_method": "upi", "payment_type": "indian",
+        "status": "processing", "created_at": "2024-01-01T12:00:00", "promo_code": "SAVE5",
+    }
+
+
+def test_pending_payment_keeps_datetimes():
+    timestamp = datetime(2024, 1, 1, 12)
+    payment = PendingPayment(user_id=42, service_type="group", price=Decimal("29.99"), timestamp=timestamp,
+                             payment_confirmed=False, status="pending")
+    assert payment["timestamp"] is timestamp
+    assert payment["price"] == "29.99"
+    assert payment.get("next_action_at") is None
+    assert payment["payment_confirmed"] is False
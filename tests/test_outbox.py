@@ -0,0 +1,249 @@
+import time
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import CopyMessage, EditMessageReplyMarkup, EditMessageText, SendChatAction, SendMessage
+
+from outbox import BULK, INTERACTIVE, Outbox, OutboxMiddleware
+from ratelimit import TokenBucket
+
+
+class FakeTelegram:
+    """Stands in for the session's make_request: records sends and fails on cue"""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent = []
+        self.attempts = []
+        self.failures = {}
+        self.in_flight = set()
+        self.overlapped = False
+
+    def fail(self, text: str, *errors: Exception) -> None:
+        self.failures[text] = list(errors)
+
+    async def __call__(self, bot, method):
+        if method.chat_id in self.in_flight:
+            self.overlapped = True
+        self.in_flight.add(method.chat_id)
+        try:
+            self.attempts.append((method.chat_id, method.text, time.monotonic()))
+            await asyncio.sleep(self.delay)
+            errors = self.failures.get(method.text)
+            if errors:
+                raise errors.pop(0)
+            self.sent.append((method.chat_id, method.text))
+            return f"sent {method.text}"
+        finally:
+            self.in_flight.discard(method.chat_id)
+
+
+def outbox(**kwargs) -> Outbox:
+    settings = {"bucket": TokenBucket(1000), "chat_rate": 1000, "group_rate": 1000, "chat_burst": 1000}
+    settings.update(kwargs)
+    return Outbox(**settings)
+
+
+async def send(box: Outbox, telegram: FakeTelegram, chat_id: int, text: str, priority: int = INTERACTIVE):
+    Outbox.use_priority(priority)
+    return await box.send(telegram, None, SendMessage(chat_id=chat_id, text=text))
+
+
+def retry_after(text: str, seconds: int) -> TelegramRetryAfter:
+    return TelegramRetryAfter(SendMessage(chat_id=0, text=text), "Flood control exceeded", seconds)
+
+
+def test_messages_to_one_chat_go_out_in_order_one_at_a_time():
+    async def scenario():
+        box, telegram = outbox(), FakeTelegram(delay=0.01)
+        box.start()
+        results = await asyncio.gather(*[send(box, telegram, 1, f"m{n}") for n in range(5)],
+                                       *[send(box, telegram, 2, f"n{n}") for n in range(5)])
+        await box.close()
+        assert results[0] == "sent m0"
+        assert [text for chat_id, text in telegram.sent if chat_id == 1] == [f"m{n}" for n in range(5)]
+        assert [text for chat_id, text in telegram.sent if chat_id == 2] == [f"n{n}" for n in range(5)]
+        assert not telegram.overlapped
+        assert box.depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_a_held_back_chat_does_not_block_other_chats():
+    async def scenario():
+        box, telegram = outbox(chat_rate=2, chat_burst=1), FakeTelegram()
+        box.start()
+        started = time.monotonic()
+        slow = asyncio.gather(send(box, telegram, 1, "first"), send(box, telegram, 1, "second"))
+        await asyncio.sleep(0.05)
+        await send(box, telegram, 2, "other chat")
+        assert time.monotonic() - started < 0.3
+        assert telegram.sent == [(1, "first"), (2, "other chat")]
+
+        await slow
+        # The chat's own bucket spaced its second message by 1 / chat_rate
+        assert telegram.attempts[2][2] - telegram.attempts[0][2] >= 0.45
+        await box.close()
+
+    asyncio.run(scenario())
+
+
+def test_global_bucket_paces_every_chat():
+    async def scenario():
+        box, telegram = outbox(bucket=TokenBucket(20, 1)), FakeTelegram()
+        box.start()
+        started = time.monotonic()
+        await asyncio.gather(*[send(box, telegram, chat_id, "hello") for chat_id in range(1, 6)])
+        await box.close()
+        # One token up front, then one every 1/20 s for the other four
+        assert time.monotonic() - started >= 0.18
+        assert len(telegram.sent) == 5
+
+    asyncio.run(scenario())
+
+
+def test_urgent_messages_overtake_bulk_ones():
+    async def scenario():
+        bucket = TokenBucket(10, 1)
+        box, telegram = outbox(bucket=bucket), FakeTelegram()
+        await bucket.acquire()  # empty the bucket so everything below queues
+        box.start()
+        bulk = [asyncio.create_task(send(box, telegram, chat_id, "broadcast", BULK)) for chat_id in range(1, 4)]
+        await asyncio.sleep(0)
+        await send(box, telegram, 100, "reply")
+        await asyncio.gather(*bulk)
+        await box.close()
+        assert telegram.sent[0] == (100, "reply")
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_requeues_at_the_head_of_the_lane():
+    async def scenario():
+        box, telegram = outbox(), FakeTelegram()
+        telegram.fail("first", retry_after("first", 0))
+        box.start()
+        results = await asyncio.gather(send(box, telegram, 1, "first"), send(box, telegram, 1, "second"))
+        await box.close()
+        assert results == ["sent first", "sent second"]
+        assert [text for _, text, _ in telegram.attempts] == ["first", "first", "second"]
+        assert box.stats["retried"] == 1
+        assert not box.dead_letters
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_pauses_the_global_bucket():
+    async def scenario():
+        box, telegram = outbox(), FakeTelegram()
+        telegram.fail("flooded", retry_after("flooded", 1))
+        box.start()
+        flooded = asyncio.create_task(send(box, telegram, 1, "flooded"))
+        await asyncio.sleep(0.05)
+        await send(box, telegram, 2, "other chat")
+        assert await flooded == "sent flooded"
+        await box.close()
+
+        failed_at = telegram.attempts[0][2]
+        assert all(at - failed_at >= 0.9 for _, _, at in telegram.attempts[1:])
+
+    asyncio.run(scenario())
+
+
+def test_dead_letter_after_max_attempts():
+    async def scenario():
+        box, telegram = outbox(max_attempts=2), FakeTelegram()
+        telegram.fail("doomed", retry_after("doomed", 0), retry_after("doomed", 0))
+        box.start()
+        with pytest.raises(TelegramRetryAfter):
+            await send(box, telegram, 1, "doomed")
+        assert await send(box, telegram, 1, "next") == "sent next"
+        await box.close()
+        assert box.stats["dead"] == 1
+        assert box.dead_letters[0]["chat_id"] == 1
+        assert box.dead_letters[0]["attempts"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_rejected_messages_fail_without_retry():
+    async def scenario():
+        box, telegram = outbox(), FakeTelegram()
+        telegram.fail("bad", TelegramBadRequest(SendMessage(chat_id=1, text="bad"), "chat not found"))
+        box.start()
+        with pytest.raises(TelegramBadRequest):
+            await send(box, telegram, 1, "bad")
+        await box.close()
+        assert len(telegram.attempts) == 1
+        assert box.stats["retried"] == 0 and box.stats["dead"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_not_started_sends_directly():
+    async def scenario():
+        box, telegram = outbox(), FakeTelegram()
+        assert await send(box, telegram, 1, "direct") == "sent direct"
+        assert box.stats["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_edits_are_not_retried_but_still_pause_the_chat():
+    async def scenario():
+        box, telegram = outbox(), FakeTelegram()
+        telegram.fail("edited", retry_after("edited", 1))
+        box.start()
+        with pytest.raises(TelegramRetryAfter):
+            await box.send(telegram, None, SendMessage(chat_id=1, text="edited"), retry=False)
+        started = time.monotonic()
+        assert await send(box, telegram, 1, "next") == "sent next"
+        await box.close()
+        assert time.monotonic() - started >= 0.9
+        assert [text for _, text, _ in telegram.attempts] == ["edited", "next"]
+        assert box.stats["failed"] == 1
+        assert box.stats["retried"] == 0 and not box.dead_letters
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("method, routed", [
+    (SendMessage(chat_id=1, text="hi"), {"priority": None, "retry": True}),
+    (CopyMessage(chat_id=1, from_chat_id=2, message_id=3), {"priority": None, "retry": True}),
+    (SendChatAction(chat_id=1, action="typing"), None),
+    (EditMessageText(chat_id=1, message_id=3, text="edited"), {"priority": INTERACTIVE, "retry": False}),
+    (EditMessageReplyMarkup(chat_id=1, message_id=3), {"priority": INTERACTIVE, "retry": False}),
+])
+def test_middleware_routes_sends_and_edits(method, routed):
+    class Box:
+        routed = None
+
+        async def send(self, make_request, bot, method, priority=None, retry=True):
+            self.routed = {"priority": priority, "retry": retry}
+            return await make_request(bot, method)
+
+    async def make_request(bot, method):
+        return "ok"
+
+    box = Box()
+    assert asyncio.run(OutboxMiddleware(box)(make_request, None, method)) == "ok"
+    assert box.routed == routed
+
+
+def test_edits_from_a_bulk_task_overtake_bulk_sends():
+    async def scenario():
+        bucket = TokenBucket(10, 1)
+        box, telegram = outbox(bucket=bucket), FakeTelegram()
+        await bucket.acquire()  # empty the bucket so everything below queues
+        box.start()
+        bulk = [asyncio.create_task(send(box, telegram, chat_id, "broadcast", BULK)) for chat_id in range(1, 4)]
+        await asyncio.sleep(0)
+        # A broadcast's progress report is edited from the BULK task itself
+        Outbox.use_priority(BULK)
+        await OutboxMiddleware(box)(telegram, None, EditMessageText(chat_id=100, message_id=3, text="50%"))
+        await asyncio.gather(*bulk)
+        await box.close()
+        assert telegram.sent[0] == (100, "50%")
+
+    asyncio.run(scenario())
@@ -0,0 +1,172 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import persistence
+from models import Transaction
+from persistence import Store
+
+
+class FakeDatabase:
+    """Stands in for db.write_batch: keeps the rows it accepts and rejects on cue"""
+
+    def __init__(self):
+        self.rows = {}
+        self.down = False
+        self.rejects = lambda batch: False
+        self.tables = {"users": [], "purchases": [], "transactions": []}
+        self.state = {"pending_payments": [], "promo_codes": [], "scheduled_tasks": []}
+        self.broken = None
+
+    async def load_state(self):
+        return self.state
+
+    async def _stream(self, table):
+        for row in self.tables[table]:
+            if table == self.broken:
+                raise ConnectionError("connection lost")
+            yield row
+
+    def iter_users(self):
+        return self._stream("users")
+
+    def iter_purchases(self):
+        return self._stream("purchases")
+
+    def iter_transactions(self):
+        return self._stream("transactions")
+
+    async def write_batch(self, batch):
+        if self.down or self.rejects(batch):
+            return False
+        for key, rows in batch.items():
+            self.rows.setdefault(key, []).extend(rows)
+        return True
+
+    def written(self, key):
+        return sorted(row[0] for row in self.rows.get(key, []))
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(persistence, "db", database)
+    return database
+
+
+def transaction(transaction_id, **values):
+    return Transaction(dict({"transaction_id": transaction_id, "user_id": 1, "amount": "10",
+                             "status": "pending"}, **values))
+
+
+def store_with(*transactions, max_failures=3):
+    store = Store(max_failures=max_failures)
+    for item in transactions:
+        store.transactions.append(item)
+        store.mark_transaction(item)
+    return store
+
+
+def test_flush_writes_one_batch(fake_db):
+    store = store_with(transaction("T1"), transaction("T2"))
+    assert asyncio.run(store.flush())
+    assert fake_db.written("transactions") == ["T1", "T2"]
+    assert store.pending_writes == 0
+    assert store.stats["flushes"] == 1
+
+
+def test_unserializable_record_is_dead_lettered_and_the_rest_written(fake_db):
+    broken = Transaction({"transaction_id": "T2", "amount": "10"})  # no user_id
+    store = store_with(transaction("T1"), broken, transaction("T3"))
+    assert asyncio.run(store.flush())
+    assert fake_db.written("transactions") == ["T1", "T3"]
+    assert store.pending_writes == 0
+    assert [(entry["kind"], entry["key"]) for entry in store.dead_letters] == [("transactions", "T2")]
+
+
+def test_rejected_record_is_isolated_after_max_failures(fake_db):
+    fake_db.rejects = lambda batch: any(row[0] == "T2" for row in batch.get("transactions", []))
+    store = store_with(transaction("T1"), transaction("T2"), transaction("T3"), max_failures=2)
+
+    async def scenario():
+        # The first failure keeps the whole batch for the next flush
+        assert not await store.flush()
+        assert store.pending_writes == 3
+        assert not fake_db.rows
+        # The second writes record by record and dead-letters the one rejected
+        assert await store.flush()
+        assert store.pending_writes == 0
+        # Later writes are no longer held up
+        store.transactions.append(transaction("T4"))
+        store.mark_transaction(store.transactions[-1])
+        assert await store.flush()
+
+    asyncio.run(scenario())
+    assert fake_db.written("transactions") == ["T1", "T3", "T4"]
+    assert [entry["key"] for entry in store.dead_letters] == ["T2"]
+    assert store.stats["dead"] == 1
+
+
+def test_database_outage_keeps_everything(fake_db):
+    fake_db.down = True
+    store = store_with(transaction("T1"), transaction("T2"), max_failures=1)
+    store.add_feedback(1, "great", "2024-01-01T12:00:00")
+
+    async def scenario():
+        for _ in range(3):
+            assert not await store.flush()
+        assert store.pending_writes == 3
+        assert not store.dead_letters
+
+        fake_db.down = False
+        assert await store.flush()
+
+    asyncio.run(scenario())
+    assert fake_db.written("transactions") == ["T1", "T2"]
+    assert fake_db.written("feedback") == [1]
+    assert store.pending_writes == 0
+
+
+def loaded_tables(fake_db):
+    fake_db.tables["users"] = [
+        {"user_id": 1, "username": "alice", "first_name": "Alice", "joined_date": datetime(2024, 1, 1),
+         "language": "en", "active_promos": []},
+        {"user_id": 2, "username": None, "first_name": "Bob", "joined_date": datetime(2024, 1, 2),
+         "language": None, "active_promos": None},
+    ]
+    fake_db.tables["purchases"] = [
+        {"purchase_id": "PUR1", "user_id": 1, "service_type": "group", "price": Decimal("29.99"),
+         "original_price": None, "status": "completed", "date": datetime(2024, 1, 3), "promo_code": None,
+         "discount_amount": None, "expiry_date": None, "renewal_reminder_sent": False,
+         "final_reminder_sent": False, "auto_renew": False, "group_name": "Premium"},
+    ]
+    fake_db.tables["transactions"] = [
+        {"transaction_id": "T1", "user_id": 1, "username": "alice", "service": "group",
+         "amount": Decimal("29.99"), "original_price": None, "discount_amount": None, "payment_method": "upi",
+         "payment_type": "indian", "status": "completed", "created_at": datetime(2024, 1, 3), "promo_code": None},
+    ]
+
+
+def test_load_streams_the_large_tables(fake_db):
+    loaded_tables(fake_db)
+    store = Store()
+    users, transactions = store.users, store.transactions
+    asyncio.run(store.load())
+    # The containers other modules hold are filled in place
+    assert store.users is users and store.transactions is transactions
+    assert store.users[1]["username"] == "alice"
+    assert store.users[2]["username"] == "Bob" and store.users[2]["language"] == "en"
+    assert [purchase["group_name"] for purchase in store.users[1]["purchases"]] == ["Premium"]
+    assert store.users[2]["purchases"] == []
+    assert [transaction["transaction_id"] for transaction in store.transactions] == ["T1"]
+
+
+def test_load_failing_midway_keeps_the_stores_empty(fake_db):
+    loaded_tables(fake_db)
+    fake_db.broken = "transactions"
+    store = Store()
+    asyncio.run(store.load())
+    assert not store.users
+    assert not store.transactions
@@ -0,0 +1,190 @@
+import logging
+from string import Formatter
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from catalog import CatalogSnapshot
+from keyboards import keyboards
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = "en"
+
+# Message templates per language, in str.format syntax. A key missing from a
+# language falls back to the English template.
+TEMPLATES = {
+    "en": {
+        "welcome": "Welcome to our service bot! Choose an option below:",
+        "payment_success": "Your payment was successful!",
+        "payment_pending": "Your payment is pending verification.",
+
+        "offers_header": "\n\n🔥 <b>Limited Time Offers:</b>\n",
+        "offer_line": "• {name}: {discount}% off! Ends {ends}\n",
+
+        "bundle_item_group": "• {group_name} Group ({duration})",
+        "bundle_item_album": "• {name}",
+        "bundle_item_other": "• {service}",
+
+        "order_summary": "Service: {service_type}\nAmount: ${price}",
+        "order_discount": "\nOriginal Price: ${original_price}\nDiscount: ${discount}",
+        "bundle_order_summary": "Bundle: {name}\nAmount: ${price}\n\nIncludes:\n{items}",
+        "payment_instructions": (
+            "<b>Payment Instructions:</b>\n\n"
+            "{details}\n\n"
+            "<b>Order Summary:</b>\n"
+            "{order_summary}\n"
+            "Transaction ID: <code>{transaction_id}</code>\n\n"
+            "<i>After making payment, click 'I've Made the Payment' button and send a screenshot as proof.</i>"
+        ),
+
+        "instructions_group": "You'll receive an invite link to join the group within 24 hours.",
+        "instructions_video_call": "Our agent will contact you to schedule your video call.",
+        "instructions_private_chat": "Our agent will initiate a private chat with you shortly.",
+        "instructions_album": "You'll receive access to the album content within 24 hours.",
+        "instructions_bundle": "You'll receive access to all bundle items within 24 hours.",
+        "instructions_renewal": "Your subscription has been extended. Thank you for renewing!",
+
+        "approved_bundle": (
+            "Your payment for the {name} bundle has been verified and approved.\n\n"
+            "<b>Your bundle includes:</b>\n{items}\n\n{instructions}\n"
+        ),
+        "approved_renewal": "Your subscription renewal has been verified and approved.\nYour subscription has been extended.\n\n",
+        "approved_service": "Your payment for {service_type} has been verified and approved.\n{instructions}\n\n",
+        "payment_approved": (
+            "🎉 <b>Payment Approved!</b>\n\n"
+            "{body}"
+            "Transaction ID: <code>{transaction_id}</code>\n\n"
+            "Thank you for your purchase! If you have any questions, contact @YG_JOIN."
+        ),
+    },
+    "hi": {
+        "welcome": "हमारे सेवा बॉट में आपका स्वागत है! नीचे एक विकल्प चुनें:",
+        "payment_success": "आपका भुगतान सफल रहा!",
+        "payment_pending": "आपका भुगतान सत्यापन के लिए लंबित है।",
+    },
+    "es": {
+        "welcome": "¡Bienvenido a nuestro bot de servicio! Elija una opción a continuación:",
+        "payment_success": "¡Su pago fue exitoso!",
+        "payment_pending": "Su pago está pendiente de verificación.",
+    },
+}
+
+_formatter = Formatter()
+
+
+class Template:
+    """A format string parsed once into literal text and fields"""
+
+    __slots__ = ("source", "_parts", "_static")
+
+    def __init__(self, source: str):
+        self.source = source
+        self._parts = tuple(
+            (literal, field, spec or "")
+            for literal, field, spec, _ in _formatter.parse(source))
+        # Templates without fields render to themselves
+        self._static = source if all(field is None for _, field, _ in self._parts) else None
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        if self._static is not None:
+            return self._static
+        out = []
+        for literal, field, spec in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(format(values[field], spec))
+        return "".join(out)
+
+
+class Texts:
+    """Compiled per-language templates and a cache of rendered fragments
+
+    Templates are compiled once when loaded. Fragments that only change with
+    the catalog, such as the offer banner and bundle item lists, are rendered
+    once per catalog version and reused; loading new templates drops them
+    and the cached keyboards.
+    """
+
+    def __init__(self, templates: Dict[str, Dict[str, str]] = TEMPLATES):
+        self._templates: Dict[str, Dict[str, Template]] = {}
+        self._fragments: Dict[Tuple, str] = {}
+        self._catalog_version: Optional[int] = None
+        self.stats = {"hits": 0, "renders": 0}
+        self.load(templates)
+
+    @property
+    def languages(self) -> Tuple[str, ...]:
+        return tuple(self._templates)
+
+    def load(self, templates: Dict[str, Dict[str, str]]) -> None:
+        """Compile a new set of templates, replacing the current ones"""
+        default = {key: Template(source) for key, source in templates[DEFAULT_LANGUAGE].items()}
+        compiled = {DEFAULT_LANGUAGE: default}
+        for language, sources in templates.items():
+            if language != DEFAULT_LANGUAGE:
+                compiled[language] = {**default, **{key: Template(source) for key, source in sources.items()}}
+
+        self._templates = compiled
+        self._fragments.clear()
+        keyboards.invalidate()
+        logger.info(f"Loaded {len(default)} templates for {len(compiled)} languages")
+
+    def has(self, key: str) -> bool:
+        return key in self._templates[DEFAULT_LANGUAGE]
+
+    def render(self, key: str, language: str = DEFAULT_LANGUAGE, **values: Any) -> str:
+        """Render a template in the given language, falling back to English"""
+        templates = self._templates.get(language) or self._templates[DEFAULT_LANGUAGE]
+        return templates[key].render(values)
+
+    def fragment(self, snapshot: CatalogSnapshot, key: Tuple, build: Callable[[], str]) -> str:
+        """A rendered fragment cached for this catalog version; key must cover every other input"""
+        if snapshot.version != self._catalog_version:
+            self._fragments.clear()
+            self._catalog_version = snapshot.version
+
+        text = self._fragments.get(key)
+        if text is not None:
+            self.stats["hits"] += 1
+            return text
+
+        text = build()
+        self._fragments[key] = text
+        self.stats["renders"] += 1
+        return text
+
+    def offer_banner(self, snapshot: CatalogSnapshot, language: str = DEFAULT_LANGUAGE) -> str:
+        """The limited-time offers appended to the main menu, empty when none are active"""
+        offers = snapshot.active_offers()
+        if not offers:
+            return ""
+
+        def build() -> str:
+            lines = [self.render("offer_line", language, name=offer["name"], discount=offer["discount"],
+                                 ends=offer["expires"].split("T")[0])
+                     for offer in offers]
+            return self.render("offers_header", language) + "".join(lines)
+
+        return self.fragment(snapshot, ("offer_banner", language, tuple(offer["id"] for offer in offers)), build)
+
+    def bundle_items(self, snapshot: CatalogSnapshot, bundle: Mapping[str, Any],
+                     language: str = DEFAULT_LANGUAGE) -> str:
+        """One line per item of a bundle"""
+        def build() -> str:
+            lines = []
+            for item in bundle["items"]:
+                if item["service"] == "group":
+                    lines.append(self.render("bundle_item_group", language,
+                                             group_name=item["group_name"], duration=item["duration"]))
+                elif item["service"] == "album":
+                    lines.append(self.render("bundle_item_album", language, name=item["name"]))
+                else:
+                    lines.append(self.render("bundle_item_other", language,
+                                             service=item["service"].capitalize()))
+            return "\n".join(lines)
+
+        return self.fragment(snapshot, ("bundle_items", language, bundle["id"]), build)
+
+
+# Create a global texts instance
+texts = Texts()
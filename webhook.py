@@ -0,0 +1,149 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+import coldstart
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Webhook settings. BOT_MODE=webhook serves updates over HTTP instead of long
+# polling; WEBHOOK_URL is the public base URL registered with Telegram (leave
+# it empty to test locally by POSTing update JSON to WEBHOOK_PATH).
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Embedded aiohttp server that acknowledges Telegram and queues updates
+
+    The request handler only checks the secret token, parses the body and
+    puts it on a bounded queue, so Telegram gets its 200 straight away. A
+    fixed number of worker tasks feed queued updates to the dispatcher. When
+    the queue is full the handler answers 503 and Telegram retries the update
+    later, which keeps memory bounded under a burst.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS):
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret = secret
+        self.workers = max(1, workers)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"received": 0, "processed": 0, "rejected": 0, "overflow": 0, "failures": 0}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Validate and enqueue one update; never waits for it to be processed"""
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.stats["rejected"] += 1
+            return web.Response(status=401)
+
+        try:
+            update = await request.json(loads=json.loads)
+        except ValueError:
+            self.stats["rejected"] += 1
+            return web.Response(status=400)
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats["overflow"] += 1
+            logger.error(f"Webhook queue full; asking Telegram to retry update {update.get('update_id')}")
+            return web.Response(status=503)
+
+        self.stats["received"] += 1
+        return web.Response(status=200)
+
+    async def health(self, request: web.Request) -> web.Response:
+        """Liveness probe with queue depth and counters"""
+        return web.json_response({"queued": self.queue.qsize(), **self.stats})
+
+    async def _worker(self) -> None:
+        """Feed queued updates to the dispatcher one at a time"""
+        while True:
+            update = await self.queue.get()
+            try:
+                # dispatcher lets updates queued in a user's mailbox reach the error handlers
+                await self.dp.feed_raw_update(self.bot, update, dispatcher=self.dp)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failures"] += 1
+                logger.error(f"Error processing webhook update {update.get('update_id')}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+        """Start the workers and the HTTP listener"""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/healthz", self.health)
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Webhook server listening on {host}:{port}{self.path} with {self.workers} workers")
+
+    async def close(self, drain_timeout: float = 10) -> None:
+        """Stop accepting requests, finish queued updates, then stop the workers"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Dropped {self.queue.qsize()} queued webhook updates on shutdown")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Webhook server closed: {self.stats}")
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Serve updates over a webhook until stopped, mirroring dp.start_polling"""
+    server = WebhookServer(bot, dp)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await server.start()
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types())
+        coldstart.report("webhook listening")
+
+        # Serve until Ctrl+C or SIGTERM, as start_polling does
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        await stop.wait()
+    finally:
+        await server.close()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()